@@ -0,0 +1,237 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+import metrics
+from config import settings
+
+READ, WRITE, AUTH = "read", "write", "auth"
+
+# Paths that are always admitted, so health checks and scraping keep working under overload.
+EXEMPT_PREFIXES = ("/healthcheck", "/metrics")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Streams stay open for minutes and would hold a slot all along; the change feed caps them instead.
+STREAM_PATHS = ("/contacts/changes/stream",)
+
+# How much slower than its long-term average latency may get before the limit shrinks.
+LATENCY_TOLERANCE = 1.5
+# Weight of a new latency sample in the long-term average.
+LONG_WINDOW = 100
+# Fraction of each computed limit change that is applied.
+SMOOTHING = 0.2
+# Multiplicative decrease applied when a request fails with a server error or times out.
+BACKOFF_RATIO = 0.9
+RETRY_AFTER_SECONDS = 1
+
+rejections = metrics.Counter(
+    "admission_rejected_total", "Requests turned away by admission control.", ("route_class", "reason"))
+limit_gauge = metrics.Gauge(
+    "admission_limit", "Current concurrency limit per route class.", ("route_class",))
+in_flight_gauge = metrics.Gauge(
+    "admission_in_flight", "Admitted requests being served per route class.", ("route_class",))
+queued_gauge = metrics.Gauge(
+    "admission_queued", "Requests waiting for admission per route class.", ("route_class",))
+
+
+class Rejected(Exception):
+    """Raised when a request can't be admitted; `reason` is "queue_full" or "timeout"."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdaptiveLimiter:
+    """A concurrency limit that adapts to the latency it observes.
+
+    Latency samples are compared against their long-term average (a gradient
+    in the style of Netflix's concurrency-limits). While latency stays within
+    LATENCY_TOLERANCE of the average the limit grows by about sqrt(limit) per
+    sample; when requests start queueing somewhere downstream (e.g. for a
+    database connection) latency rises and the limit shrinks proportionally.
+    Server errors and timeouts cut it multiplicatively (AIMD).
+
+    Requests above the limit wait in a bounded FIFO queue for at most
+    `queue_timeout` seconds; beyond that they are rejected right away instead
+    of piling up.
+
+    Attributes:
+        name (str): The route class.
+        limit (float): The current concurrency limit.
+        in_flight (int): Admitted requests not finished yet.
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int,
+                 queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.long_rtt = None
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        """Waits for a slot.
+
+        Raises:
+            Rejected: If the queue is full or the wait exceeded queue_timeout.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            rejections.inc(self.name, "queue_full")
+            raise Rejected("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            rejections.inc(self.name, "timeout")
+            raise Rejected("timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the request went away.
+                self.release(None)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, rtt: float, failed: bool = False):
+        """Frees a slot and feeds the request's latency to the limit.
+
+        Args:
+            rtt (float): Seconds until the response started, or None if unknown.
+            failed (bool): Whether the request ended with a server error.
+        """
+        self.in_flight -= 1
+        if failed:
+            self._set_limit(self.limit * BACKOFF_RATIO)
+        elif rtt is not None:
+            self._sample(rtt)
+        self._wake()
+
+    def _sample(self, rtt: float):
+        if self.long_rtt is None:
+            self.long_rtt = rtt
+            return
+        self.long_rtt += (rtt - self.long_rtt) / LONG_WINDOW
+        gradient = max(0.5, min(1.0, LATENCY_TOLERANCE * self.long_rtt / max(rtt, 1e-6)))
+        new_limit = self.limit * gradient
+        # Only grow while the limit is actually in use; an idle limit says nothing about capacity.
+        if gradient == 1.0 and self.in_flight + 1 >= self.limit / 2:
+            new_limit += math.sqrt(self.limit)
+        self._set_limit(self.limit * (1 - SMOOTHING) + new_limit * SMOOTHING)
+
+    def _set_limit(self, limit: float):
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued,
+                "long_rtt": self.long_rtt}
+
+
+def make_limiters() -> dict:
+    """Creates one limiter per route class.
+
+    Auth routes are bound by bcrypt, so their limit starts at the number of
+    hashing workers and can't exceed what the hashing queue accepts.
+    """
+    hashing_capacity = max(1, settings.hash_workers) + settings.hash_queue_size
+    return {
+        READ: AdaptiveLimiter(READ, initial=50, min_limit=5, max_limit=500, queue_size=200, queue_timeout=0.5),
+        WRITE: AdaptiveLimiter(WRITE, initial=20, min_limit=2, max_limit=200, queue_size=100, queue_timeout=1.0),
+        AUTH: AdaptiveLimiter(AUTH, initial=max(1, settings.hash_workers), min_limit=1,
+                              max_limit=hashing_capacity, queue_size=hashing_capacity, queue_timeout=2.0),
+    }
+
+
+def classify(method: str, path: str):
+    """Returns the route class of a request, or None if it is exempt from admission control."""
+    if path.startswith(EXEMPT_PREFIXES) or path in STREAM_PATHS:
+        return None
+    if path.startswith("/auth/"):
+        return AUTH
+    if method in WRITE_METHODS:
+        return WRITE
+    return READ
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying per route class adaptive concurrency limits.
+
+    A request that can't be admitted is answered at once with 503 and
+    Retry-After, before it reaches the database pool or the hashing queue.
+
+    Attributes:
+        limiters (dict): The AdaptiveLimiter of each route class.
+    """
+
+    def __init__(self, app, limiters: dict = None):
+        self.app = app
+        self.limiters = limiters if limiters is not None else shared_limiters
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        limiter = self.limiters[route_class]
+        try:
+            await limiter.acquire()
+        except Rejected:
+            return await self._reject(send)
+
+        started = time.perf_counter()
+        rtt = None
+        failed = True
+
+        async def send_wrapper(message):
+            nonlocal rtt, failed
+            if message["type"] == "http.response.start":
+                rtt = time.perf_counter() - started
+                failed = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            limiter.release(rtt, failed)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Server is overloaded, try again later"}).encode()
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(RETRY_AFTER_SECONDS).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# The limiters of this worker, used by every AdmissionMiddleware not given its own.
+shared_limiters = make_limiters()
+
+
+def update_metrics():
+    """Copies the limiters' state into the admission gauges."""
+    for name, limiter in shared_limiters.items():
+        limit_gauge.set(limiter.limit, name)
+        in_flight_gauge.set(limiter.in_flight, name)
+        queued_gauge.set(limiter.queued, name)
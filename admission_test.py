@@ -0,0 +1,65 @@
+import asyncio
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from admission import AdaptiveLimiter, Rejected, classify, READ, WRITE, AUTH
+
+
+class TestClassify(TestCase):
+  def test_route_classes(self):
+    self.assertEqual(classify("GET", "/contacts/1"), READ)
+    self.assertEqual(classify("PATCH", "/contacts/1"), WRITE)
+    self.assertEqual(classify("POST", "/auth/token"), AUTH)
+    self.assertIsNone(classify("GET", "/healthcheck"))
+    self.assertIsNone(classify("GET", "/metrics"))
+    self.assertIsNone(classify("GET", "/contacts/changes/stream"))
+    self.assertEqual(classify("GET", "/contacts/changes"), READ)
+
+
+class TestAdaptiveLimiter(IsolatedAsyncioTestCase):
+  def limiter(self, **kwargs):
+    options = dict(initial=2, min_limit=1, max_limit=10, queue_size=1, queue_timeout=0.05)
+    options.update(kwargs)
+    return AdaptiveLimiter("test", **options)
+
+  async def test_queue_full_and_timeout(self):
+    limiter = self.limiter()
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    with self.assertRaises(Rejected) as full:
+      await limiter.acquire()
+    self.assertEqual(full.exception.reason, "queue_full")
+    with self.assertRaises(Rejected) as timeout:
+      await waiting
+    self.assertEqual(timeout.exception.reason, "timeout")
+    self.assertEqual(limiter.queued, 0)
+
+  async def test_release_hands_slot_to_waiter(self):
+    limiter = self.limiter(queue_timeout=1.0)
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release(0.01)
+    await waiting
+    self.assertEqual(limiter.in_flight, 2)
+
+  def test_limit_adapts_to_latency(self):
+    limiter = self.limiter(initial=4)
+    limiter.in_flight = 4
+    for _ in range(20):
+      limiter.in_flight += 1
+      limiter.release(0.01)
+    grown = limiter.limit
+    self.assertGreater(grown, 4)
+    for _ in range(20):
+      limiter.in_flight += 1
+      limiter.release(0.1)
+    self.assertLess(limiter.limit, grown)
+
+  def test_failures_back_off(self):
+    limiter = self.limiter(initial=10)
+    limiter.in_flight = 1
+    limiter.release(None, failed=True)
+    self.assertEqual(limiter.limit, 9)
@@ -1,113 +1,120 @@
-from unittest import TestCase
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from .main import ContactInDB, create_user, get_db, CreateUserRequest
-
-# Assuming your models.py defines ContactInDB
-
-class TestCreateUser(TestCase):
-  def setUp(self):
-    # Create a temporary engine for testing
-    self.engine = create_engine('sqlite:///:memory:')
-    # Create all tables based on models
-    # (You might need to modify this line based on your model declaration)
-    ContactInDB.Base.metadata.create_all(self.engine)
-    self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-
-  def tearDown(self):
-    # Drop all tables after each test
-    ContactInDB.Base.metadata.drop_all(self.engine)
-
-  def test_create_user_success(self):
-    # Create a session
-    db = self.SessionLocal()
-    # Define user data
-    user_data = CreateUserRequest(username="test_user", password="test_password")
-
-    # Call the create_user function
-    created_user = create_user(db, user_data)
-
-    # Check if user is created successfully
-    self.assertIsNotNone(created_user)
-    # Check if username matches
-    self.assertEqual(created_user.username, user_data.username)
-
-    # Close the session
-    db.close()
-
-  def test_create_user_duplicate_username(self):
-    # Create a session
-    db = self.SessionLocal()
-    # Define user data
-    user_data = CreateUserRequest(username="test_user", password="test_password")
-
-    # Create a user first
-    create_user(db, user_data)
-
-    # Try creating another user with the same username
-    with self.assertRaises(Exception):  # Replace Exception with specific error type
-      create_user(db, user_data)
-
-    # Close the session
-    db.close()
-
-
-from unittest.mock import patch, MagicMock
-
-# Use MagicMock for your tests here
-
-
-from .main import authenticate_user, get_db
-
-# Assuming your models.py defines ContactInDB
-
-class TestAuthenticateUser(TestCase):
-  def setUp(self):
-    # Patch get_db function to avoid actual database interaction during tests
-    self.get_db_patcher = patch('your_file.get_db')
-    self.get_db_patcher.start()
-
-  def tearDown(self):
-    self.get_db_patcher.stop()
-
-  def test_authenticate_user_success(self):
-    # Mock the database session to return a valid user
-    db_mock = MagicMock()
-    user = ContactInDB(username="test_user", hashed_password="hashed_password")
-    db_mock.query.return_value.first.return_value = user
-    self.get_db_patcher.return_value = db_mock
-
-    # Define user credentials
-    username = "test_user"
-    password = "valid_password"  # Assuming password is validated before hashing
-
-    # Call the authenticate_user function
-    authenticated_user = authenticate_user(username, password, db_mock)
-
-    # Check if user is authenticated successfully
-    self.assertIsNotNone(authenticated_user)
-    self.assertEqual(authenticated_user.username, username)
-
-  def test_authenticate_user_invalid_username(self):
-    # Mock the database session to return None
-    db_mock = MagicMock()
-    db_mock.query.return_value.first.return_value = None
-    self.get_db_patcher.return_value = db_mock
-
-    # Define user credentials
-    username = "invalid_user"
-    password = "valid_password"
-
-    # Call the authenticate_user function
-    authenticated_user = authenticate_user(username, password, db_mock)
-
-    # Check if user is not authenticated
-    self.assertIsNone(authenticated_user)
-
-  def test_authenticate_user_invalid_password(self):
-    # Mock the database session to return a valid user
-    db_mock = MagicMock()
-    user = ContactInDB(username="test_user", hashed_password="hashed_password")
-    db_mock.query.return_value.first.return_value = user
-    self.get
+import re
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import jwt
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import database
+import mailer
+from auth import CreateUserRequest, authenticate_user, create_access_token, create_user, get_current_user, very_token
+from config import settings
+from models import OutboxMessage, User
+from revocation import revocations
+from testing import DatabaseTestCase
+
+
+class AuthTestCase(DatabaseTestCase):
+  async def create(self, username="test_user", password="test_password", email=None):
+    async with self.sessions() as db:
+      await create_user(db, CreateUserRequest(username=username, password=password, email=email))
+
+
+class TestCreateUser(AuthTestCase):
+  async def test_create_user_success(self):
+    await self.create()
+    async with self.sessions() as db:
+      user = await db.scalar(select(User).where(User.username == "test_user"))
+    self.assertIsNotNone(user)
+    self.assertNotEqual(user.hashed_password, "test_password")
+
+  async def test_create_user_duplicate_username(self):
+    await self.create()
+    with self.assertRaises(IntegrityError):
+      await self.create()
+
+
+class TestAuthenticateUser(AuthTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    await self.create()
+
+  async def test_authenticate_user_success(self):
+    async with self.sessions() as db:
+      user = await authenticate_user("test_user", "test_password", db)
+    self.assertEqual(user.username, "test_user")
+
+  async def test_authenticate_user_invalid_username(self):
+    async with self.sessions() as db:
+      self.assertFalse(await authenticate_user("invalid_user", "test_password", db))
+
+  async def test_authenticate_user_invalid_password(self):
+    async with self.sessions() as db:
+      self.assertFalse(await authenticate_user("test_user", "wrong_password", db))
+
+
+class TestAccessToken(AuthTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    # Revocations are read through the application's session factory.
+    patcher = patch.object(database, "SessionLocal", self.sessions)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def test_round_trip(self):
+    token = create_access_token("test_user", 7, timedelta(minutes=5))
+    user = await get_current_user(token)
+    self.assertEqual((user["username"], user["id"]), ("test_user", 7))
+
+  async def test_invalid_token(self):
+    with self.assertRaises(HTTPException) as error:
+      await get_current_user("not a token")
+    self.assertEqual(error.exception.status_code, 401)
+
+  async def test_revoked_token(self):
+    token = create_access_token("test_user", 7, timedelta(minutes=5))
+    user = await get_current_user(token)
+    async with self.sessions() as db:
+      await revocations.revoke_token(db, user["jti"], user["id"], datetime.now(timezone.utc) + timedelta(minutes=5))
+      await db.commit()
+    with self.assertRaises(HTTPException) as error:
+      await get_current_user(token)
+    self.assertEqual(error.exception.status_code, 401)
+
+
+class TestVerificationToken(AuthTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    patcher = patch.object(settings, "verification_secret", "verification-secret")
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def emailed_token(self):
+    await self.create(email="ann@example.com")
+    async with self.sessions() as db:
+      body = await db.scalar(select(OutboxMessage.body))
+    return re.search(r"token=([\w.-]+)", body).group(1)
+
+  async def verify(self, token):
+    async with self.sessions() as db:
+      return await very_token(token, db)
+
+  async def test_emailed_token_identifies_the_user(self):
+    user = await self.verify(await self.emailed_token())
+    self.assertEqual(user.username, "test_user")
+
+  async def test_expired_token_is_rejected(self):
+    with patch.object(mailer, "VERIFICATION_TOKEN_EXPIRE", timedelta(seconds=-1)):
+      token = await self.emailed_token()
+    with self.assertRaises(HTTPException) as error:
+      await self.verify(token)
+    self.assertEqual(error.exception.status_code, 401)
+
+  async def test_token_without_expiry_is_rejected(self):
+    await self.create()
+    token = jwt.encode({"id": 1, "username": "test_user"}, settings.verification_secret, algorithm="HS256")
+    with self.assertRaises(HTTPException) as error:
+      await self.verify(token)
+    self.assertEqual(error.exception.status_code, 401)
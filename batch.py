@@ -0,0 +1,262 @@
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, Response, status
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import select, insert, update, delete, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import birthdays
+import cache
+import changes as change_feed
+import search
+from auth import owner_dependency
+from database import get_db
+from models import Contact, ContactTombstone, derived_columns
+from schemas import ContactCreate, ContactPatch
+from serialization import CONTACT_FIELDS, CONTACT_COLUMNS, contact_rows, encode_row
+
+router = APIRouter(
+    prefix='/contacts',
+    tags=['batch']
+)
+
+# The maximum number of operations accepted in one batch.
+MAX_BATCH_OPERATIONS = 1000
+
+ATOMIC, BEST_EFFORT = "atomic", "best_effort"
+
+# Status of an operation whose payload is invalid.
+INVALID = 422
+# Status of an operation that was valid but not applied because another one failed.
+NOT_APPLIED = status.HTTP_424_FAILED_DEPENDENCY
+
+
+class BatchOperation(BaseModel):
+    """One create, update or delete of a contact.
+
+    Attributes:
+        op (str): "create", "update" or "delete".
+        contact_id (int): The contact to update or delete.
+        version (int): Only apply the update or delete if the contact still has
+            this version (like If-Match).
+        data (dict): The contact for "create" (all fields, see ContactCreate),
+            or the fields to change for "update" (see ContactPatch).
+    """
+    op: Literal["create", "update", "delete"]
+    contact_id: Optional[int] = None
+    version: Optional[int] = None
+    data: Optional[dict] = None
+
+
+class BatchRequest(BaseModel):
+    """A list of operations applied in one transaction.
+
+    Attributes:
+        mode (str): "atomic" applies every operation or none of them;
+            "best_effort" applies the valid ones and reports the others.
+        operations (List[BatchOperation]): Up to MAX_BATCH_OPERATIONS operations.
+    """
+    mode: Literal["atomic", "best_effort"] = ATOMIC
+    operations: List[BatchOperation] = Field(max_length=MAX_BATCH_OPERATIONS)
+
+
+class OperationResult(BaseModel):
+    """The outcome of one operation, in request order.
+
+    Attributes:
+        status (int): An HTTP status: 201 created, 200 updated or deleted, 404
+            missing, 412 version mismatch, 422 invalid, 424 not applied.
+        contact (dict): The contact as stored after a create or update.
+        errors (list): What was wrong with a failed operation.
+    """
+    status: int
+    contact: Optional[dict] = None
+    errors: Optional[list] = None
+
+
+class BatchReport(BaseModel):
+    """The result of a batch.
+
+    Attributes:
+        committed (bool): Whether any change was committed.
+        results (List[OperationResult]): One result per operation.
+    """
+    committed: bool
+    results: List[OperationResult]
+
+
+def _error(status_code: int, message: str) -> OperationResult:
+    return OperationResult(status=status_code, errors=[{"msg": message}])
+
+
+def _validate(operation: BatchOperation):
+    """Validates the payload of an operation.
+
+    Returns:
+        tuple: (values, None) with the column values to write, or (None, OperationResult) on error.
+    """
+    if operation.op != "create" and operation.contact_id is None:
+        return None, _error(INVALID, "contact_id is required")
+    if operation.op == "delete":
+        return {}, None
+    try:
+        if operation.op == "create":
+            values = ContactCreate.model_validate(operation.data or {}).model_dump()
+        else:
+            values = ContactPatch.model_validate(operation.data or {}).model_dump(exclude_unset=True)
+    except ValidationError as e:
+        return None, OperationResult(status=INVALID,
+                                     errors=e.errors(include_url=False, include_context=False))
+    values.update(derived_columns(values))
+    return values, None
+
+
+async def _current_versions(db: AsyncSession, contact_ids, owner_id: int) -> dict:
+    """Reads and locks the contacts an update or delete refers to.
+
+    Returns:
+        dict: The current version of every one of them that exists and
+        belongs to the user, keyed by id.
+    """
+    if not contact_ids:
+        return {}
+    result = await db.execute(
+        select(Contact.contact_id, Contact.version)
+        .where(Contact.owner_id == owner_id, Contact.contact_id.in_(contact_ids))
+        .with_for_update()
+    )
+    return dict(result.all())
+
+
+@router.post("/batch", response_model=BatchReport)
+async def batch_contacts(batch: BatchRequest, response: Response, owner_id: owner_dependency,
+                         db: AsyncSession = Depends(get_db)):
+    """Applies many creates, updates and deletes of the user's contacts in a single transaction.
+
+    Every operation is checked first: payloads are validated, and the rows to
+    update or delete are read (and locked) in one query so that missing
+    contacts and version mismatches are known before anything is written.
+    Operations are checked in request order, so a later operation sees the
+    effect of an earlier one on the same contact. The writes are then issued
+    as one multi-row INSERT ... RETURNING, one executemany UPDATE per set of
+    changed fields and one DELETE with its tombstones, followed by a single
+    commit.
+
+    In atomic mode nothing is written if any operation fails, and the response
+    status is 409. In best-effort mode the failed operations are skipped.
+
+    Args:
+        batch (BatchRequest): The mode and the operations.
+        response (Response): The outgoing response, used to set the status code.
+        owner_id (int): The id of the authenticated user.
+        db (AsyncSession): The database session dependency.
+
+    Returns:
+        BatchReport: Whether the batch was committed and the result of every operation.
+    """
+    operations = batch.operations
+    results = [None] * len(operations)
+    values = [None] * len(operations)
+    for i, operation in enumerate(operations):
+        values[i], results[i] = _validate(operation)
+
+    # Operation i gets change sequence number first_seq + i. They are reserved
+    # before the contacts are locked, the order every writer takes its locks in.
+    first_seq = await change_feed.allocate(db, owner_id, len(operations)) if operations else None
+    targets = {op.contact_id for op, result in zip(operations, results) if op.op != "create" and result is None}
+    versions = await _current_versions(db, targets, owner_id)
+
+    creates, updates, deletes = [], [], []
+    changes = {}
+    for i, operation in enumerate(operations):
+        if results[i] is not None or operation.op == "create":
+            if results[i] is None:
+                creates.append(i)
+            continue
+        current = versions.get(operation.contact_id)
+        if current is None:
+            results[i] = _error(status.HTTP_404_NOT_FOUND, "Contact not found")
+        elif operation.version is not None and operation.version != current:
+            results[i] = _error(status.HTTP_412_PRECONDITION_FAILED, f"Contact is at version {current}")
+        elif operation.op == "delete":
+            versions[operation.contact_id] = None
+            changes.pop(operation.contact_id, None)
+            deletes.append(i)
+        else:
+            versions[operation.contact_id] = current + 1
+            # Several updates of one contact are merged into one, later fields winning.
+            changes[operation.contact_id] = dict(changes.get(operation.contact_id, {}), **values[i],
+                                                 change_seq=first_seq + i)
+            updates.append(i)
+
+    failed = any(result is not None for result in results)
+    if failed and batch.mode == ATOMIC:
+        await db.rollback()
+        response.status_code = status.HTTP_409_CONFLICT
+        results = [result or OperationResult(status=NOT_APPLIED) for result in results]
+        return BatchReport(committed=False, results=results)
+
+    written = {}
+    if creates:
+        # Multi-row INSERT; rows come back in parameter order.
+        result = await db.execute(
+            insert(Contact).returning(*CONTACT_COLUMNS, sort_by_parameter_order=True),
+            [dict(values[i], owner_id=owner_id, change_seq=first_seq + i) for i in creates],
+        )
+        for i, row in zip(creates, result.all()):
+            results[i] = OperationResult(status=status.HTTP_201_CREATED, contact=dict(zip(CONTACT_FIELDS, row)))
+            written[row.contact_id] = row
+
+    # One executemany UPDATE per set of changed fields. The version is the one
+    # the checks above arrived at, i.e. one more per update of the contact.
+    groups = {}
+    for contact_id, fields in changes.items():
+        groups.setdefault(tuple(sorted(fields)), []).append(contact_id)
+    for fields, contact_ids in groups.items():
+        stmt = (
+            update(Contact)
+            .where(Contact.owner_id == owner_id, Contact.contact_id == bindparam("b_contact_id"))
+            .values(version=bindparam("b_version"), **{field: bindparam(f"b_{field}") for field in fields})
+        )
+        params = [dict({f"b_{field}": changes[contact_id][field] for field in fields},
+                       b_contact_id=contact_id, b_version=versions[contact_id]) for contact_id in contact_ids]
+        connection = await db.connection()
+        await connection.execute(stmt, params)
+
+    if changes:
+        result = await db.execute(contact_rows().where(Contact.owner_id == owner_id,
+                                                       Contact.contact_id.in_(changes)))
+        for row in result:
+            written[row.contact_id] = row
+    deleted_ids = {operations[i].contact_id for i in deletes}
+    if deleted_ids:
+        await db.execute(delete(Contact).where(Contact.owner_id == owner_id,
+                                               Contact.contact_id.in_(deleted_ids)))
+        await db.execute(insert(ContactTombstone), [
+            {"owner_id": owner_id, "contact_id": operations[i].contact_id, "change_seq": first_seq + i}
+            for i in deletes])
+
+    for i in updates:
+        row = written.get(operations[i].contact_id)
+        # A contact updated and then deleted in the same batch has no row to report.
+        results[i] = OperationResult(status=status.HTTP_200_OK,
+                                     contact=dict(zip(CONTACT_FIELDS, row)) if row else None)
+    for i in deletes:
+        results[i] = OperationResult(status=status.HTTP_200_OK)
+
+    changed = bool(creates or updates or deletes)
+    if changed:
+        # These statements bypass the ORM flush, so the index and caches are told directly.
+        for contact_id, row in written.items():
+            if contact_id not in deleted_ids:
+                search.record_change(db, contact_id, (row.first_name, row.last_name, row.email), owner_id)
+        for contact_id in deleted_ids:
+            search.record_change(db, contact_id)
+        birthdays.mark_changed(db)
+        await db.commit()
+        for contact_id, row in written.items():
+            if contact_id not in deleted_ids:
+                await cache.contacts.set((owner_id, contact_id), (row.version, encode_row(row)))
+        for contact_id in deleted_ids:
+            await cache.contacts.invalidate((owner_id, contact_id))
+    return BatchReport(committed=changed, results=results)
@@ -0,0 +1,83 @@
+from fastapi import Response
+from sqlalchemy import select
+
+import cache
+from batch import ATOMIC, BEST_EFFORT, BatchOperation, BatchRequest, batch_contacts
+from models import Contact, ContactTombstone, User
+from testing import DatabaseTestCase
+
+CONTACT = {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+           "phone_number": "555 123 4567", "birthday": "1990-05-17", "additional_info": ""}
+
+
+class TestBatch(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    cache.contacts.clear()
+    async with self.sessions() as db:
+      db.add(User(id=1, username="ann"))
+      db.add_all(Contact(**dict(CONTACT, birthday=None, first_name=name), owner_id=1) for name in ("Bob", "Eve"))
+      await db.commit()
+
+  async def batch(self, mode, *operations):
+    response = Response()
+    async with self.sessions() as db:
+      report = await batch_contacts(BatchRequest(mode=mode, operations=[BatchOperation(**op) for op in operations]),
+                                    response, 1, db)
+    return response.status_code, report
+
+  async def contacts(self):
+    async with self.sessions() as db:
+      result = await db.execute(select(Contact.contact_id, Contact.first_name, Contact.version)
+                                .order_by(Contact.contact_id))
+      return [tuple(row) for row in result]
+
+  async def test_atomic_batch_rolls_back_on_a_version_conflict(self):
+    status_code, report = await self.batch(
+      ATOMIC,
+      {"op": "create", "data": CONTACT},
+      {"op": "update", "contact_id": 1, "version": 1, "data": {"first_name": "Rob"}},
+      {"op": "delete", "contact_id": 2, "version": 7},
+    )
+    self.assertEqual(status_code, 409)
+    self.assertFalse(report.committed)
+    self.assertEqual([result.status for result in report.results], [424, 424, 412])
+    self.assertEqual(await self.contacts(), [(1, "Bob", 1), (2, "Eve", 1)])
+    async with self.sessions() as db:
+      self.assertEqual((await db.get(User, 1)).change_seq, 0)
+
+  async def test_best_effort_batch_applies_the_valid_operations(self):
+    status_code, report = await self.batch(
+      BEST_EFFORT,
+      {"op": "create", "data": CONTACT},
+      {"op": "create", "data": {"first_name": "No email"}},
+      {"op": "update", "contact_id": 1, "version": 1, "data": {"first_name": "Rob"}},
+      {"op": "update", "contact_id": 1, "data": {"last_name": "Stone"}},
+      {"op": "update", "contact_id": 99, "data": {"first_name": "Nobody"}},
+    )
+    self.assertEqual(status_code, 200)
+    self.assertTrue(report.committed)
+    self.assertEqual([result.status for result in report.results], [201, 422, 200, 200, 404])
+    self.assertEqual(report.results[0].contact["first_name"], "Ann")
+    # Both updates of contact 1 are reported with its final state.
+    self.assertEqual(report.results[3].contact["first_name"], "Rob")
+    self.assertEqual(report.results[3].contact["last_name"], "Stone")
+    self.assertEqual(await self.contacts(), [(1, "Rob", 3), (2, "Eve", 1), (3, "Ann", 1)])
+
+  async def test_deletes_leave_tombstones(self):
+    status_code, report = await self.batch(
+      ATOMIC,
+      {"op": "update", "contact_id": 2, "data": {"first_name": "Eva"}},
+      {"op": "delete", "contact_id": 2, "version": 2},
+      {"op": "delete", "contact_id": 1},
+    )
+    self.assertEqual(status_code, 200)
+    self.assertEqual([result.status for result in report.results], [200, 200, 200])
+    # The contact updated and then deleted in the same batch has nothing left to report.
+    self.assertIsNone(report.results[0].contact)
+    self.assertEqual(await self.contacts(), [])
+    async with self.sessions() as db:
+      tombstones = (await db.execute(select(ContactTombstone.contact_id, ContactTombstone.change_seq)
+                                     .order_by(ContactTombstone.contact_id))).all()
+    # Operation i gets change number i + 1.
+    self.assertEqual([tuple(row) for row in tombstones], [(1, 3), (2, 2)])
@@ -0,0 +1,509 @@
+"""Load-test and micro-benchmark suite for the contacts API.
+
+Seeds a local database with a fixed number of generated contacts, then drives
+every route of main.py, auth.py and transfer.py at a fixed concurrency, either
+in-process through httpx's ASGI transport, over a real uvicorn server, or
+both. Throughput and p50/p95/p99 latencies are printed per route and can be
+stored as a baseline; later runs compared against it fail when a route gets
+slower than the allowed threshold.
+
+Usage:
+    python bench.py --size 10k --save-baseline bench_baseline.json
+    python bench.py --size 10k --baseline bench_baseline.json --threshold 0.2
+    python bench.py --database-url postgresql+asyncpg://postgres:pw@localhost/bench --size 1m
+    python bench.py --startup --baseline startup_baseline.json
+
+The database is reused between runs: seeding only tops it up to the requested
+size, so point --database-url at a throwaway database.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import date, timedelta
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///bench.sqlite"
+DEFAULT_CONCURRENCY = 16
+DEFAULT_REQUESTS = 2000
+DEFAULT_THRESHOLD = 0.15
+# Routes that hash passwords run this many times fewer requests.
+HEAVY_DIVISOR = 10
+SEED = 1234
+PASSWORD = "bench-password"
+SERVER_START_TIMEOUT = 30.0
+# Cold starts measured by --startup.
+STARTUP_RUNS = 5
+
+FIRST_NAMES = ("Anna", "Bohdan", "Carla", "Dmytro", "Elena", "Farid", "Greta", "Hiro", "Ines", "Jonas",
+               "Kateryna", "Liam", "Maria", "Nazar", "Olga", "Pavlo", "Quinn", "Rosa", "Sofia", "Taras")
+LAST_NAMES = ("Shevchenko", "Kowalski", "Novak", "Garcia", "Smith", "Tanaka", "Muller", "Rossi",
+              "Bondarenko", "Larsen", "Dubois", "Silva", "Kim", "Horvat", "Petrenko", "Jensen")
+
+
+def fake_contact(rng: random.Random, i: int) -> dict:
+    """Returns a deterministic contact; contact i is the same in every run."""
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        "first_name": first,
+        "last_name": last,
+        "email": f"{first.lower()}.{last.lower()}.{i}@example.com",
+        "phone_number": f"+380{rng.randrange(10**9):09d}",
+        "birthday": (date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))).isoformat(),
+        "additional_info": None,
+    }
+
+
+class Result:
+    """Latencies and errors of one scenario run.
+
+    Attributes:
+        name (str): "<transport>/<scenario>".
+        latencies (List[float]): Seconds per successful request.
+        errors (int): Requests answered with an unexpected status or that failed.
+        elapsed (float): Wall time of the run, in seconds.
+    """
+
+    def __init__(self, name: str, latencies, errors: int, elapsed: float):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return math.nan
+        rank = max(1, math.ceil(p / 100 * len(self.latencies)))
+        return self.latencies[rank - 1]
+
+    def as_dict(self) -> dict:
+        requests = len(self.latencies) + self.errors
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "rps": requests / self.elapsed if self.elapsed else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Scenario:
+    """One route driven by the benchmark.
+
+    Attributes:
+        name (str): The scenario name used in reports and baselines.
+        build (Callable): Takes the BenchContext and returns (method, url, httpx kwargs).
+        expected (tuple): Status codes counted as success.
+        heavy (bool): Whether the route hashes passwords and runs fewer requests.
+        serial (bool): Whether requests must run one at a time, whatever the concurrency.
+    """
+
+    def __init__(self, name: str, build, expected=(200,), heavy: bool = False, serial: bool = False):
+        self.name = name
+        self.build = build
+        self.expected = expected
+        self.heavy = heavy
+        self.serial = serial
+
+
+class BenchContext:
+    """Shared state of a benchmark run: seeded ids, users and created contacts."""
+
+    def __init__(self, contacts: int, users: dict):
+        self.rng = random.Random(SEED)
+        self.contacts = contacts
+        self.users = users
+        self.created = deque()
+        self.sequence = 0
+        self._owner_headers = None
+
+    def contact_id(self) -> int:
+        return self.rng.randint(1, self.contacts)
+
+    def next(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+    def bearer(self, username: str) -> dict:
+        import auth
+        user_id = self.users[username]
+        token = auth.create_access_token(username, user_id, auth.ACCESS_TOKEN_EXPIRE)
+        return {"Authorization": f"Bearer {token}"}
+
+    def owner(self, **headers) -> dict:
+        """Returns `headers` plus the authorization of the user owning the seeded contacts."""
+        if self._owner_headers is None:
+            self._owner_headers = self.bearer("bench")
+        return dict(self._owner_headers, **headers)
+
+
+def _import_body(ctx: BenchContext) -> bytes:
+    start = ctx.next() * 1000
+    rows = (json.dumps(fake_contact(ctx.rng, start + i)) for i in range(100))
+    return ("\n".join(rows) + "\n").encode()
+
+
+def _delete_target(ctx: BenchContext) -> int:
+    # Deletes contacts made by the create scenario; a missing id still exercises the route.
+    return ctx.created.popleft() if ctx.created else ctx.contacts + 10**9
+
+
+def _verification_token(ctx: BenchContext) -> str:
+    import jwt
+    from config import settings
+    return jwt.encode({"id": ctx.users["bench-verify"]}, settings.verification_secret, algorithm="HS256")
+
+
+def scenarios() -> list:
+    """Returns the scenarios in the order they run; delete follows create."""
+    from pagination import encode_cursor
+    return [
+        Scenario("healthcheck", lambda ctx: ("GET", "/healthcheck", {})),
+        Scenario("healthcheck_deep", lambda ctx: ("GET", "/healthcheck", {"params": {"deep": "true"}})),
+        Scenario("healthcheck_pool", lambda ctx: ("GET", "/healthcheck/pool", {})),
+        Scenario("metrics", lambda ctx: ("GET", "/metrics", {})),
+        Scenario("cache_stats", lambda ctx: ("GET", "/cache/stats", {})),
+        Scenario("read_contact", lambda ctx: ("GET", f"/contacts/{ctx.contact_id()}", {"headers": ctx.owner()})),
+        Scenario("list_contacts", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(), "params": {"limit": 100}})),
+        Scenario("list_contacts_columnar", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(Accept="application/vnd.contacts.columnar+json"),
+                                  "params": {"limit": 100}})),
+        Scenario("list_contacts_msgpack", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(Accept="application/msgpack"), "params": {"limit": 100}})),
+        Scenario("list_contacts_cursor", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(),
+                                  "params": {"limit": 100, "cursor": encode_cursor(ctx.contact_id())}})),
+        Scenario("search_prefix", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(),
+                                  "params": {"query": ctx.rng.choice(LAST_NAMES)[:4] + "*", "limit": 50}})),
+        Scenario("search_substring", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(),
+                                  "params": {"query": ctx.rng.choice(LAST_NAMES)[2:6], "limit": 50}})),
+        Scenario("search_email", lambda ctx: (
+            "GET", "/contacts/", {"headers": ctx.owner(),
+                                  "params": {"query": f".{ctx.contact_id()}@example.com", "limit": 50}})),
+        Scenario("upcoming_birthdays", lambda ctx: (
+            "GET", "/contacts/birthday/", {"headers": ctx.owner(), "params": {"days": 7}})),
+        Scenario("create_contact", lambda ctx: (
+            "POST", "/contacts/", {"headers": ctx.owner(),
+                                   "json": fake_contact(ctx.rng, ctx.contacts + ctx.next())})),
+        Scenario("update_contact", lambda ctx: (
+            "PUT", f"/contacts/{ctx.contact_id()}", {"headers": ctx.owner(),
+                                                     "json": fake_contact(ctx.rng, ctx.contact_id())})),
+        Scenario("patch_contact", lambda ctx: (
+            "PATCH", f"/contacts/{ctx.contact_id()}", {"headers": ctx.owner(),
+                                                       "json": {"additional_info": f"note {ctx.next()}"}})),
+        Scenario("batch_mixed", lambda ctx: ("POST", "/contacts/batch", {"headers": ctx.owner(), "json": {
+            "mode": "best_effort", "operations": [
+                *({"op": "create", "data": fake_contact(ctx.rng, ctx.contacts + ctx.next())} for _ in range(50)),
+                *({"op": "update", "contact_id": ctx.contact_id(), "data": {"additional_info": "batch"}}
+                  for _ in range(50)),
+            ]}})),
+        Scenario("delete_contact", lambda ctx: (
+            "DELETE", f"/contacts/{_delete_target(ctx)}", {"headers": ctx.owner()}),
+                 expected=(200, 404)),
+        Scenario("export_month", lambda ctx: (
+            "GET", "/contacts/export", {"headers": ctx.owner(),
+                                        "params": {"format": "ndjson", "birthday_month": ctx.rng.randint(1, 12)}})),
+        Scenario("import_ndjson", lambda ctx: (
+            "POST", "/contacts/import",
+            {"content": _import_body(ctx), "headers": ctx.owner(**{"Content-Type": "application/x-ndjson"})})),
+        Scenario("verification", lambda ctx: ("GET", "/verification", {"params": {"token": _verification_token(ctx)}})),
+        Scenario("create_user", lambda ctx: (
+            "POST", "/auth/", {"json": {"username": f"bench-new-{SEED}-{time.time_ns()}-{ctx.next()}",
+                                        "password": PASSWORD}}),
+                 expected=(201,), heavy=True),
+        Scenario("login", lambda ctx: (
+            "POST", "/auth/token", {"data": {"username": "bench", "password": PASSWORD}}), heavy=True),
+        Scenario("logout", lambda ctx: ("POST", "/auth/logout", {"headers": ctx.bearer("bench")}),
+                 expected=(204,)),
+        Scenario("change_password", lambda ctx: (
+            "POST", "/auth/password", {"headers": ctx.bearer("bench-password"),
+                                       "json": {"old_password": PASSWORD, "new_password": PASSWORD}}),
+                 # Each change revokes the user's tokens issued before it, those of concurrent requests too.
+                 expected=(204,), heavy=True, serial=True),
+    ]
+
+
+async def seed(size: int) -> dict:
+    """Creates the schema and the bench users, and tops the contacts of "bench" up to `size` rows.
+
+    Returns:
+        dict: User ids keyed by username.
+    """
+    import database
+    import hashing
+    import models
+    import transfer
+    from schemas import ContactCreate
+    from sqlalchemy import func, select
+
+    async with database.init_engine().begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+
+    async with database.SessionLocal() as db:
+        usernames = ["bench", "bench-verify", "bench-password"]
+        hashed = await hashing.hash_password(PASSWORD)
+        existing = {user.username: user for user in await db.scalars(
+            select(models.User).where(models.User.username.in_(usernames)))}
+        for username in usernames:
+            user = existing.get(username)
+            if user is None:
+                user = existing[username] = models.User(username=username)
+                db.add(user)
+            user.hashed_password, user.is_verified = hashed, False
+        await db.commit()
+
+        # The seeded contacts all belong to the "bench" user.
+        owner_id = existing["bench"].id
+        count = await db.scalar(select(func.count()).select_from(models.Contact)
+                                .where(models.Contact.owner_id == owner_id))
+        rng = random.Random(SEED)
+        started = time.perf_counter()
+        for start in range(count, size, transfer.IMPORT_CHUNK_SIZE):
+            stop = min(size, start + transfer.IMPORT_CHUNK_SIZE)
+            chunk = [ContactCreate(**fake_contact(rng, i)) for i in range(start, stop)]
+            await transfer.insert_contacts(db, chunk, owner_id)
+            await db.commit()
+        if count < size:
+            print(f"seeded {size - count} contacts in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {username: user.id for username, user in existing.items()}
+
+
+async def run_scenario(client, scenario: Scenario, ctx: BenchContext, transport: str,
+                       requests: int, concurrency: int) -> Result:
+    """Sends `requests` requests for one scenario from `concurrency` concurrent workers."""
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = scenario.build(ctx)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except Exception:
+                errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if response.status_code not in scenario.expected:
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            if scenario.name == "create_contact":
+                ctx.created.append(response.json()["contact_id"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return Result(f"{transport}/{scenario.name}", latencies, errors, time.perf_counter() - started)
+
+
+async def run_suite(client, transport: str, ctx: BenchContext, args) -> list:
+    results = []
+    for scenario in scenarios():
+        if args.only and scenario.name not in args.only:
+            continue
+        requests = max(1, args.requests // HEAVY_DIVISOR) if scenario.heavy else args.requests
+        concurrency = 1 if scenario.serial else args.concurrency
+        # A short warm-up fills caches and the connection pool before measuring.
+        await run_scenario(client, scenario, ctx, transport, min(requests, concurrency), concurrency)
+        result = await run_scenario(client, scenario, ctx, transport, requests, concurrency)
+        print_result(result)
+        results.append(result)
+    return results
+
+
+async def bench_asgi(ctx: BenchContext, args) -> list:
+    """Runs the suite in-process through httpx's ASGI transport."""
+    import httpx
+    from main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_suite(client, "asgi", ctx, args)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int = 1):
+    """Starts server.py in a subprocess."""
+    return subprocess.Popen(
+        [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        env=dict(os.environ), cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+async def wait_until_ready(client, server, poll_interval: float = 0.1):
+    """Polls /healthcheck until the server answers it."""
+    import httpx
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            await client.get("/healthcheck")
+            return
+        except httpx.TransportError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("the server did not start")
+            await asyncio.sleep(poll_interval)
+
+
+async def bench_uvicorn(ctx: BenchContext, args) -> list:
+    """Runs the suite against the uvicorn server of server.py, started in a subprocess."""
+    import httpx
+    port = _free_port()
+    server = start_server(port, args.workers)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as client:
+            await wait_until_ready(client, server)
+            return await run_suite(client, "uvicorn", ctx, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def bench_startup(args) -> list:
+    """Measures cold start times.
+
+    import_main is the time a fresh interpreter takes to import main;
+    first_response is the time from launching server.py until it answers its
+    first health check. Each is repeated STARTUP_RUNS times; the results are regular Results, so
+    they are saved to and compared against a baseline like the routes.
+    """
+    import httpx
+    root = os.path.dirname(os.path.abspath(__file__))
+    probe = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    imports, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(STARTUP_RUNS):
+        done = subprocess.run([sys.executable, "-c", probe], env=dict(os.environ), cwd=root,
+                              capture_output=True, text=True)
+        if done.returncode:
+            errors += 1
+            continue
+        imports.append(float(done.stdout.strip().splitlines()[-1]))
+    results = [Result("startup/import_main", imports, errors, time.perf_counter() - started)]
+
+    ready, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(STARTUP_RUNS):
+        port = _free_port()
+        launched = time.perf_counter()
+        server = start_server(port, args.workers)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+                await wait_until_ready(client, server, poll_interval=0.01)
+            ready.append(time.perf_counter() - launched)
+        except RuntimeError:
+            errors += 1
+        finally:
+            server.terminate()
+            server.wait()
+    results.append(Result("startup/first_response", ready, errors, time.perf_counter() - started))
+    for result in results:
+        print_result(result)
+    return results
+
+
+def print_result(result: Result):
+    stats = result.as_dict()
+    print(f"{result.name:<32} {stats['rps']:>9.1f} req/s  p50 {stats['p50'] * 1000:>8.2f}ms  "
+          f"p95 {stats['p95'] * 1000:>8.2f}ms  p99 {stats['p99'] * 1000:>8.2f}ms  errors {stats['errors']}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Lists the routes that regressed against the baseline.
+
+    A route regresses when its p95 grew, or its throughput dropped, by more
+    than `threshold` (a fraction), or when it had errors the baseline didn't.
+
+    Returns:
+        List[str]: One line per regression.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["p95"] > previous["p95"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95'] * 1000:.2f}ms -> {current['p95'] * 1000:.2f}ms")
+        if current["rps"] < previous["rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['rps']:.1f} -> {current['rps']:.1f} req/s")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--replica-url", action="append", default=[],
+                        help="read replica URL; repeat for several (the bench doesn't seed replicas)")
+    parser.add_argument("--size", choices=SIZES, default="10k", help="number of seeded contacts")
+    parser.add_argument("--transport", choices=("asgi", "uvicorn", "both"), default="both")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="requests per route")
+    parser.add_argument("--only", nargs="*", help="scenario names to run")
+    parser.add_argument("--baseline", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown as a fraction, e.g. 0.15 for 15%%")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the uvicorn server")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure import and server start time instead of the routes")
+    return parser.parse_args(argv)
+
+
+async def main(args) -> int:
+    results = []
+    if args.startup:
+        results += await bench_startup(args)
+    else:
+        ctx = BenchContext(SIZES[args.size], await seed(SIZES[args.size]))
+        if args.transport in ("asgi", "both"):
+            results += await bench_asgi(ctx, args)
+        if args.transport in ("uvicorn", "both"):
+            results += await bench_uvicorn(ctx, args)
+    report = {result.name: result.as_dict() for result in results}
+
+    if args.save_baseline:
+        meta = {"size": args.size, "concurrency": args.concurrency, "requests": args.requests,
+                "workers": args.workers,
+                "database": args.database_url.split(":", 1)[0], "replicas": len(args.replica_url),
+                "python": sys.version.split()[0]}
+        with open(args.save_baseline, "w") as file:
+            json.dump({"meta": meta, "results": report}, file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline["results"], args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    # Settings are read on import, so the database has to be chosen before the app is loaded.
+    os.environ["DATABASE_URL"] = arguments.database_url
+    if arguments.replica_url:
+        os.environ["DATABASE_REPLICA_URLS"] = ",".join(arguments.replica_url)
+    sys.exit(asyncio.run(main(arguments)))
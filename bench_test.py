@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from bench import Result, compare
+
+
+class TestResult(TestCase):
+  def test_percentiles(self):
+    result = Result("asgi/read_contact", [i / 1000 for i in range(100, 0, -1)], errors=0, elapsed=2.0)
+    stats = result.as_dict()
+    self.assertEqual(stats["p50"], 0.05)
+    self.assertEqual(stats["p95"], 0.095)
+    self.assertEqual(stats["p99"], 0.099)
+    self.assertEqual(stats["rps"], 50.0)
+
+
+class TestCompare(TestCase):
+  baseline = {"asgi/read_contact": {"p95": 0.010, "rps": 1000.0, "errors": 0}}
+
+  def test_within_threshold(self):
+    current = {"asgi/read_contact": {"p95": 0.011, "rps": 900.0, "errors": 0}}
+    self.assertEqual(compare(current, self.baseline, 0.15), [])
+
+  def test_regressions(self):
+    current = {"asgi/read_contact": {"p95": 0.012, "rps": 800.0, "errors": 3},
+               "asgi/new_route": {"p95": 1.0, "rps": 1.0, "errors": 0}}
+    regressions = compare(current, self.baseline, 0.15)
+    self.assertEqual(len(regressions), 3)
+    self.assertTrue(all(line.startswith("asgi/read_contact") for line in regressions))
@@ -0,0 +1,120 @@
+import calendar
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import select, or_, case, event
+from sqlalchemy.orm import Session
+
+from cache import LRUCache, ReadThroughCache
+from models import Contact, birthday_key
+
+FEB_28 = 228
+FEB_29 = 229
+
+DEFAULT_WINDOW_DAYS = 7
+MAX_WINDOW_DAYS = 366
+
+# Bounds of the upcoming birthdays cache. Entries hold whole response bodies,
+# hence fewer of them than contacts.
+BIRTHDAY_CACHE_SIZE = 1000
+BIRTHDAY_CACHE_TTL = 30.0
+
+
+def upcoming_key_range(today: date, days: int):
+    """Computes the birthday_key range covering the next `days` days.
+
+    The range wraps around the end of the year when needed. In a non-leap
+    year, people born on February 29th are congratulated on February 28th.
+
+    Args:
+        today (date): The first day of the window.
+        days (int): The number of days after today included in the window.
+
+    Returns:
+        tuple: (start, end) birthday keys, or None if the window covers the whole year.
+    """
+    # today + 365 days always spans every month/day.
+    if days >= 365:
+        return None
+    end_date = today + timedelta(days=days)
+    start, end = birthday_key(today), birthday_key(end_date)
+    if end == FEB_28 and not calendar.isleap(end_date.year):
+        end = FEB_29
+    return start, end
+
+
+def upcoming_birthdays_query(today: date, days: int, owner_id: int):
+    """Builds the SELECT for a user's contacts whose birthday falls within the next `days` days.
+
+    The query is a range scan on the (owner_id, birthday_key) index. Results
+    are ordered by how soon the birthday comes.
+
+    Args:
+        today (date): The first day of the window.
+        days (int): The number of days after today included in the window.
+        owner_id (int): The id of the user whose contacts are selected.
+
+    Returns:
+        Select: The statement selecting the matching contacts.
+    """
+    stmt = select(Contact).where(Contact.owner_id == owner_id, Contact.birthday_key.is_not(None))
+    key_range = upcoming_key_range(today, days)
+    start = birthday_key(today)
+    if key_range is not None:
+        start, end = key_range
+        if start <= end:
+            stmt = stmt.where(Contact.birthday_key.between(start, end))
+        else:
+            stmt = stmt.where(or_(Contact.birthday_key >= start, Contact.birthday_key <= end))
+    # Birthdays later this year come before those after New Year.
+    next_year_first = case((Contact.birthday_key >= start, 0), else_=1)
+    return stmt.order_by(next_year_first, Contact.birthday_key, Contact.contact_id)
+
+
+class BirthdayCache(ReadThroughCache):
+    """Caches upcoming birthday results for a short while.
+
+    Results are keyed by day, owner, window size and media type, so they
+    stop matching at midnight. Every entry is dropped when this worker
+    commits a contact write; writes committed by other workers or by the
+    dedupe CLI are seen once BIRTHDAY_CACHE_TTL has passed.
+
+    Attributes:
+        cleared_at (float): Monotonic time of the last write that cleared the cache.
+    """
+
+    def __init__(self, maxsize: int = BIRTHDAY_CACHE_SIZE, ttl: float = BIRTHDAY_CACHE_TTL):
+        super().__init__(LRUCache(maxsize, ttl))
+        self.cleared_at = float("-inf")
+
+    def clear(self):
+        """Drops every cached result; a load already in flight isn't stored."""
+        super().clear()
+        self.cleared_at = time.monotonic()
+
+
+cache = BirthdayCache()
+
+
+def mark_changed(session):
+    """Clears the cache when the session commits, for contact writes issued as UPDATE or DELETE statements."""
+    session.info["birthdays_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_contacts_changed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Contact):
+            mark_changed(session)
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_cache(session):
+    if session.info.pop("birthdays_changed", False):
+        cache.clear()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_changes(session, previous_transaction):
+    session.info.pop("birthdays_changed", None)
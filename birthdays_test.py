@@ -0,0 +1,79 @@
+from datetime import date
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from birthdays import BirthdayCache, upcoming_key_range
+from models import Contact, birthday_key
+
+
+class TestBirthdayKey(TestCase):
+  def test_key(self):
+    self.assertEqual(birthday_key(date(1990, 12, 31)), 1231)
+    self.assertEqual(birthday_key(date(2000, 2, 29)), 229)
+    self.assertIsNone(birthday_key(None))
+
+  def test_contact_keeps_key_in_sync(self):
+    contact = Contact(first_name="A", birthday=date(1985, 3, 7))
+    self.assertEqual(contact.birthday_key, 307)
+    contact.birthday = None
+    self.assertIsNone(contact.birthday_key)
+
+
+class TestUpcomingKeyRange(TestCase):
+  def test_within_year(self):
+    self.assertEqual(upcoming_key_range(date(2024, 5, 10), 7), (510, 517))
+
+  def test_year_wraparound(self):
+    self.assertEqual(upcoming_key_range(date(2023, 12, 28), 7), (1228, 104))
+
+  def test_feb_29_in_non_leap_year(self):
+    self.assertEqual(upcoming_key_range(date(2023, 2, 21), 7), (221, 229))
+
+  def test_feb_29_in_leap_year(self):
+    self.assertEqual(upcoming_key_range(date(2024, 2, 21), 7), (221, 228))
+    self.assertEqual(upcoming_key_range(date(2024, 2, 25), 7), (225, 303))
+
+  def test_whole_year(self):
+    self.assertIsNone(upcoming_key_range(date(2023, 6, 1), 365))
+    self.assertIsNone(upcoming_key_range(date(2024, 1, 1), 366))
+    self.assertEqual(upcoming_key_range(date(2024, 1, 1), 364), (101, 1230))
+
+
+class TestBirthdayCache(IsolatedAsyncioTestCase):
+  async def load(self):
+    self.loads += 1
+    return ["a"]
+
+  async def asyncSetUp(self):
+    self.loads = 0
+
+  async def test_expires_at_midnight(self):
+    cache = BirthdayCache()
+    await cache.get_or_load((date(2024, 5, 10), 1, 7), self.load)
+    self.assertEqual(await cache.get_or_load((date(2024, 5, 10), 1, 7), self.load), ["a"])
+    self.assertEqual(self.loads, 1)
+    await cache.get_or_load((date(2024, 5, 11), 1, 7), self.load)
+    self.assertEqual(self.loads, 2)
+
+  async def test_is_bounded(self):
+    cache = BirthdayCache(maxsize=2)
+    for owner_id in range(3):
+      await cache.get_or_load((date(2024, 5, 10), owner_id, 7), self.load)
+    self.assertEqual(len(cache.local), 2)
+    self.assertEqual(cache.stats()["evictions"], 1)
+
+  async def test_clear(self):
+    cache = BirthdayCache()
+    await cache.get_or_load((date(2024, 5, 10), 1, 7), self.load)
+    cache.clear()
+    await cache.get_or_load((date(2024, 5, 10), 1, 7), self.load)
+    self.assertEqual(self.loads, 2)
+
+  async def test_load_racing_a_clear_is_not_kept(self):
+    cache = BirthdayCache()
+
+    async def racing_load():
+      cache.clear()
+      return ["stale"]
+
+    self.assertEqual(await cache.get_or_load((date(2024, 5, 10), 1, 7), racing_load), ["stale"])
+    self.assertEqual(len(cache.local), 0)
@@ -0,0 +1,231 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Bounds of the in-process contact cache. The TTL also bounds how long another
+# worker's local copy can stay stale after a write on this worker.
+CONTACT_CACHE_SIZE = 10000
+CONTACT_CACHE_TTL = 30.0
+
+
+class CacheStats:
+    """Counters describing how a cache is performing.
+
+    Attributes:
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that had to load the value.
+        evictions (int): Entries dropped to respect the size bound.
+        expirations (int): Entries dropped because their TTL elapsed.
+        coalesced (int): Misses that waited for a load already in flight.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def as_dict(self) -> dict:
+        """Returns the counters as a dictionary."""
+        return dict(vars(self))
+
+
+class LRUCache:
+    """A size-bounded, least-recently-used cache with per-entry expiry.
+
+    Attributes:
+        maxsize (int): The maximum number of entries.
+        ttl (float): The default time to live of an entry, in seconds.
+        stats (CacheStats): The hit/miss/eviction counters.
+    """
+
+    def __init__(self, maxsize: int = CONTACT_CACHE_SIZE, ttl: float = CONTACT_CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._clock = clock
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if it is missing or expired.
+
+        Hits and misses are counted in stats.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > self._clock():
+                self._data.move_to_end(key)
+                self.stats.hits += 1
+                return value
+            del self._data[key]
+            self.stats.expirations += 1
+        self.stats.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        """Stores a value, evicting the least recently used entries if needed.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl (float, optional): Overrides the default time to live, in seconds.
+        """
+        self._data[key] = (value, self._clock() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def delete(self, key):
+        """Removes key from the cache if it is present."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry."""
+        self._data.clear()
+
+
+class CacheBackend(ABC):
+    """Interface of a cache shared between workers (e.g. Redis or memcached).
+
+    Values are JSON-compatible; implementations are responsible for encoding them.
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        """Returns the stored value, or None."""
+
+    @abstractmethod
+    async def set(self, key, value, ttl: float):
+        """Stores a value for ttl seconds."""
+
+    @abstractmethod
+    async def delete(self, key):
+        """Removes a value."""
+
+
+class MemoryBackend(CacheBackend):
+    """An in-memory CacheBackend, standing in for a shared cache in tests."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._data = {}
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key, value, ttl: float):
+        self._data[key] = (value, self._clock() + ttl)
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+
+class ReadThroughCache:
+    """Two-level read-through cache: a local LRUCache in front of an optional shared backend.
+
+    Concurrent misses on the same key share a single load (single-flight). A
+    load that overlaps with an invalidation is returned to its callers but not
+    stored, so a write can't be overwritten by the stale value it raced with.
+
+    Attributes:
+        local (LRUCache): The in-process cache.
+        backend (CacheBackend): The shared cache, or None.
+    """
+
+    def __init__(self, local: LRUCache, backend: CacheBackend = None):
+        self.local = local
+        self.backend = backend
+        self._inflight = {}
+        self._generation = 0
+
+    async def get_or_load(self, key, loader):
+        """Returns the cached value for key, loading it on a miss.
+
+        Args:
+            key: The cache key.
+            loader: An async callable returning the value, or None if it doesn't exist.
+                None is returned to the caller but never cached.
+
+        Returns:
+            The cached or loaded value.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.local.stats.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request doing the load went away; load it ourselves.
+                return await self.get_or_load(key, loader)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await self.backend.get(key) if self.backend is not None else None
+            from_backend = value is not None
+            if value is None:
+                value = await loader()
+            if value is not None and generation == self._generation:
+                self.local.set(key, value)
+                if self.backend is not None and not from_backend:
+                    await self.backend.set(key, value, self.local.ttl)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def set(self, key, value):
+        """Stores a fresh value after a write, in both levels."""
+        self._generation += 1
+        self.local.set(key, value)
+        if self.backend is not None:
+            await self.backend.set(key, value, self.local.ttl)
+
+    async def invalidate(self, key):
+        """Removes a value from both levels after a write."""
+        self._generation += 1
+        self.local.delete(key)
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+    def clear(self):
+        """Drops every locally cached value."""
+        self._generation += 1
+        self.local.clear()
+
+    def stats(self) -> dict:
+        """Returns the local cache counters together with its current size."""
+        return dict(self.local.stats.as_dict(), size=len(self.local), maxsize=self.local.maxsize)
+
+
+contacts = ReadThroughCache(LRUCache(CONTACT_CACHE_SIZE, CONTACT_CACHE_TTL))
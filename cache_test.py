@@ -0,0 +1,93 @@
+import asyncio
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from cache import LRUCache, MemoryBackend, ReadThroughCache
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+class TestLRUCache(TestCase):
+  def test_hit_and_miss(self):
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    self.assertEqual(cache.get("a"), 1)
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 1))
+
+  def test_evicts_least_recently_used(self):
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual(cache.get("a"), 1)
+    self.assertEqual(cache.stats.evictions, 1)
+
+  def test_expiry(self):
+    clock = FakeClock()
+    cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=30)
+    clock.now = 15
+    self.assertIsNone(cache.get("a"))
+    self.assertEqual(cache.get("b"), 2)
+    self.assertEqual(cache.stats.expirations, 1)
+
+
+class TestReadThroughCache(IsolatedAsyncioTestCase):
+  async def test_concurrent_misses_share_one_load(self):
+    cache = ReadThroughCache(LRUCache(maxsize=10, ttl=10))
+    calls = 0
+
+    async def loader():
+      nonlocal calls
+      calls += 1
+      await asyncio.sleep(0.01)
+      return {"id": 1}
+
+    results = await asyncio.gather(*(cache.get_or_load(1, loader) for _ in range(5)))
+    self.assertEqual(results, [{"id": 1}] * 5)
+    self.assertEqual(calls, 1)
+    self.assertEqual(cache.stats()["coalesced"], 4)
+
+  async def test_missing_value_is_not_cached(self):
+    cache = ReadThroughCache(LRUCache(maxsize=10, ttl=10))
+
+    async def loader():
+      return None
+
+    self.assertIsNone(await cache.get_or_load(1, loader))
+    self.assertEqual(len(cache.local), 0)
+
+  async def test_invalidation_during_load_is_not_overwritten(self):
+    cache = ReadThroughCache(LRUCache(maxsize=10, ttl=10))
+
+    async def loader():
+      await cache.invalidate(1)
+      return {"name": "stale"}
+
+    self.assertEqual(await cache.get_or_load(1, loader), {"name": "stale"})
+    self.assertIsNone(cache.local.get(1))
+
+  async def test_shared_backend(self):
+    backend = MemoryBackend()
+    first = ReadThroughCache(LRUCache(maxsize=10, ttl=10), backend)
+    second = ReadThroughCache(LRUCache(maxsize=10, ttl=10), backend)
+
+    async def loader():
+      return {"name": "db"}
+
+    async def failing_loader():
+      raise AssertionError("should be served by the shared backend")
+
+    await first.get_or_load(1, loader)
+    self.assertEqual(await second.get_or_load(1, failing_loader), {"name": "db"})
+    await first.invalidate(1)
+    self.assertIsNone(await backend.get(1))
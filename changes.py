@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, cast, event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import birthdays
+import database
+import metrics
+from auth import owner_dependency
+from config import settings
+from database import get_read_db
+from models import Contact, ContactTombstone, User
+from serialization import CONTACT_FIELDS, CONTACT_COLUMNS, RawJSONResponse, dumps
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix='/contacts',
+    tags=['changes']
+)
+
+# Postgres channel on which every commit changing contacts sends the owner's id.
+CHANNEL = "contact_changes"
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Changes read per query while a stream catches up.
+STREAM_BATCH_SIZE = 500
+# Seconds between keep-alive comments on an idle stream. The stream also
+# checks the database then, which bounds the delay of changes committed by
+# workers it gets no notification from (e.g. on SQLite).
+HEARTBEAT_INTERVAL = 15.0
+# Seconds after which a stream ends; the client reconnects with Last-Event-ID,
+# presenting its access token again.
+STREAM_LIFETIME = 300.0
+# Milliseconds an EventSource waits before reconnecting.
+RETRY_MILLISECONDS = 2000
+RETRY_AFTER_SECONDS = 1
+# Seconds before listening again after the LISTEN connection is lost, doubled
+# after every failed attempt up to RECONNECT_MAX_DELAY.
+RECONNECT_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+UPSERT, DELETE = "upsert", "delete"
+
+streams_gauge = metrics.Gauge("change_streams", "Open change streams of this worker.")
+
+
+async def allocate(db: AsyncSession, owner_id: int, count: int = 1) -> int:
+    """Reserves `count` consecutive change sequence numbers for one user's contacts.
+
+    The counter is kept on the user's row, so the UPDATE locks that row until
+    the transaction ends. A user's writes therefore commit in sequence order,
+    and a client that has seen sequence n can't miss a later commit with a
+    smaller number. Call it before writing any contact, so that every writer
+    takes the locks in the same order. Unused numbers are simply skipped.
+
+    Args:
+        db (AsyncSession): The session of the write.
+        owner_id (int): The id of the user whose contacts change.
+        count (int): How many numbers to reserve.
+
+    Returns:
+        int: The first reserved number.
+
+    Raises:
+        HTTPException: 401 if the user doesn't exist.
+    """
+    stmt = update(User).where(User.id == owner_id).values(change_seq=User.change_seq + count)
+    if db.bind.dialect.name == "postgresql":
+        # The notification is delivered to the listening workers when the transaction commits.
+        stmt = stmt.returning(User.change_seq, func.pg_notify(CHANNEL, cast(owner_id, String)))
+    else:
+        stmt = stmt.returning(User.change_seq)
+    last = (await db.execute(stmt.execution_options(synchronize_session=False))).scalar()
+    if last is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate user.')
+    db.info.setdefault("changed_owners", set()).add(owner_id)
+    return last - count + 1
+
+
+async def read_changes(db: AsyncSession, owner_id: int, since: int, limit: int):
+    """Reads a user's contact changes made after sequence number `since`.
+
+    A contact changed several times is reported once, at its last change; a
+    deleted contact is reported by its tombstone. Both come from a range scan
+    of an (owner_id, change_seq) index.
+
+    Returns:
+        tuple: (changes, has_more), the changes ordered by sequence number as
+        dicts with seq, op ("upsert" or "delete"), contact_id and contact.
+    """
+    contacts = await db.execute(
+        select(Contact.change_seq, *CONTACT_COLUMNS)
+        .where(Contact.owner_id == owner_id, Contact.change_seq > since)
+        .order_by(Contact.change_seq)
+        .limit(limit + 1)
+    )
+    tombstones = await db.execute(
+        select(ContactTombstone.change_seq, ContactTombstone.contact_id)
+        .where(ContactTombstone.owner_id == owner_id, ContactTombstone.change_seq > since)
+        .order_by(ContactTombstone.change_seq)
+        .limit(limit + 1)
+    )
+    changes = [{"seq": row[0], "op": UPSERT, "contact_id": row.contact_id,
+                "contact": dict(zip(CONTACT_FIELDS, row[1:]))} for row in contacts]
+    changes += [{"seq": seq, "op": DELETE, "contact_id": contact_id, "contact": None}
+                for seq, contact_id in tombstones]
+    changes.sort(key=lambda change: change["seq"])
+    return changes[:limit], len(changes) > limit
+
+
+def encode_event(change: dict) -> bytes:
+    """Encodes a change as a server-sent event whose id is its sequence number."""
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (change["seq"], change["op"].encode(), dumps(change))
+
+
+class ChangeFeed:
+    """Wakes this worker's change streams when their user's contacts change.
+
+    Commits of this worker are published right after they happen (see
+    allocate). On Postgres, start() also listens on CHANNEL for the commits
+    of every other worker and of the dedupe job; each one also drops this
+    worker's birthday cache, which may hold the contacts they changed. If the
+    listening connection is lost, the feed listens again on a new one and
+    wakes every stream, since notifications sent in between were missed.
+
+    Attributes:
+        streams (int): The number of open streams.
+        closed (bool): Whether the streams were told to end.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._listener = None
+        self._engine = None
+        self._reconnecting = None
+        self._loop = None
+        self.streams = 0
+        self.closed = False
+
+    @contextmanager
+    def subscribe(self, owner_id: int):
+        """Registers a stream of a user's changes.
+
+        Yields:
+            asyncio.Event: Set when the user's contacts change or the feed closes.
+        """
+        wakeup = asyncio.Event()
+        self._subscribers.setdefault(owner_id, set()).add(wakeup)
+        self.streams += 1
+        streams_gauge.set(self.streams)
+        try:
+            yield wakeup
+        finally:
+            self.streams -= 1
+            streams_gauge.set(self.streams)
+            subscribers = self._subscribers[owner_id]
+            subscribers.discard(wakeup)
+            if not subscribers:
+                del self._subscribers[owner_id]
+
+    def publish(self, owner_ids):
+        """Wakes the streams of the given users."""
+        for owner_id in owner_ids:
+            for wakeup in self._subscribers.get(owner_id, ()):
+                wakeup.set()
+
+    def _notified(self, connection, pid, channel, payload):
+        birthdays.cache.clear()
+        self.publish((int(payload),))
+
+    async def start(self, engine):
+        """Starts listening for the other workers' commits, where the database supports it."""
+        self._loop = asyncio.get_running_loop()
+        self.closed = False
+        if engine.dialect.name != "postgresql" or self._listener is not None:
+            return
+        self._engine = engine
+        await self._listen()
+
+    async def _listen(self):
+        # A dedicated connection: LISTEN holds on to it for the worker's lifetime.
+        listener = await self._engine.connect()
+        try:
+            raw = await listener.get_raw_connection()
+            await raw.driver_connection.add_listener(CHANNEL, self._notified)
+            raw.driver_connection.add_termination_listener(self._connection_lost)
+        except BaseException:
+            await listener.close()
+            raise
+        self._listener = listener
+
+    def _connection_lost(self, connection):
+        # Also called when stop() closes the connection, after it has forgotten it.
+        if self._listener is None or self._reconnecting is not None:
+            return
+        logger.warning("Lost the connection listening on %s, reconnecting", CHANNEL)
+        self._reconnecting = self._loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        listener, self._listener = self._listener, None
+        try:
+            await listener.invalidate()
+        except Exception:
+            pass
+        delay = RECONNECT_DELAY
+        try:
+            while True:
+                try:
+                    await self._listen()
+                    break
+                except Exception as error:
+                    logger.warning("Listening on %s failed: %r", CHANNEL, error)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            self._reconnecting = None
+        # Commits notified while nobody listened are only found by reading again.
+        birthdays.cache.clear()
+        self.publish(list(self._subscribers))
+
+    def close(self):
+        """Ends every stream, so that they don't hold up a graceful shutdown."""
+        self.closed = True
+        for subscribers in self._subscribers.values():
+            for wakeup in subscribers:
+                wakeup.set()
+
+    def close_soon(self):
+        """Like close(), but safe to call from a signal handler."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.close)
+
+    async def stop(self):
+        self.close()
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            try:
+                await self._reconnecting
+            except asyncio.CancelledError:
+                pass
+            self._reconnecting = None
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await listener.close()
+
+
+feed = ChangeFeed()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    owner_ids = session.info.pop("changed_owners", None)
+    if owner_ids:
+        feed.publish(owner_ids)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_changes(session, previous_transaction):
+    session.info.pop("changed_owners", None)
+
+
+async def stream(owner_id: int, since: int):
+    """Yields a user's changes after `since` as server-sent events, then new ones as they commit."""
+    deadline = time.monotonic() + STREAM_LIFETIME
+    with feed.subscribe(owner_id) as wakeup:
+        yield b"retry: %d\n\n" % RETRY_MILLISECONDS
+        while not feed.closed and time.monotonic() < deadline:
+            # Cleared before reading, so a commit landing during the read wakes the next round.
+            wakeup.clear()
+            # A short session per round: an idle stream holds no connection.
+            async with database.SessionLocal() as db:
+                changes, has_more = await read_changes(db, owner_id, since, STREAM_BATCH_SIZE)
+            if changes:
+                yield b"".join(encode_event(change) for change in changes)
+                since = changes[-1]["seq"]
+            if has_more:
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), max(0.0, min(HEARTBEAT_INTERVAL, deadline - time.monotonic())))
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+
+
+@router.get("/changes")
+async def read_contact_changes(owner_id: owner_dependency, since: int = Query(0, ge=0),
+                               limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                               db: AsyncSession = Depends(get_read_db)):
+    """Returns the changes to the authenticated user's contacts since a sequence number.
+
+    Clients keep a copy in sync by passing the next_since of their last
+    response; since=0 returns every contact. Deleted contacts are reported as
+    "delete" changes. Deletions are remembered indefinitely.
+
+    Args:
+        owner_id (int): The id of the authenticated user.
+        since (int): The sequence number the client has seen.
+        limit (int): The maximum number of changes to return.
+        db (AsyncSession): The database session dependency.
+
+    Returns:
+        dict: changes (ordered by seq), next_since, and has_more if more changes are waiting.
+    """
+    changes, has_more = await read_changes(db, owner_id, since, limit)
+    next_since = changes[-1]["seq"] if changes else since
+    return RawJSONResponse(dumps({"changes": changes, "next_since": next_since, "has_more": has_more}))
+
+
+@router.get("/changes/stream")
+async def stream_contact_changes(owner_id: owner_dependency, since: int = Query(0, ge=0),
+                                 last_event_id: Optional[str] = Header(None)):
+    """Streams changes to the authenticated user's contacts as server-sent events.
+
+    Changes after `since` are sent first, then every change as soon as it is
+    committed. Each event's id is its sequence number, so an EventSource that
+    reconnects resumes where it left off through Last-Event-ID. Streams end
+    after STREAM_LIFETIME seconds and when the worker shuts down.
+
+    Args:
+        owner_id (int): The id of the authenticated user.
+        since (int): The sequence number the client has seen.
+        last_event_id (str, optional): The id of the last event received, sent on reconnect.
+
+    Raises:
+        HTTPException: 503 if the worker already serves max_change_streams streams or is shutting down.
+    """
+    if last_event_id and last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+    if feed.closed or feed.streams >= settings.max_change_streams:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many change streams, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return StreamingResponse(stream(owner_id, since), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
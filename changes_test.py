@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from sqlalchemy import delete
+
+import birthdays
+import changes
+from changes import CHANNEL, ChangeFeed, allocate, encode_event, feed, read_changes
+from models import Contact, ContactTombstone, User
+from testing import DatabaseTestCase
+
+
+class ListenerConnection:
+  """Stands in for a pooled asyncpg connection holding a LISTEN."""
+
+  def __init__(self):
+    self.listeners = {}
+    self.termination_listeners = []
+    self.closed = False
+
+  async def get_raw_connection(self):
+    return SimpleNamespace(driver_connection=self)
+
+  async def add_listener(self, channel, callback):
+    self.listeners[channel] = callback
+
+  def add_termination_listener(self, callback):
+    self.termination_listeners.append(callback)
+
+  def terminate(self):
+    self.closed = True
+    for callback in self.termination_listeners:
+      callback(self)
+
+  async def invalidate(self):
+    self.closed = True
+
+  async def close(self):
+    # asyncpg calls the termination listeners on a regular close as well.
+    self.terminate()
+
+
+class PostgresEngine:
+  """Hands out ListenerConnections, failing the first `failures` attempts."""
+
+  dialect = SimpleNamespace(name="postgresql")
+
+  def __init__(self):
+    self.connections = []
+    self.failures = 0
+
+  async def connect(self):
+    if self.failures:
+      self.failures -= 1
+      raise OSError("connection refused")
+    self.connections.append(ListenerConnection())
+    return self.connections[-1]
+
+
+class TestChanges(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    async with self.sessions() as db:
+      db.add_all([User(id=1, username="one"), User(id=2, username="two")])
+      await db.commit()
+
+  async def add(self, db, owner_id, name):
+    contact = Contact(owner_id=owner_id, first_name=name, last_name="Doe", email=f"{name}@example.com",
+                      phone_number="1", change_seq=await allocate(db, owner_id))
+    db.add(contact)
+    await db.flush()
+    return contact
+
+  async def test_allocate_reserves_consecutive_numbers_per_owner(self):
+    async with self.sessions() as db:
+      self.assertEqual(await allocate(db, 1), 1)
+      self.assertEqual(await allocate(db, 1, 10), 2)
+      self.assertEqual(await allocate(db, 1), 12)
+      self.assertEqual(await allocate(db, 2), 1)
+
+  async def test_delta_reports_latest_changes_and_deletions(self):
+    async with self.sessions() as db:
+      first = await self.add(db, 1, "ann")
+      second = await self.add(db, 1, "bob")
+      await self.add(db, 2, "eve")
+      await db.commit()
+
+      changes, has_more = await read_changes(db, 1, 0, 10)
+      self.assertEqual([(c["seq"], c["op"], c["contact_id"]) for c in changes],
+                       [(1, "upsert", first.contact_id), (2, "upsert", second.contact_id)])
+      self.assertFalse(has_more)
+      self.assertEqual(changes[0]["contact"]["first_name"], "ann")
+
+      first.first_name, first.change_seq = "anne", await allocate(db, 1)
+      seq = await allocate(db, 1)
+      await db.execute(delete(Contact).where(Contact.contact_id == second.contact_id))
+      db.add(ContactTombstone(owner_id=1, contact_id=second.contact_id, change_seq=seq))
+      await db.commit()
+
+      changes, has_more = await read_changes(db, 1, 2, 10)
+      self.assertEqual([(c["seq"], c["op"], c["contact_id"]) for c in changes],
+                       [(3, "upsert", first.contact_id), (4, "delete", second.contact_id)])
+      self.assertEqual(changes[0]["contact"]["first_name"], "anne")
+      self.assertIsNone(changes[1]["contact"])
+
+      changes, has_more = await read_changes(db, 1, 0, 1)
+      self.assertEqual([c["seq"] for c in changes], [3])
+      self.assertTrue(has_more)
+      self.assertEqual(await read_changes(db, 1, 4, 10), ([], False))
+
+  async def test_commit_wakes_the_owners_streams(self):
+    with feed.subscribe(1) as one, feed.subscribe(2) as two:
+      async with self.sessions() as db:
+        await self.add(db, 1, "ann")
+        self.assertFalse(one.is_set())
+        await db.commit()
+      self.assertTrue(one.is_set())
+      self.assertFalse(two.is_set())
+
+      one.clear()
+      async with self.sessions() as db:
+        await self.add(db, 1, "bob")
+        await db.rollback()
+      self.assertFalse(one.is_set())
+
+  async def test_notification_wakes_streams_and_drops_the_birthday_cache(self):
+    changes = ChangeFeed()
+    birthdays.cache.local.set("key", "entry")
+    with changes.subscribe(1) as one, changes.subscribe(2) as two:
+      changes._notified(None, 4242, CHANNEL, "1")
+      self.assertTrue(one.is_set())
+      self.assertFalse(two.is_set())
+    self.assertIsNone(birthdays.cache.local.get("key"))
+
+  async def test_close_ends_streams(self):
+    changes = ChangeFeed()
+    with changes.subscribe(1) as wakeup:
+      self.assertEqual(changes.streams, 1)
+      changes.close()
+      await asyncio.wait_for(wakeup.wait(), 1)
+    self.assertEqual(changes.streams, 0)
+
+  def test_encode_event(self):
+    event = encode_event({"seq": 7, "op": "delete", "contact_id": 3, "contact": None})
+    self.assertTrue(event.startswith(b"id: 7\nevent: delete\ndata: {"))
+    self.assertTrue(event.endswith(b"}\n\n"))
+
+
+class TestListener(IsolatedAsyncioTestCase):
+  async def test_listens_again_after_losing_the_connection(self):
+    engine = PostgresEngine()
+    change_feed = ChangeFeed()
+    await change_feed.start(engine)
+    self.assertIn(CHANNEL, engine.connections[0].listeners)
+    birthdays.cache.local.set("key", "entry")
+
+    engine.failures = 2
+    with patch.object(changes, "RECONNECT_DELAY", 0), change_feed.subscribe(1) as wakeup:
+      engine.connections[0].terminate()
+      await asyncio.wait_for(change_feed._reconnecting, 1)
+      # Notifications may have been missed, so every stream reads again.
+      self.assertTrue(wakeup.is_set())
+    self.assertIsNone(birthdays.cache.local.get("key"))
+    self.assertEqual(len(engine.connections), 2)
+    self.assertIn(CHANNEL, engine.connections[1].listeners)
+
+    await change_feed.stop()
+    self.assertTrue(engine.connections[1].closed)
+    # Closing the connection on purpose doesn't reconnect.
+    self.assertIsNone(change_feed._reconnecting)
+    self.assertEqual(len(engine.connections), 2)
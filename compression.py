@@ -0,0 +1,202 @@
+import re
+import zlib
+from typing import Optional
+
+from config import settings
+from serialization import parse_accept
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it responses are only gzipped.
+    brotli = None
+
+# zlib's default level; higher levels cost much more CPU for a few percent.
+GZIP_LEVEL = 6
+# Brotli's fast range compresses about as quickly as gzip, and smaller. Its
+# default quality, 11, is meant for static files.
+BROTLI_QUALITY = 4
+# Compressed besides text/* and JSON types (application/json, +json, x-ndjson).
+COMPRESSIBLE_TYPES = ("application/msgpack", "application/xml")
+# Events must reach the client as they happen, and proxies tend to buffer compressed streams.
+EVENT_STREAM = "text/event-stream"
+# The suffix a content coding adds to entity tags, e.g. "3-gzip", as sent back in If-Match and If-None-Match.
+_CODED_TAG = re.compile(rb'-(?:gzip|br)"')
+CONDITIONAL_HEADERS = (b"if-match", b"if-none-match")
+
+
+class GzipEncoder:
+    """Compresses one body into gzip, chunk by chunk."""
+
+    coding = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk and flushes it, so the client can decode it before the next one."""
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """Compresses the last chunk and ends the body."""
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    """Compresses one body into brotli, chunk by chunk."""
+
+    coding = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk and flushes it, so the client can decode it before the next one."""
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """Compresses the last chunk and ends the body."""
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def encoders() -> dict:
+    """Returns the encoder classes by content coding, in order of preference."""
+    if brotli is None:
+        return {"gzip": GzipEncoder}
+    return {"br": BrotliEncoder, "gzip": GzipEncoder}
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Picks the content coding of a response from an Accept-Encoding header.
+
+    The coding with the highest q wins, brotli on a tie; q=0 refuses a coding,
+    and * stands for the codings not listed.
+
+    Returns:
+        str: "br" or "gzip", or None to send the body as it is.
+    """
+    choices = {"gzip" if value == "x-gzip" else value: q for value, q in parse_accept(accept_encoding)}
+    best, best_q = None, 0.0
+    for coding in encoders():
+        q = choices.get(coding, choices.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compressible(status: int, headers) -> bool:
+    """Tells whether a response with this status and these raw headers may be compressed."""
+    if status < 200 or status in (204, 304):
+        return False
+    content_type = ""
+    for name, value in headers:
+        name = name.lower()
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value.decode("latin-1").split(";", 1)[0].strip().lower()
+    if content_type == EVENT_STREAM:
+        return False
+    return content_type.startswith("text/") or content_type.endswith("json") or content_type in COMPRESSIBLE_TYPES
+
+
+def coded_etag(tag: bytes, coding: str) -> bytes:
+    """Returns the entity tag of a body compressed with `coding`, e.g. "3" becomes "3-gzip"."""
+    if not tag.endswith(b'"'):
+        return tag
+    return tag[:-1] + b"-" + coding.encode() + b'"'
+
+
+def strip_codings(header: bytes) -> bytes:
+    """Turns the coded entity tags of a conditional header back into the application's tags."""
+    return _CODED_TAG.sub(b'"', header)
+
+
+def _add_vary(headers: list, value: bytes) -> list:
+    for i, (name, current) in enumerate(headers):
+        if name.lower() == b"vary":
+            fields = [field.strip().lower() for field in current.split(b",")]
+            if value.lower() not in fields and b"*" not in fields:
+                headers[i] = (name, current + b", " + value)
+            return headers
+    return headers + [(b"vary", value)]
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing response bodies with brotli or gzip, as Accept-Encoding allows.
+
+    Bodies sent whole and shorter than minimum_size go out as they are: the
+    bytes saved wouldn't pay for the CPU. Streamed bodies are compressed
+    chunk by chunk and flushed after each, so every chunk still reaches the
+    client as soon as it's sent. Event streams and bodies that already have
+    a Content-Encoding are left alone.
+
+    A compressed body is another representation, so its ETag gets the coding
+    as a suffix ("3-gzip") and the response varies on Accept-Encoding; a 304
+    gets the same suffix and Vary. The suffix is taken off the tags of
+    If-Match and If-None-Match before the application sees them, so
+    conditional requests keep working whichever coding the client's copy
+    came in.
+    """
+
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = settings.compress_min_size if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if any(name in CONDITIONAL_HEADERS for name, value in scope["headers"]):
+            # Rewritten in place rather than in a copy: the middlewares around this one
+            # read what the router adds to the scope, such as the matched route.
+            scope["headers"] = [(name, strip_codings(value) if name in CONDITIONAL_HEADERS else value)
+                                for name, value in scope["headers"]]
+        if scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        accept_encoding = b",".join(value for name, value in scope["headers"] if name == b"accept-encoding")
+        coding = choose_encoding(accept_encoding.decode("latin-1"))
+        if coding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        encoder = None
+
+        async def send_wrapper(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first chunk of the body tells whether it is worth compressing.
+                start = message
+                return
+            if start is not None:
+                started, start = start, None
+                headers = list(started.get("headers", []))
+                body, more_body = message.get("body", b""), message.get("more_body", False)
+                if started["status"] == 304:
+                    # The client's copy is the representation it would get now, so the
+                    # 304 carries that representation's ETag and Vary.
+                    headers = [(name, coded_etag(value, coding) if name.lower() == b"etag" else value)
+                               for name, value in headers]
+                    await send(dict(started, headers=_add_vary(headers, b"Accept-Encoding")))
+                    return await send(message)
+                if (message["type"] != "http.response.body" or not compressible(started["status"], headers)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    await send(started)
+                    return await send(message)
+                encoder = encoders()[coding]()
+                headers = [(name, coded_etag(value, coding) if name.lower() == b"etag" else value)
+                           for name, value in headers if name.lower() != b"content-length"]
+                headers = _add_vary(headers + [(b"content-encoding", coding.encode())], b"Accept-Encoding")
+                if more_body:
+                    await send(dict(started, headers=headers))
+                    return await send(dict(message, body=encoder.compress(body)))
+                body = encoder.finish(body)
+                await send(dict(started, headers=headers + [(b"content-length", str(len(body)).encode())]))
+                return await send(dict(message, body=body))
+            if encoder is not None and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if message.get("more_body", False):
+                    message = dict(message, body=encoder.compress(body))
+                else:
+                    message = dict(message, body=encoder.finish(body))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,131 @@
+import gzip
+import zlib
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+import compression
+import metrics
+from compression import CompressionMiddleware, choose_encoding, compressible, strip_codings
+
+BODY = b'{"first_name":"Anna"}' * 100
+
+
+def app(chunks, content_type=b"application/json", headers=()):
+  async def respond(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", content_type), *headers]})
+    for i, chunk in enumerate(chunks):
+      await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+  return respond
+
+
+class TestNegotiation(TestCase):
+  def test_choose_encoding(self):
+    with patch.object(compression, "brotli", None):
+      self.assertEqual(choose_encoding("gzip, deflate, br"), "gzip")
+      self.assertEqual(choose_encoding("x-gzip"), "gzip")
+      self.assertEqual(choose_encoding("*"), "gzip")
+      self.assertIsNone(choose_encoding("gzip;q=0, deflate"))
+      self.assertIsNone(choose_encoding(None))
+    with patch.object(compression, "brotli", object()):
+      self.assertEqual(choose_encoding("gzip, br"), "br")
+      self.assertEqual(choose_encoding("gzip, br;q=0.5"), "gzip")
+
+  def test_compressible(self):
+    self.assertTrue(compressible(200, [(b"content-type", b"application/json")]))
+    self.assertTrue(compressible(200, [(b"Content-Type", b"application/vnd.contacts.columnar+json")]))
+    self.assertTrue(compressible(200, [(b"content-type", b"text/csv; charset=utf-8")]))
+    self.assertFalse(compressible(200, [(b"content-type", b"text/event-stream")]))
+    self.assertFalse(compressible(200, [(b"content-type", b"application/gzip")]))
+    self.assertFalse(compressible(200, [(b"content-type", b"text/plain"), (b"content-encoding", b"gzip")]))
+    self.assertFalse(compressible(304, [(b"content-type", b"application/json")]))
+
+
+class TestMiddleware(IsolatedAsyncioTestCase):
+  async def call(self, inner, accept_encoding=b"gzip", minimum_size=500, headers=()):
+    sent = []
+
+    async def send(message):
+      sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": [(b"accept-encoding", accept_encoding), *headers]}
+    with patch.object(compression, "brotli", None):
+      await CompressionMiddleware(inner, minimum_size)(scope, None, send)
+    headers = dict(sent[0]["headers"])
+    return headers, [message["body"] for message in sent[1:]]
+
+  async def test_whole_body_is_compressed(self):
+    headers, chunks = await self.call(app([BODY], headers=[(b"content-length", b"2100"), (b"vary", b"Accept")]))
+    self.assertEqual(headers[b"content-encoding"], b"gzip")
+    self.assertEqual(headers[b"vary"], b"Accept, Accept-Encoding")
+    self.assertEqual(int(headers[b"content-length"]), len(chunks[0]))
+    self.assertEqual(gzip.decompress(chunks[0]), BODY)
+
+  async def test_small_bodies_and_event_streams_are_left_alone(self):
+    headers, chunks = await self.call(app([b"[]"]))
+    self.assertNotIn(b"content-encoding", headers)
+    self.assertEqual(chunks, [b"[]"])
+    headers, chunks = await self.call(app([BODY, BODY], content_type=b"text/event-stream"))
+    self.assertNotIn(b"content-encoding", headers)
+    headers, chunks = await self.call(app([BODY]), accept_encoding=b"identity")
+    self.assertNotIn(b"content-encoding", headers)
+
+  async def test_streams_are_flushed_chunk_by_chunk(self):
+    headers, chunks = await self.call(app([b"[", BODY, b"]"]))
+    self.assertEqual(headers[b"content-encoding"], b"gzip")
+    self.assertNotIn(b"content-length", headers)
+    decoder = zlib.decompressobj(31)
+    # Every chunk decodes as soon as it arrives.
+    self.assertEqual([decoder.decompress(chunk) for chunk in chunks], [b"[", BODY, b"]"])
+    self.assertTrue(decoder.eof)
+
+  async def test_compressed_bodies_get_their_own_etag(self):
+    tagged = [(b"etag", b'"p2.3.4"')]
+    headers, chunks = await self.call(app([BODY], headers=tagged))
+    self.assertEqual(headers[b"etag"], b'"p2.3.4-gzip"')
+    headers, chunks = await self.call(app([b"[]"], headers=tagged))
+    self.assertEqual(headers[b"etag"], b'"p2.3.4"')
+    headers, chunks = await self.call(app([BODY], headers=[(b"etag", b'W/"7"')]))
+    self.assertEqual(headers[b"etag"], b'W/"7-gzip"')
+
+  async def test_not_modified_carries_the_coded_etag(self):
+    async def inner(scope, receive, send):
+      await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", b'"3"')]})
+      await send({"type": "http.response.body", "body": b""})
+
+    headers, chunks = await self.call(inner, headers=[(b"if-none-match", b'"3-gzip"')])
+    self.assertEqual(headers[b"etag"], b'"3-gzip"')
+    self.assertEqual(headers[b"vary"], b"Accept-Encoding")
+    self.assertNotIn(b"content-encoding", headers)
+    self.assertEqual(chunks, [b""])
+
+  async def test_conditional_headers_reach_the_app_without_the_coding(self):
+    seen = {}
+
+    async def inner(scope, receive, send):
+      seen.update(scope["headers"])
+      await app([b"[]"])(scope, receive, send)
+
+    await self.call(inner, headers=[(b"if-none-match", b'"3-gzip", W/"4-br"'), (b"if-match", b'"3-gzip"')])
+    self.assertEqual(seen[b"if-none-match"], b'"3", W/"4"')
+    self.assertEqual(seen[b"if-match"], b'"3"')
+    self.assertEqual(strip_codings(b'"p1.2.3-msgpack"'), b'"p1.2.3-msgpack"')
+
+
+class TestWithMetrics(IsolatedAsyncioTestCase):
+  async def test_conditional_requests_keep_their_route_label(self):
+    inner = FastAPI()
+
+    @inner.get("/items/{item_id}")
+    async def read_item(item_id: int):
+      return {"item_id": item_id}
+
+    transport = httpx.ASGITransport(app=metrics.MetricsMiddleware(CompressionMiddleware(inner)))
+    before = metrics.http_requests.get("GET", "/items/{item_id}", 200)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+      response = await client.get("/items/1", headers={"If-None-Match": '"1-gzip"'})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(metrics.http_requests.get("GET", "/items/{item_id}", 200), before + 1)
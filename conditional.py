@@ -0,0 +1,79 @@
+import hashlib
+from typing import Optional, Set
+
+from fastapi import Response, status
+
+ETAG_HEADER = "ETag"
+# Contacts are per-user data: browsers may keep them but must revalidate
+# (If-None-Match) before reuse, and shared caches must not store them.
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(version: int) -> str:
+    """Returns the strong entity tag of a contact version, e.g. "3" (quotes included)."""
+    return f'"{version}"'
+
+
+def parse_if_match(header: Optional[str]) -> Optional[Set[int]]:
+    """Parses an If-Match header into the contact versions it accepts.
+
+    If-Match uses strong comparison, so weak tags (W/"3") and tags that aren't
+    contact versions never match.
+
+    Args:
+        header (str, optional): The If-Match header value.
+
+    Returns:
+        Set[int]: The accepted versions (possibly empty), or None when the
+        request is unconditional (no header, or "*").
+    """
+    if header is None or header.strip() == "*":
+        return None
+    versions = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.add(int(tag[1:-1]))
+    return versions
+
+
+def list_etag(count: int, version_sum: int, id_sum: int, variant: str = "") -> str:
+    """Returns the entity tag of a list page from a cheap aggregate of its rows.
+
+    Any update bumps a version, and any insert or delete within the page changes
+    the count or the ids, so the tag changes whenever the page does. `variant`
+    tells the representations of one page apart (see serialization.ETAG_VARIANTS).
+    """
+    return f'"p{count}.{version_sum}.{id_sum}{variant}"'
+
+
+def body_etag(body: bytes) -> str:
+    """Returns a strong entity tag derived from an encoded response body."""
+    return '"b' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def is_not_modified(header: Optional[str], tag: str) -> bool:
+    """Tells whether an If-None-Match header matches an entity tag.
+
+    If-None-Match uses weak comparison, so W/"3" matches "3".
+
+    Args:
+        header (str, optional): The If-None-Match header value.
+        tag (str): The current entity tag.
+
+    Returns:
+        bool: True if the client's copy is current and 304 can be sent.
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == tag:
+            return True
+    return False
+
+
+def not_modified(tag: str, headers: dict = None) -> Response:
+    """Builds an empty 304 Not Modified response for an entity tag, with extra `headers` (e.g. Vary)."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={ETAG_HEADER: tag, "Cache-Control": CACHE_CONTROL, **(headers or {})})
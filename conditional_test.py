@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from conditional import etag, body_etag, is_not_modified, parse_if_match
+
+
+class TestIfMatch(TestCase):
+  def test_unconditional(self):
+    self.assertIsNone(parse_if_match(None))
+    self.assertIsNone(parse_if_match(" * "))
+
+  def test_versions(self):
+    self.assertEqual(parse_if_match(etag(3)), {3})
+    self.assertEqual(parse_if_match('"3", "5"'), {3, 5})
+
+  def test_weak_and_foreign_tags_never_match(self):
+    self.assertEqual(parse_if_match('W/"3", "abc", 4'), set())
+
+
+class TestIfNoneMatch(TestCase):
+  def test_weak_comparison(self):
+    self.assertTrue(is_not_modified('"3"', etag(3)))
+    self.assertTrue(is_not_modified('W/"3"', etag(3)))
+    self.assertTrue(is_not_modified('"1", "3"', etag(3)))
+    self.assertTrue(is_not_modified("*", etag(3)))
+
+  def test_no_match(self):
+    self.assertFalse(is_not_modified(None, etag(3)))
+    self.assertFalse(is_not_modified('"4"', etag(3)))
+
+  def test_body_etag(self):
+    self.assertEqual(body_etag(b"[]"), body_etag(b"[]"))
+    self.assertNotEqual(body_etag(b"[]"), body_etag(b"[1]"))
@@ -0,0 +1,207 @@
+import time
+
+from fastapi import Request
+from sqlalchemy import exc, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+import replicas
+from config import settings
+
+
+class PoolStats:
+    """Connection acquisition statistics of a pool.
+
+    Attributes:
+        acquisitions (int): Connections handed out.
+        timeouts (int): Requests that gave up waiting for a connection.
+        wait_total (float): Total seconds spent acquiring connections.
+        wait_max (float): The longest acquisition, in seconds.
+    """
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self) -> dict:
+        average = self.wait_total / self.acquisitions if self.acquisitions else 0.0
+        return dict(vars(self), wait_avg=average)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The default async queue pool, recording how long connections take to acquire."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        self.stats.acquisitions += 1
+        self.stats.wait_total += waited
+        self.stats.wait_max = max(self.stats.wait_max, waited)
+        return connection
+
+
+def make_engine(url: str):
+    """Creates the async engine used by every router.
+
+    Pool size, overflow, timeout, recycle and pre-ping come from settings.
+    SQLite keeps SQLAlchemy's default pool, which the sizing options don't apply to.
+
+    Args:
+        url (str): The SQLAlchemy database URL.
+
+    Returns:
+        AsyncEngine: The engine.
+    """
+    if url.startswith("sqlite"):
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+
+
+class RoutingSession(Session):
+    """A session reading from the replica it was given and writing to the primary.
+
+    Sessions of read-only routes get a replica in info["replica"] (see
+    get_read_db). Their SELECTs run on that replica until the session flushes
+    or executes an INSERT, UPDATE or DELETE; from then on every statement,
+    reads included, runs on the primary, so the session sees its own writes.
+    Sessions without a replica always use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+        replica = self.info.get("replica")
+        if replica is not None and not self.info.get("wrote"):
+            return replica.engine.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _report_write(session):
+    if session.info.get("wrote"):
+        replicas.note_write()
+
+
+# The engine and session factory of this worker. The engine is created by
+# init_engine() on startup rather than at import, so a master process that
+# preloads the app before forking never opens connections its workers would
+# inherit. asyncpg keeps the event loop free while a query is in flight, so one
+# worker can serve many concurrent requests instead of blocking on each query.
+SQLALCHEMY_DATABASE_URL = settings.database_url
+engine = None
+SessionLocal = async_sessionmaker(class_=AsyncSession, sync_session_class=RoutingSession,
+                                  autoflush=False, expire_on_commit=False)
+
+
+def init_engine(url: str = None, replica_urls=None):
+    """Creates the engines of this process and binds SessionLocal to the primary.
+
+    Does nothing if the engine already exists.
+
+    Args:
+        url (str, optional): The SQLAlchemy database URL (default: settings.database_url).
+        replica_urls (List[str], optional): URLs of read replicas (default: settings.replica_urls).
+
+    Returns:
+        AsyncEngine: The primary engine.
+    """
+    global engine
+    if engine is None:
+        engine = make_engine(url or SQLALCHEMY_DATABASE_URL)
+        SessionLocal.configure(bind=engine)
+        replica_urls = settings.replica_urls if replica_urls is None else replica_urls
+        if replica_urls:
+            replicas.replica_set = replicas.ReplicaSet(
+                [make_engine(replica_url) for replica_url in replica_urls],
+                max_lag=settings.replica_max_lag, eject_seconds=settings.replica_eject_seconds)
+    return engine
+
+
+async def dispose_engine():
+    """Closes the pooled connections of this process and forgets the engines."""
+    global engine
+    if replicas.replica_set is not None:
+        await replicas.replica_set.close()
+        replicas.replica_set = None
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+
+
+async def get_db():
+    """Creates an async database session and yields it for dependency injection.
+
+    Yields:
+        AsyncSession: A session bound to the shared async engine. It is closed
+        once the request is finished.
+    """
+    async with SessionLocal() as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    """Yields a session for a read-only route, reading from a replica when one is usable.
+
+    Clients that wrote within the last read_your_writes_seconds (see
+    replicas.ReadYourWritesMiddleware) read from the primary, as do all
+    clients while no replica is healthy and in sync. Their sessions have
+    info["sticky"] set, telling routes to skip per-worker caches too.
+
+    Yields:
+        AsyncSession: A session routed by RoutingSession. It is closed once
+        the request is finished.
+    """
+    async with SessionLocal() as db:
+        replica_set = replicas.replica_set
+        sticky = db.info["sticky"] = replicas.is_sticky(request.cookies)
+        if replica_set is not None:
+            replica = None if sticky else replica_set.choose()
+            db.info["replica"] = replica
+            replicas.reads.inc(replica.name if replica is not None else "primary")
+        yield db
+
+
+def pool_stats(target=None) -> dict:
+    """Reports the live state of an engine's connection pool.
+
+    Args:
+        target (AsyncEngine, optional): The engine to inspect (default: the shared engine).
+
+    Returns:
+        dict: Pool size, checked-in/checked-out connections, overflow and, when
+        available, acquisition counts and wait times. Only {"pool": None}
+        before the engine is created.
+    """
+    target = target or engine
+    if target is None:
+        return {"pool": None}
+    pool = target.sync_engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats.as_dict())
+    return stats
@@ -0,0 +1,395 @@
+"""Duplicate contact detection and merging.
+
+Contacts are only compared within blocks: groups of one user's contacts that
+share a normalized email (email_key) or phone number (phone_key). A block is
+read in key order from an (owner_id, key) index, so finding candidates costs
+one index scan per key instead of comparing every pair of contacts. Within a
+block, pairs are scored by how alike their names are; pairs scoring at least
+MATCH_THRESHOLD are duplicates, and duplicates of duplicates form a cluster.
+A cluster is merged into its oldest contact.
+
+Run as a job over every user (or some of them):
+    python dedupe.py [--owner ID ...] [--dry-run]
+
+The job first fills in the keys of contacts written before they existed,
+dry runs included. Memory stays bounded by the largest block and the
+duplicates of one user.
+
+Running API workers see the merges as follows. On Postgres, each merge is
+announced on the change feed (see changes.allocate), which wakes change
+streams and drops the workers' birthday caches. Contact caches pick up merged
+contacts within their TTL, and without the feed, so do birthday caches. The
+in-process search index used on SQLite is never told: restart the workers
+after a run there.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from difflib import SequenceMatcher
+from types import SimpleNamespace
+
+from sqlalchemy import bindparam, delete, insert, or_, select, update
+
+import birthdays
+import cache
+import changes
+import database
+import search
+from models import Contact, ContactTombstone, User, derived_columns
+from serialization import CONTACT_FIELDS, CONTACT_COLUMNS, contact_rows, encode_row
+
+logger = logging.getLogger("dedupe")
+
+# The blocking keys, and how much sharing one counts towards a pair's score;
+# the rest of the score is the similarity of the names.
+KEY_WEIGHTS = {"email_key": 0.6, "phone_key": 0.5}
+# Pairs scoring at least this are duplicates: names at least about 62% alike
+# with the same email, or 70% alike with the same phone number (see name_similarity()).
+MATCH_THRESHOLD = 0.85
+# Larger blocks (an office switchboard, a placeholder address) are skipped:
+# comparing within a block is quadratic, and such blocks rarely hold duplicates.
+MAX_BLOCK_SIZE = 50
+# Rows fetched per round trip while scanning blocks.
+SCAN_BATCH_SIZE = 5000
+# Clusters merged per transaction.
+MERGE_BATCH_SIZE = 100
+# Users read per query while the job walks through them.
+OWNER_BATCH_SIZE = 500
+# Contacts given their keys per transaction by backfill_keys().
+BACKFILL_BATCH_SIZE = 5000
+
+# Fields a merge fills in from the duplicates when the oldest contact lacks them.
+MERGED_FIELDS = ("first_name", "last_name", "email", "phone_number", "birthday")
+
+# Response header of create_contact listing the ids of the contacts a new one duplicates.
+DUPLICATES_HEADER = "X-Duplicate-Of"
+
+
+def _words(first_name, last_name) -> list:
+    return f"{first_name or ''} {last_name or ''}".lower().split()
+
+
+def name_similarity(first_a, last_a, first_b, last_b) -> float:
+    """Compares two names word by word, ignoring case, spacing and word order.
+
+    Every word of the shorter name is paired with the most similar word of
+    the other; the least similar pair decides. So "Jon Smith" is close to
+    "John Smith", while "Anna Smith" is not, despite the shared surname.
+
+    Returns:
+        float: 1.0 for the same name down to 0.0 for nothing in common; 0.0 if either name is empty.
+    """
+    a, b = _words(first_a, last_a), _words(first_b, last_b)
+    if not a or not b:
+        return 0.0
+    shorter, longer = sorted((a, b), key=len)
+    return min(max(SequenceMatcher(None, word, other).ratio() for other in longer) for word in shorter)
+
+
+def score(key: str, a, b) -> float:
+    """Scores two contacts sharing the blocking key `key`.
+
+    Args:
+        key (str): "email_key" or "phone_key".
+        a, b: Rows or objects with first_name and last_name.
+    """
+    weight = KEY_WEIGHTS[key]
+    return weight + (1 - weight) * name_similarity(a.first_name, a.last_name, b.first_name, b.last_name)
+
+
+class Clusters:
+    """Groups contacts linked by duplicate pairs (a union-find).
+
+    Each cluster is rooted at its smallest, i.e. oldest, contact id.
+    """
+
+    def __init__(self):
+        self._parent = {}
+
+    def find(self, contact_id: int) -> int:
+        parent = self._parent.setdefault(contact_id, contact_id)
+        while parent != contact_id:
+            grandparent = self._parent[parent]
+            self._parent[contact_id] = grandparent
+            contact_id, parent = parent, grandparent
+        return contact_id
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self._parent[max(a, b)] = min(a, b)
+
+    def groups(self) -> list:
+        """Returns the clusters as lists of ids, oldest first, ordered by their oldest id."""
+        groups = {}
+        for contact_id in self._parent:
+            groups.setdefault(self.find(contact_id), []).append(contact_id)
+        return [sorted(group) for root, group in sorted(groups.items()) if len(group) > 1]
+
+
+def _match_block(key: str, block: list, clusters: Clusters):
+    if len(block) < 2 or len(block) > MAX_BLOCK_SIZE:
+        return
+    for i, a in enumerate(block):
+        for b in block[i + 1:]:
+            if score(key, a, b) >= MATCH_THRESHOLD:
+                clusters.union(a.contact_id, b.contact_id)
+
+
+async def find_duplicates(db, owner_id: int) -> list:
+    """Finds the clusters of duplicates among a user's contacts.
+
+    Each blocking key is read in key order from its index through a
+    server-side cursor; only the current block is held in memory.
+
+    Args:
+        db (AsyncSession): The database session.
+        owner_id (int): The id of the user whose contacts are checked.
+
+    Returns:
+        list: The clusters, as lists of contact ids ordered oldest first.
+    """
+    clusters = Clusters()
+    for key in KEY_WEIGHTS:
+        column = getattr(Contact, key)
+        stmt = (select(column, Contact.contact_id, Contact.first_name, Contact.last_name)
+                .where(Contact.owner_id == owner_id, column.is_not(None))
+                .order_by(column, Contact.contact_id))
+        result = await db.stream(stmt.execution_options(yield_per=SCAN_BATCH_SIZE))
+        block, block_key = [], None
+        async for row in result:
+            if row[0] != block_key:
+                _match_block(key, block, clusters)
+                block, block_key = [], row[0]
+            # An oversized block is skipped anyway; stop collecting it.
+            if len(block) <= MAX_BLOCK_SIZE:
+                block.append(row)
+        _match_block(key, block, clusters)
+    return clusters.groups()
+
+
+async def find_matches(db, owner_id: int, values: dict) -> list:
+    """Finds the existing contacts that a new one would duplicate.
+
+    Uses the same blocking indexes and scoring as find_duplicates(); at most
+    MAX_BLOCK_SIZE candidates are scored.
+
+    Args:
+        db (AsyncSession): The database session.
+        owner_id (int): The id of the user the contact is created for.
+        values (dict): The new contact's fields.
+
+    Returns:
+        list: The ids of the duplicated contacts, best match first.
+    """
+    keys = derived_columns(values)
+    shared = [key for key in KEY_WEIGHTS if keys.get(key)]
+    if not shared:
+        return []
+    result = await db.execute(
+        select(Contact.contact_id, Contact.first_name, Contact.last_name, *(getattr(Contact, key) for key in shared))
+        .where(Contact.owner_id == owner_id, or_(*(getattr(Contact, key) == keys[key] for key in shared)))
+        .limit(MAX_BLOCK_SIZE)
+    )
+    new = SimpleNamespace(first_name=values.get("first_name"), last_name=values.get("last_name"))
+    scored = []
+    for row in result:
+        best = max(score(key, row, new) for key in shared if getattr(row, key) == keys[key])
+        if best >= MATCH_THRESHOLD:
+            scored.append((-best, row.contact_id))
+    return [contact_id for _, contact_id in sorted(scored)]
+
+
+def merged_values(contacts: list) -> dict:
+    """Combines duplicates into the changes to make to the first of them.
+
+    Fields the first contact lacks are taken from the first duplicate that
+    has them; the distinct additional_info notes of all of them are kept.
+
+    Args:
+        contacts (list): The duplicates as dicts of their fields, the one to keep first.
+
+    Returns:
+        dict: The fields of the kept contact that change.
+    """
+    kept = contacts[0]
+    values = {}
+    for field in MERGED_FIELDS:
+        if kept.get(field) in (None, ""):
+            value = next((contact[field] for contact in contacts[1:] if contact.get(field) not in (None, "")), None)
+            if value is not None:
+                values[field] = value
+    notes = []
+    for contact in contacts:
+        note = contact.get("additional_info")
+        if note and note not in notes:
+            notes.append(note)
+    if "\n".join(notes) != (kept.get("additional_info") or ""):
+        values["additional_info"] = "\n".join(notes)
+    return values
+
+
+async def merge_duplicates(db, owner_id: int, clusters: list) -> int:
+    """Merges clusters of a user's duplicates in one transaction and commits it.
+
+    Each cluster is merged into its oldest contact, which gets the values of
+    merged_values(); the others are deleted, leaving tombstones. Contacts
+    changed or deleted since the clusters were found are merged as they are
+    now; a cluster with a single contact left is skipped.
+
+    Args:
+        db (AsyncSession): The database session.
+        owner_id (int): The id of the user the contacts belong to.
+        clusters (list): The clusters, as returned by find_duplicates().
+
+    Returns:
+        int: The number of contacts deleted.
+    """
+    ids = [contact_id for cluster in clusters for contact_id in cluster]
+    seq = await changes.allocate(db, owner_id, len(ids))
+    result = await db.execute(
+        contact_rows().where(Contact.owner_id == owner_id, Contact.contact_id.in_(ids)).with_for_update())
+    rows = {row.contact_id: dict(zip(CONTACT_FIELDS, row)) for row in result}
+
+    written, deleted = {}, []
+    for cluster in clusters:
+        contacts = [rows[contact_id] for contact_id in cluster if contact_id in rows]
+        if len(contacts) < 2:
+            continue
+        kept = contacts[0]["contact_id"]
+        values = merged_values(contacts)
+        if values:
+            stmt = (update(Contact)
+                    .where(Contact.owner_id == owner_id, Contact.contact_id == kept)
+                    .values(**values, **derived_columns(values), version=Contact.version + 1, change_seq=seq)
+                    .returning(*CONTACT_COLUMNS))
+            row = (await db.execute(stmt.execution_options(synchronize_session=False))).first()
+            written[kept] = row
+            search.record_change(db, kept, (row.first_name, row.last_name, row.email), owner_id)
+            seq += 1
+        for contact in contacts[1:]:
+            deleted.append((contact["contact_id"], seq))
+            seq += 1
+
+    if deleted:
+        await db.execute(delete(Contact).where(Contact.owner_id == owner_id,
+                                               Contact.contact_id.in_([contact_id for contact_id, _ in deleted])))
+        await db.execute(insert(ContactTombstone), [
+            {"owner_id": owner_id, "contact_id": contact_id, "change_seq": change_seq}
+            for contact_id, change_seq in deleted])
+        for contact_id, _ in deleted:
+            search.record_change(db, contact_id)
+        birthdays.mark_changed(db)
+    await db.commit()
+    for contact_id, row in written.items():
+        await cache.contacts.set((owner_id, contact_id), (row.version, encode_row(row)))
+    for contact_id, _ in deleted:
+        await cache.contacts.invalidate((owner_id, contact_id))
+    return len(deleted)
+
+
+async def backfill_keys(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Computes the blocking keys of contacts that have an email or phone number but no key.
+
+    Contacts are walked in id order, one transaction per batch.
+
+    Returns:
+        int: The number of contacts updated.
+    """
+    last_id, updated = 0, 0
+    stmt = (update(Contact)
+            .where(Contact.contact_id == bindparam("b_contact_id"))
+            .values(email_key=bindparam("b_email_key"), phone_key=bindparam("b_phone_key")))
+    while True:
+        async with database.SessionLocal() as db:
+            result = await db.execute(
+                select(Contact.contact_id, Contact.email, Contact.phone_number, Contact.email_key, Contact.phone_key)
+                .where(Contact.contact_id > last_id,
+                       or_(Contact.email_key.is_(None) & Contact.email.is_not(None),
+                           Contact.phone_key.is_(None) & Contact.phone_number.is_not(None)))
+                .order_by(Contact.contact_id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                return updated
+            params = []
+            for contact_id, email, phone_number, *stored in rows:
+                keys = derived_columns({"email": email, "phone_number": phone_number})
+                # Numbers too short for a key are selected again on every run; they need no update.
+                if [keys["email_key"], keys["phone_key"]] != stored:
+                    params.append({"b_contact_id": contact_id, "b_email_key": keys["email_key"],
+                                   "b_phone_key": keys["phone_key"]})
+            if params:
+                connection = await db.connection()
+                await connection.execute(stmt, params)
+                await db.commit()
+        last_id = rows[-1].contact_id
+        updated += len(params)
+
+
+async def owner_batches(owner_ids=None):
+    """Yields the ids of the users to check, OWNER_BATCH_SIZE at a time."""
+    if owner_ids:
+        yield sorted(owner_ids)
+        return
+    last_id = 0
+    while True:
+        async with database.SessionLocal() as db:
+            batch = (await db.scalars(
+                select(User.id).where(User.id > last_id).order_by(User.id).limit(OWNER_BATCH_SIZE))).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+async def run(owner_ids=None, dry_run: bool = False) -> dict:
+    """Finds, and unless `dry_run` merges, the duplicates of every user or of `owner_ids`.
+
+    Returns:
+        dict: Counts of backfilled contacts, checked users, clusters found and contacts removed.
+    """
+    stats = {"backfilled": await backfill_keys(), "owners": 0, "clusters": 0, "removed": 0}
+    async for batch in owner_batches(owner_ids):
+        for owner_id in batch:
+            stats["owners"] += 1
+            async with database.SessionLocal() as db:
+                clusters = await find_duplicates(db, owner_id)
+            if not clusters:
+                continue
+            stats["clusters"] += len(clusters)
+            logger.info("user %d: %d clusters of duplicates", owner_id, len(clusters))
+            if dry_run:
+                for cluster in clusters:
+                    print(json.dumps({"owner_id": owner_id, "contact_ids": cluster}))
+                continue
+            for start in range(0, len(clusters), MERGE_BATCH_SIZE):
+                async with database.SessionLocal() as db:
+                    stats["removed"] += await merge_duplicates(db, owner_id, clusters[start:start + MERGE_BATCH_SIZE])
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--owner", type=int, action="append", help="only check this user's contacts")
+    parser.add_argument("--dry-run", action="store_true", help="print the clusters instead of merging them")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+async def main(args) -> int:
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    database.init_engine()
+    try:
+        stats = await run(args.owner, args.dry_run)
+    finally:
+        await database.dispose_engine()
+    print(json.dumps(stats), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
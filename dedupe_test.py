@@ -0,0 +1,105 @@
+from datetime import date
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from dedupe import Clusters, find_duplicates, find_matches, merge_duplicates, merged_values, name_similarity
+from main import create_contact
+from models import Contact, ContactTombstone, User, email_key, phone_key
+from schemas import ContactCreate
+from testing import DatabaseTestCase
+
+
+class TestKeys(TestCase):
+  def test_email_key(self):
+    self.assertEqual(email_key(" John.Doe+work@Example.com "), "john.doe@example.com")
+    self.assertEqual(email_key("j.o.h.n+x@GoogleMail.com"), "john@gmail.com")
+    self.assertIsNone(email_key(""))
+    self.assertIsNone(email_key(None))
+
+  def test_phone_key(self):
+    self.assertEqual(phone_key("+380 (50) 123-45-67"), phone_key("050 123 4567"))
+    self.assertIsNone(phone_key("12-34"))
+    self.assertIsNone(phone_key(None))
+
+  def test_contact_keeps_keys_in_sync(self):
+    contact = Contact(email="A@B.com", phone_number="555 123 4567")
+    self.assertEqual((contact.email_key, contact.phone_key), ("a@b.com", "551234567"))
+
+
+class TestScoring(TestCase):
+  def test_name_similarity(self):
+    self.assertEqual(name_similarity("John", "Smith", " john ", "SMITH"), 1.0)
+    self.assertEqual(name_similarity("John", "Smith", "Smith", "John"), 1.0)
+    self.assertGreater(name_similarity("Jon", "Smith", "John", "Smith"), 0.8)
+    self.assertEqual(name_similarity("John", None, "John", "Smith"), 1.0)
+    self.assertLess(name_similarity("John", "Smith", "Anna", "Smith"), 0.3)
+    self.assertEqual(name_similarity("", None, "John", "Smith"), 0.0)
+
+  def test_clusters_are_rooted_at_the_oldest_contact(self):
+    clusters = Clusters()
+    clusters.union(5, 9)
+    clusters.union(9, 2)
+    clusters.union(7, 8)
+    self.assertEqual(clusters.groups(), [[2, 5, 9], [7, 8]])
+
+  def test_merged_values(self):
+    kept = {"first_name": "John", "last_name": "Smith", "email": "j@x.com", "phone_number": "",
+            "birthday": None, "additional_info": "friend"}
+    other = dict(kept, phone_number="5551234567", additional_info="colleague")
+    self.assertEqual(merged_values([kept, other]),
+                     {"phone_number": "5551234567", "additional_info": "friend\ncolleague"})
+    self.assertEqual(merged_values([kept, dict(kept)]), {})
+
+
+class TestDedupe(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    contacts = [
+      ("John", "Smith", "john.smith@example.com", "050 123 4567", 1),
+      ("Jon", "Smith", "John.Smith+home@example.com", "", 1),
+      ("Smith", "John", "js@other.com", "+380 50 123 45 67", 1),
+      ("Anna", "Smith", "john.smith@example.com", "", 1),
+      ("John", "Smith", "john.smith@example.com", "050 123 4567", 2),
+    ]
+    async with self.sessions() as db:
+      db.add_all([User(id=1, username="one"), User(id=2, username="two")])
+      db.add_all(Contact(first_name=first, last_name=last, email=email, phone_number=phone, owner_id=owner,
+                         additional_info=f"note {i}")
+                 for i, (first, last, email, phone, owner) in enumerate(contacts, 1))
+      await db.commit()
+
+  async def test_find_duplicates_within_blocks(self):
+    async with self.sessions() as db:
+      # Contact 4 shares the email but not the name; contact 5 belongs to someone else.
+      self.assertEqual(await find_duplicates(db, 1), [[1, 2, 3]])
+      self.assertEqual(await find_duplicates(db, 2), [])
+
+  async def test_find_matches(self):
+    async with self.sessions() as db:
+      values = {"first_name": "john", "last_name": "smith", "email": "JOHN.SMITH@example.com", "phone_number": None}
+      self.assertEqual(await find_matches(db, 1, values), [1, 2])
+      self.assertEqual(await find_matches(db, 1, dict(values, first_name="Bob", last_name="Stone")), [])
+
+  async def test_merge_duplicates(self):
+    async with self.sessions() as db:
+      self.assertEqual(await merge_duplicates(db, 1, [[1, 2, 3]]), 2)
+      remaining = (await db.scalars(select(Contact).where(Contact.owner_id == 1).order_by(Contact.contact_id))).all()
+      self.assertEqual([contact.contact_id for contact in remaining], [1, 4])
+      self.assertEqual(remaining[0].additional_info, "note 1\nnote 2\nnote 3")
+      self.assertEqual(remaining[0].version, 2)
+      tombstones = (await db.execute(select(ContactTombstone.contact_id, ContactTombstone.change_seq)
+                                     .order_by(ContactTombstone.change_seq))).all()
+      self.assertEqual([tuple(row) for row in tombstones], [(2, 2), (3, 3)])
+      self.assertEqual(remaining[0].change_seq, 1)
+
+  async def test_create_merges_into_the_match_with_one_change_number(self):
+    contact = ContactCreate(first_name="John", last_name="Smith", email="john.smith@example.com",
+                            phone_number="", birthday=date(1990, 5, 17), additional_info=None)
+    async with self.sessions() as db:
+      response = await create_contact(contact, 1, "merge", db)
+    self.assertEqual(response.headers["x-duplicate-of"], "1")
+    async with self.sessions() as db:
+      merged = await db.get(Contact, 1)
+      self.assertEqual((merged.birthday, merged.change_seq), (date(1990, 5, 17), 1))
+      self.assertEqual((await db.get(User, 1)).change_seq, 1)
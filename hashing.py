@@ -0,0 +1,106 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+
+import metrics
+from config import settings
+
+# Number of processes hashing passwords; 0 hashes in the default thread pool instead.
+HASH_WORKERS = settings.hash_workers
+# Hashing requests allowed to wait for a worker before new ones are rejected.
+HASH_QUEUE_SIZE = settings.hash_queue_size
+# bcrypt cost. Raising it makes existing hashes get upgraded on the next login.
+BCRYPT_ROUNDS = settings.bcrypt_rounds
+RETRY_AFTER_SECONDS = 1
+
+_context = None
+_executor = None
+_pending = 0
+
+
+def bcrypt_context():
+    """Returns the passlib context, importing passlib on first use.
+
+    Hashing runs in worker processes, so the web process never needs passlib
+    unless HASH_WORKERS is 0.
+    """
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+        _context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=BCRYPT_ROUNDS)
+    return _context
+
+
+def _hash(password: str) -> str:
+    return bcrypt_context().hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str):
+    return bcrypt_context().verify_and_update(password, hashed_password)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None and HASH_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return _executor
+
+
+async def _run(operation: str, func, *args):
+    global _pending
+    if _pending >= HASH_WORKERS + HASH_QUEUE_SIZE:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many concurrent logins, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    _pending += 1
+    try:
+        with metrics.bcrypt_time.time(operation):
+            return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """Hashes a password off the event loop.
+
+    Args:
+        password (str): The plain text password.
+
+    Returns:
+        str: The bcrypt hash.
+
+    Raises:
+        HTTPException: 503 if the hashing queue is full.
+    """
+    return await _run("hash", _hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    """Verifies a password off the event loop and checks if its hash is outdated.
+
+    Args:
+        password (str): The plain text password.
+        hashed_password (str): The stored hash.
+
+    Returns:
+        tuple: (valid, new_hash). new_hash is a hash with the current cost
+        parameters when the stored one must be replaced, otherwise None.
+
+    Raises:
+        HTTPException: 503 if the hashing queue is full.
+    """
+    return await _run("verify", _verify_and_update, password, hashed_password)
+
+
+def queue_depth() -> int:
+    """Returns the number of hashing requests running or waiting."""
+    return _pending
+
+
+def shutdown():
+    """Stops the worker processes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+import hashing
+
+
+class TestHashing(IsolatedAsyncioTestCase):
+  def setUp(self):
+    # The default thread pool: no worker processes to start, and blocking work can be held up.
+    patcher = patch.multiple(hashing, HASH_WORKERS=0, HASH_QUEUE_SIZE=2, BCRYPT_ROUNDS=4, _context=None,
+                             _executor=None)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def test_full_queue_is_rejected_with_503(self):
+    release = threading.Event()
+    running = [asyncio.create_task(hashing._run("hash", release.wait)) for _ in range(2)]
+    await asyncio.sleep(0)
+    self.assertEqual(hashing.queue_depth(), 2)
+    with self.assertRaises(HTTPException) as error:
+      await hashing._run("hash", release.wait)
+    self.assertEqual(error.exception.status_code, 503)
+    self.assertEqual(error.exception.headers["Retry-After"], str(hashing.RETRY_AFTER_SECONDS))
+    release.set()
+    self.assertEqual(await asyncio.gather(*running), [True, True])
+    self.assertEqual(hashing.queue_depth(), 0)
+
+  async def test_failures_free_their_slot(self):
+    with self.assertRaises(ZeroDivisionError):
+      await hashing._run("verify", lambda: 1 / 0)
+    self.assertEqual(hashing.queue_depth(), 0)
+
+  async def test_hash_and_verify(self):
+    hashed = await hashing.hash_password("secret")
+    self.assertEqual(await hashing.verify_password("secret", hashed), (True, None))
+    self.assertEqual(await hashing.verify_password("wrong", hashed), (False, None))
+    # A hash with a lower cost than BCRYPT_ROUNDS is replaced on the next login.
+    with patch.object(hashing, "BCRYPT_ROUNDS", 5), patch.object(hashing, "_context", None):
+      valid, new_hash = await hashing.verify_password("secret", hashed)
+    self.assertTrue(valid)
+    self.assertIn("$05$", new_hash)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+from models import User
+from config import settings
+import outbox
+import jwt
+
+# How long the link in a verification email stays valid.
+VERIFICATION_TOKEN_EXPIRE = timedelta(hours=24)
+
+
+def mail_config():
+    """Builds the email connection configuration.
+
+    fastapi_mail is only imported here, on startup, so that importing the
+    application stays fast.
+
+    Returns:
+        ConnectionConfig: The SMTP settings used by the outbox worker.
+    """
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME = settings.mail_username,
+        MAIL_PASSWORD = settings.mail_password,
+        MAIL_FROM = settings.mail_username,
+        MAIL_PORT= 507,
+        MAIL_SERVER="smtp.gmail.com ",
+        MAIL_FROM_NAME="Desired Name",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+    )
+
+
+async def send_email(db, email: List, instance: User):
+    """Queues an email verification message to a list of recipients.
+
+    The message is written to the outbox in the caller's transaction and is
+    delivered by the outbox worker after the caller commits.
+
+    Args:
+        db (AsyncSession): The session of the transaction creating the user.
+        email (List[EmailStr]): A list of email addresses for the recipients.
+        instance (User): The flushed User object containing user information for the email.
+    """
+    token_data = {
+        "id": instance.id,
+        "username": instance.username,
+        "exp": datetime.now(timezone.utc) + VERIFICATION_TOKEN_EXPIRE,
+    }
+    token = jwt.encode(token_data, settings.verification_secret, algorithm='HS256')
+
+    template = f"""
+        <!DOCTYPE html>
+        <html>
+            <head>
+
+            </head>
+            <body>
+                <div style = "display: flex; align-items: center; justify-content: center; flex-direction: column">
+
+                    <h3>Account Verification </hs>
+                    <br>
+
+                    <p> Thanks for choosing us, please click the button below to verify your account </p>
+
+                    <a> style= "marign-top: 1rem; padding: 1rem; border-radius: 0.5rem;
+                    front-size: 1rem; text-decoration: none; background: #0275d8; color: white;
+                    " href="http://localhost:8000/verification/?token={token}">
+                    Verify your email
+                    </a>
+
+                    <p>Please kindly ignore this email if you did not register for 
+                    us and nothing will happen. Thanks</p>
+                <div>
+            </body>
+        </html> 
+    """
+    
+    
+    outbox.enqueue(
+        db,
+        subject="Account Verification Email", 
+        recipients= email, #List of recipients
+        body= template,
+        subtype= "html",
+        dedupe_key= f"verify-user-{instance.id}",
+    )
+
@@ -0,0 +1,297 @@
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Latency buckets in seconds, the Prometheus client defaults.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Buckets for the number of queries a request runs.
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with optional labels, rendered in Prometheus text format.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labelnames (tuple): The label names; values are passed positionally.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if register:
+            _registry.append(self)
+
+    def _key(self, labels) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples()]
+        return "\n".join(lines)
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets and tracks their sum.
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets, ending with +Inf.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * len(self.buckets), 0.0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observes the time spent in the with block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels) -> int:
+        series = self._values.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def sum(self, *labels) -> float:
+        series = self._values.get(self._key(labels))
+        return series[1] if series else 0.0
+
+    def _samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket", le, cumulative
+            plain = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum", plain, total
+            yield f"{self.name}_count", plain, cumulative
+
+
+def render() -> str:
+    """Renders every registered metric in Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+http_latency = Histogram(
+    "http_request_duration_seconds", "Time spent serving HTTP requests.", ("method", "route"))
+http_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being served.", ("method",))
+request_db_queries = Histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request.", ("route",),
+    buckets=QUERY_COUNT_BUCKETS)
+request_db_time = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request.", ("route",))
+db_queries = Histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements.", ("statement",))
+bcrypt_time = Histogram(
+    "bcrypt_duration_seconds", "Time spent hashing and verifying passwords, including queueing.",
+    ("operation",))
+email_time = Histogram(
+    "email_send_duration_seconds", "Time spent delivering one email over SMTP.", ("outcome",))
+pool_gauge = Gauge(
+    "db_pool", "Live database connection pool figures.", ("figure",))
+
+
+class RequestStats:
+    """SQL work attributed to the request being served.
+
+    Attributes:
+        queries (int): Statements executed.
+        db_time (float): Seconds spent executing them.
+    """
+
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_request() -> RequestStats:
+    """Returns the stats of the request being served, or None outside a request."""
+    return _current.get()
+
+
+def _route_of(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths share one label so that scanners can't blow up the series count.
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL work of each HTTP request.
+
+    Requests are labelled by route template (e.g. /contacts/{contact_id}) rather
+    than by path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        http_in_flight.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec(method)
+            _current.reset(token)
+            route = _route_of(scope)
+            http_requests.inc(method, route, status_code)
+            http_latency.observe(elapsed, method, route)
+            request_db_queries.observe(stats.queries, route)
+            request_db_time.observe(stats.db_time, route)
+
+
+# Called as observer(conn, statement, parameters, context, executemany, elapsed)
+# after every statement, so other modules (see profiler) reuse these timers.
+statement_observers = []
+
+
+def statement_kind(statement: str) -> str:
+    """Returns the verb a SQL statement starts with, e.g. "SELECT"."""
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    db_queries.observe(elapsed, statement_kind(statement))
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    for observer in statement_observers:
+        observer(conn, statement, parameters, context, executemany, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_query_timer(context):
+    # A failed statement never reaches after_cursor_execute. ExceptionContext.cursor
+    # isn't always set, so the execution context tells whether a statement ran.
+    if context.connection is not None and context.execution_context is not None:
+        pending = context.connection.info.get("query_started")
+        if pending:
+            pending.pop()
+
+
+def update_pool(stats: dict):
+    """Copies the numeric figures of database.pool_stats() into the pool gauge."""
+    for figure, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            pool_gauge.set(value, figure)
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from metrics import Counter, Histogram
+
+
+class TestCounter(TestCase):
+  def test_render_with_labels(self):
+    counter = Counter("requests_total", "Requests.", ("route",), register=False)
+    counter.inc("/a")
+    counter.inc("/a", amount=2)
+    counter.inc('/"b"')
+    self.assertEqual(counter.render().splitlines(), [
+      "# HELP requests_total Requests.",
+      "# TYPE requests_total counter",
+      'requests_total{route="/a"} 3',
+      'requests_total{route="/\\"b\\""} 1',
+    ])
+
+  def test_label_count_is_checked(self):
+    counter = Counter("requests_total", "Requests.", ("route",), register=False)
+    with self.assertRaises(ValueError):
+      counter.inc()
+
+
+class TestHistogram(TestCase):
+  def test_buckets_are_cumulative(self):
+    histogram = Histogram("latency", "Latency.", buckets=(0.1, 1.0), register=False)
+    for value in (0.05, 0.5, 0.5, 3.0):
+      histogram.observe(value)
+    self.assertEqual(histogram.render().splitlines()[2:], [
+      'latency_bucket{le="0.1"} 1',
+      'latency_bucket{le="1.0"} 3',
+      'latency_bucket{le="+Inf"} 4',
+      "latency_sum 4.05",
+      "latency_count 4",
+    ])
+    self.assertEqual(histogram.count(), 4)
+
+  def test_time(self):
+    histogram = Histogram("latency", "Latency.", ("operation",), register=False)
+    with histogram.time("hash"):
+      pass
+    self.assertEqual(histogram.count("hash"), 1)
+    self.assertEqual(histogram.count("verify"), 0)
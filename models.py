@@ -1,14 +1,98 @@
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import (Column, Integer, BigInteger, SmallInteger, String, Text, Date, DateTime, Boolean, Index, DDL,
+                        event, func)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import validates
+
+from config import settings
 
 Base = declarative_base()
 
+# Number of hash partitions of the contacts table on Postgres; 0 keeps one plain table.
+CONTACT_PARTITIONS = settings.contact_partitions
+
+def birthday_key(birthday):
+    """Computes the month/day key stored alongside a birthday.
+
+    Args:
+        birthday (date): The birth date, or None.
+
+    Returns:
+        int: month * 100 + day (e.g. 1231 for December 31st), or None.
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+# Phone numbers are compared on their last digits, so national and international
+# forms of a number ("050 123 4567", "+380 50 123 4567") get the same key.
+PHONE_KEY_DIGITS = 9
+# Numbers with fewer digits are extensions or junk and get no key.
+PHONE_MIN_DIGITS = 7
+# Domains whose mailboxes ignore dots in the local part.
+DOTLESS_EMAIL_DOMAINS = {"gmail.com": "gmail.com", "googlemail.com": "gmail.com"}
+
+def email_key(email):
+    """Normalizes an email address for duplicate detection.
+
+    The address is lowercased and a "+tag" suffix of the local part removed;
+    Gmail addresses also lose the dots of their local part.
+
+    Args:
+        email (str): The email address, or None.
+
+    Returns:
+        str: The normalized address, or None.
+    """
+    if not email or not email.strip():
+        return None
+    local, _, domain = email.strip().lower().rpartition("@")
+    if not local:
+        return domain
+    local = local.split("+", 1)[0]
+    if domain in DOTLESS_EMAIL_DOMAINS:
+        local, domain = local.replace(".", ""), DOTLESS_EMAIL_DOMAINS[domain]
+    return f"{local}@{domain}"
+
+def phone_key(phone_number):
+    """Normalizes a phone number for duplicate detection.
+
+    Args:
+        phone_number (str): The phone number, or None.
+
+    Returns:
+        str: The last PHONE_KEY_DIGITS digits, or None for numbers with fewer than PHONE_MIN_DIGITS digits.
+    """
+    digits = "".join(char for char in phone_number or "" if char.isdigit())
+    if len(digits) < PHONE_MIN_DIGITS:
+        return None
+    return digits[-PHONE_KEY_DIGITS:]
+
+# Columns computed from other contact fields, and the field each one is computed from.
+DERIVED_COLUMNS = {"birthday_key": ("birthday", birthday_key),
+                   "email_key": ("email", email_key),
+                   "phone_key": ("phone_number", phone_key)}
+
+def derived_columns(values: dict) -> dict:
+    """Computes the derived columns of the fields present in `values`.
+
+    Statements that bypass the ORM use it to keep birthday_key, email_key and
+    phone_key in sync.
+
+    Args:
+        values (dict): Contact field values.
+
+    Returns:
+        dict: The derived column values, keyed by column name.
+    """
+    return {column: derive(values[field]) for column, (field, derive) in DERIVED_COLUMNS.items() if field in values}
+
 class Contact(Base):
     """Represents a contact stored in a database using SQLAlchemy.
 
     Attributes:
         __tablename__ (str): The name of the database table for contacts ("contacts").
         contact_id (int): The unique identifier for the contact (primary key).
+        owner_id (int): The id of the user the contact belongs to.
         first_name (str): The contact's first name.
         last_name (str): The contact's last name.
         email (str): The contact's email address.
@@ -16,14 +100,196 @@ class Contact(Base):
         birthday (date): The contact's birthday (optional).
         additional_info (str): Any additional information about the contact (optional).
         is_verified (bool): A flag indicating if the contact's email has been verified (default: False).
+        birthday_key (int): The birthday's month and day as MMDD, kept in sync with birthday.
+        email_key (str): The normalized email, kept in sync with email (see email_key()).
+        phone_key (str): The normalized phone number, kept in sync with phone_number (see phone_key()).
+        updated_at (datetime): When the contact was created or last modified.
+        version (int): Incremented on every change; used for optimistic locking (If-Match).
+        change_seq (int): The owner's change sequence number of the last change (see changes.allocate).
     """
     __tablename__ = "contacts"
 
-    contact_id = Column(Integer, primary_key=True, index=True)
+    contact_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # A partitioned table's primary key has to include the partition key.
+    owner_id = Column(Integer, nullable=False, primary_key=CONTACT_PARTITIONS > 0)
     first_name = Column(String)
     last_name = Column(String)
     email = Column(String)
     phone_number = Column(String)
     birthday = Column(Date, nullable=True)
     additional_info = Column(String, nullable=True)
-    is_verified  = Column(bool, default=False)
\ No newline at end of file
+    is_verified  = Column(Boolean, default=False)
+    birthday_key = Column(SmallInteger, nullable=True)
+    email_key = Column(String, nullable=True)
+    phone_key = Column(String(PHONE_KEY_DIGITS), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+    version = Column(Integer, nullable=False, server_default="1")
+    change_seq = Column(BigInteger, nullable=False, server_default="0")
+
+    # Contacts are identified by contact_id alone, whether or not owner_id is part of the table's key.
+    __mapper_args__ = {"version_id_col": version, "primary_key": [contact_id]}
+
+    @validates("birthday")
+    def _sync_birthday_key(self, key, value):
+        self.birthday_key = birthday_key(value)
+        return value
+
+    @validates("email")
+    def _sync_email_key(self, key, value):
+        self.email_key = email_key(value)
+        return value
+
+    @validates("phone_number")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = phone_key(value)
+        return value
+
+    __table_args__ = (
+        # Every query is scoped to one owner, so the indexes lead with owner_id:
+        # a user's page, lookup or birthday range only reads that user's slice.
+        Index("ix_contacts_owner_id_contact_id", owner_id, contact_id),
+        Index("ix_contacts_owner_id_birthday_key", owner_id, birthday_key),
+        # Serves delta syncs: a user's changes since n are one range scan.
+        Index("ix_contacts_owner_id_change_seq", owner_id, change_seq),
+        # Blocking keys of duplicate detection: candidates share one of them.
+        Index("ix_contacts_owner_id_email_key", owner_id, email_key),
+        Index("ix_contacts_owner_id_phone_key", owner_id, phone_key),
+        # B-tree indexes for exact email and prefix lookups. text_pattern_ops lets
+        # Postgres use them for LIKE 'abc%' regardless of the database collation.
+        Index("ix_contacts_owner_id_email_lower", owner_id, func.lower(email).label("email_lower"),
+              postgresql_ops={"email_lower": "text_pattern_ops"}),
+        Index("ix_contacts_owner_id_first_name_lower", owner_id, func.lower(first_name).label("first_name_lower"),
+              postgresql_ops={"first_name_lower": "text_pattern_ops"}),
+        Index("ix_contacts_owner_id_last_name_lower", owner_id, func.lower(last_name).label("last_name_lower"),
+              postgresql_ops={"last_name_lower": "text_pattern_ops"}),
+        # Trigram indexes serving ILIKE '%abc%' searches (Postgres only).
+        Index("ix_contacts_first_name_trgm", first_name, postgresql_using="gin",
+              postgresql_ops={"first_name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_contacts_last_name_trgm", last_name, postgresql_using="gin",
+              postgresql_ops={"last_name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_contacts_email_trgm", email, postgresql_using="gin",
+              postgresql_ops={"email": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        {"postgresql_partition_by": "HASH (owner_id)"} if CONTACT_PARTITIONS > 0 else {},
+    )
+
+# The trigram indexes need the pg_trgm extension.
+event.listen(
+    Contact.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+# A hash partitioned table stores nothing itself; its partitions are created with it.
+# Indexes created on the parent table are created on every partition.
+for remainder in range(CONTACT_PARTITIONS):
+    event.listen(
+        Contact.__table__,
+        "after_create",
+        DDL(f"CREATE TABLE contacts_p{remainder} PARTITION OF contacts "
+            f"FOR VALUES WITH (MODULUS {CONTACT_PARTITIONS}, REMAINDER {remainder})").execute_if(dialect="postgresql"),
+    )
+
+class User(Base):
+    """Represents an application user that can log in and receive access tokens.
+
+    Attributes:
+        __tablename__ (str): The name of the database table for users ("users").
+        id (int): The unique identifier for the user (primary key).
+        username (str): The unique login name of the user.
+        email (str): The user's email address (optional).
+        hashed_password (str): The bcrypt hash of the user's password.
+        is_verified (bool): A flag indicating if the user's email has been verified (default: False).
+        change_seq (int): The last change sequence number given to a change of the user's contacts.
+    """
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    email = Column(String, nullable=True)
+    hashed_password = Column(String)
+    is_verified = Column(Boolean, default=False)
+    change_seq = Column(BigInteger, nullable=False, server_default="0")
+
+class ContactTombstone(Base):
+    """Records the deletion of a contact, so delta syncs can report it.
+
+    Attributes:
+        __tablename__ (str): The name of the database table ("contact_tombstones").
+        id (int): The unique identifier of the tombstone (primary key).
+        owner_id (int): The id of the user the contact belonged to.
+        contact_id (int): The id of the deleted contact.
+        change_seq (int): The owner's change sequence number of the deletion.
+        deleted_at (datetime): When the contact was deleted.
+    """
+    __tablename__ = "contact_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, nullable=False)
+    contact_id = Column(Integer, nullable=False)
+    change_seq = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_contact_tombstones_owner_id_change_seq", "owner_id", "change_seq"),
+    )
+
+class RevokedToken(Base):
+    """Records a revoked access token or a revocation of all of a user's tokens.
+
+    Rows are appended only; workers read them incrementally by id.
+
+    Attributes:
+        __tablename__ (str): The name of the database table ("revoked_tokens").
+        id (int): The unique, increasing identifier of the revocation.
+        jti (str): The id of the revoked token (logout), if a single token is revoked.
+        user_id (int): The user whose token(s) are revoked.
+        revoked_before (int): For password changes, tokens issued before this Unix time in milliseconds are revoked.
+        expires_at (datetime): When the revocation stops mattering because the tokens have expired.
+    """
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(64), nullable=True, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    revoked_before = Column(BigInteger, nullable=True)
+    expires_at = Column(DateTime(timezone=True), index=True)
+
+class OutboxMessage(Base):
+    """An email waiting to be delivered by the outbox worker.
+
+    Messages are written in the same transaction as the change that triggers
+    them, so an email is sent if and only if that change was committed.
+
+    Attributes:
+        __tablename__ (str): The name of the database table ("email_outbox").
+        id (int): The unique identifier of the message (primary key).
+        dedupe_key (str): Optional key preventing the same email from being queued twice.
+        recipients (str): Comma separated recipient addresses.
+        subject (str): The email subject.
+        body (str): The email body.
+        subtype (str): "html" or "plain".
+        status (str): "pending", "sending", "sent" or "failed".
+        attempts (int): The number of delivery attempts so far.
+        next_attempt_at (datetime): When the message may be (re)tried; also the lease of a "sending" message.
+        created_at (datetime): When the message was queued.
+        sent_at (datetime): When the message was delivered.
+        last_error (str): The error of the last failed attempt.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    dedupe_key = Column(String(128), unique=True, nullable=True)
+    recipients = Column(Text)
+    subject = Column(String)
+    body = Column(Text)
+    subtype = Column(String(16), default="html")
+    status = Column(String(16), default="pending")
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
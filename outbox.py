@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import random
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import formataddr
+
+import aiosmtplib
+from sqlalchemy import select, update, func, event
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+from models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages claimed by the worker per round.
+BATCH_SIZE = 50
+# Long-lived SMTP connections kept open by the worker.
+SMTP_POOL_SIZE = 4
+# Seconds to wait for the SMTP server before an attempt counts as failed.
+SMTP_TIMEOUT = 15.0
+# Delay between polls when the outbox is empty, in seconds.
+POLL_INTERVAL = 2.0
+# How long a claimed message stays reserved for the worker that claimed it.
+SEND_LEASE = timedelta(minutes=2)
+# Retry schedule: BACKOFF_BASE * 2 ** attempts, capped at BACKOFF_MAX, with jitter.
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 3600.0
+MAX_ATTEMPTS = 8
+
+PENDING, SENDING, SENT, FAILED = "pending", "sending", "sent", "failed"
+
+queue_gauge = metrics.Gauge(
+    "email_outbox_messages", "Email outbox messages not sent yet, by status.", ("status",))
+worker_gauge = metrics.Gauge(
+    "email_outbox_worker", "Delivery counters of this worker's outbox worker.", ("counter",))
+
+
+def enqueue(db, recipients, subject: str, body: str, subtype: str = "html", dedupe_key: str = None):
+    """Adds an email to the outbox as part of the caller's transaction.
+
+    Nothing is sent until the caller commits. A message whose dedupe_key is
+    already queued is rejected by the unique constraint on commit.
+
+    Args:
+        db (AsyncSession): The session whose transaction the message joins.
+        recipients (List[str]): The recipient addresses.
+        subject (str): The email subject.
+        body (str): The email body.
+        subtype (str): "html" or "plain".
+        dedupe_key (str, optional): A key identifying this email.
+
+    Returns:
+        OutboxMessage: The queued message.
+    """
+    message = OutboxMessage(recipients=",".join(recipients), subject=subject, body=body,
+                            subtype=subtype, dedupe_key=dedupe_key, status=PENDING, attempts=0)
+    db.add(message)
+    return message
+
+
+def backoff(attempts: int) -> timedelta:
+    """Returns the delay before the next attempt after `attempts` failures."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class SMTPPool:
+    """A small pool of long-lived, authenticated SMTP connections.
+
+    Connections are opened on demand up to `size`, reused between batches and
+    dropped when a send fails, so one TLS handshake and login serve many messages.
+
+    Attributes:
+        size (int): The maximum number of open connections.
+    """
+
+    def __init__(self, conf, size: int = SMTP_POOL_SIZE):
+        self.conf = conf
+        self.size = size
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+
+    def _new_connection(self):
+        conf = self.conf
+        password = conf.MAIL_PASSWORD
+        password = password.get_secret_value() if hasattr(password, "get_secret_value") else password
+        return aiosmtplib.SMTP(
+            hostname=conf.MAIL_SERVER.strip(), port=conf.MAIL_PORT,
+            username=conf.MAIL_USERNAME if conf.USE_CREDENTIALS else None,
+            password=password if conf.USE_CREDENTIALS else None,
+            use_tls=conf.MAIL_SSL_TLS, start_tls=conf.MAIL_STARTTLS,
+            validate_certs=conf.VALIDATE_CERTS, timeout=SMTP_TIMEOUT,
+        )
+
+    async def send(self, message: EmailMessage):
+        """Sends a message over a pooled connection.
+
+        Raises:
+            aiosmtplib.SMTPException: If the message could not be sent.
+        """
+        async with self._slots:
+            smtp = self._idle.get_nowait() if not self._idle.empty() else self._new_connection()
+            started = time.perf_counter()
+            try:
+                if not smtp.is_connected:
+                    await smtp.connect()
+                await smtp.send_message(message)
+            except BaseException:
+                metrics.email_time.observe(time.perf_counter() - started, "failed")
+                smtp.close()
+                raise
+            metrics.email_time.observe(time.perf_counter() - started, "sent")
+            self._idle.put_nowait(smtp)
+
+    async def close(self):
+        """Closes every idle connection."""
+        while not self._idle.empty():
+            smtp = self._idle.get_nowait()
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+
+class OutboxStats:
+    """Delivery counters of the outbox worker."""
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class OutboxWorker:
+    """Drains the email outbox in the background.
+
+    Each round claims up to BATCH_SIZE due messages, sends them concurrently
+    over the SMTP pool and records the outcome in one transaction. Failed
+    messages are retried with exponential backoff up to MAX_ATTEMPTS times.
+    Claims are leases, so messages held by a crashed worker are picked up
+    again once SEND_LEASE has passed.
+
+    Attributes:
+        stats (OutboxStats): Delivery counters.
+    """
+
+    def __init__(self, conf, pool: SMTPPool = None):
+        self.conf = conf
+        self.pool = pool or SMTPPool(conf)
+        self.stats = OutboxStats()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._hostname = socket.gethostname()
+
+    def start(self):
+        """Starts the worker loop as a background task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the worker loop and closes the SMTP connections."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.pool.close()
+
+    def wake(self):
+        """Asks the worker to check the outbox now instead of at the next poll."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.run_once()
+            except Exception:
+                logger.exception("Outbox round failed")
+                sent = 0
+            if sent < BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _claim(self, db):
+        now = datetime.now(timezone.utc)
+        due = (
+            select(OutboxMessage.id)
+            .where(OutboxMessage.status.in_((PENDING, SENDING)), OutboxMessage.next_attempt_at <= now)
+            .order_by(OutboxMessage.next_attempt_at)
+            .limit(BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.scalars(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due.scalar_subquery()))
+            .values(status=SENDING, next_attempt_at=now + SEND_LEASE)
+            .returning(OutboxMessage)
+            .execution_options(synchronize_session=False)
+        )
+        messages = result.all()
+        await db.commit()
+        return messages
+
+    def _build(self, message: OutboxMessage) -> EmailMessage:
+        email = EmailMessage()
+        email["From"] = formataddr((self.conf.MAIL_FROM_NAME or "", str(self.conf.MAIL_FROM)))
+        email["To"] = message.recipients.replace(",", ", ")
+        email["Subject"] = message.subject
+        # A stable Message-ID lets receivers drop a duplicate if a retry resends a delivered message.
+        email["Message-ID"] = f"<outbox-{message.id}@{self._hostname}>"
+        email.set_content(message.body, subtype=message.subtype)
+        return email
+
+    async def run_once(self) -> int:
+        """Claims and sends one batch of due messages.
+
+        Returns:
+            int: The number of messages claimed.
+        """
+        async with database.SessionLocal() as db:
+            messages = await self._claim(db)
+            if not messages:
+                return 0
+            outcomes = await asyncio.gather(
+                *(self.pool.send(self._build(message)) for message in messages), return_exceptions=True)
+
+            now = datetime.now(timezone.utc)
+            for message, outcome in zip(messages, outcomes):
+                message.attempts += 1
+                if not isinstance(outcome, BaseException):
+                    message.status, message.sent_at, message.last_error = SENT, now, None
+                    self.stats.sent += 1
+                elif message.attempts >= MAX_ATTEMPTS:
+                    message.status, message.last_error = FAILED, str(outcome)
+                    self.stats.failed += 1
+                else:
+                    message.status, message.last_error = PENDING, str(outcome)
+                    message.next_attempt_at = now + backoff(message.attempts)
+                    self.stats.retried += 1
+                db.add(message)
+            await db.commit()
+            self.stats.batches += 1
+            return len(messages)
+
+
+async def queue_depth(db) -> dict:
+    """Counts outbox messages by status.
+
+    Args:
+        db (AsyncSession): The database session.
+
+    Returns:
+        dict: The number of pending, sending and failed messages.
+    """
+    result = await db.execute(
+        select(OutboxMessage.status, func.count())
+        .where(OutboxMessage.status != SENT)
+        .group_by(OutboxMessage.status)
+    )
+    depth = {PENDING: 0, SENDING: 0, FAILED: 0}
+    depth.update(dict(result.all()))
+    return depth
+
+
+async def update_metrics():
+    """Copies the queue depth and the worker's counters into the outbox gauges.
+
+    The depth keeps its last value while the database can't be reached, so
+    that /metrics still answers.
+    """
+    if worker is not None:
+        for counter, value in worker.stats.as_dict().items():
+            worker_gauge.set(value, counter)
+    try:
+        async with database.SessionLocal() as db:
+            depth = await queue_depth(db)
+    except Exception:
+        logger.warning("Could not read the outbox queue depth", exc_info=True)
+        return
+    for status, count in depth.items():
+        queue_gauge.set(count, status)
+
+
+# The worker running in this process, set by the application on startup.
+worker = None
+
+
+@event.listens_for(Session, "after_flush")
+def _note_queued_messages(session, flush_context):
+    if any(isinstance(obj, OutboxMessage) for obj in session.new):
+        session.info["outbox_queued"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_worker(session):
+    # Deliver newly committed messages right away rather than at the next poll.
+    if session.info.pop("outbox_queued", False) and worker is not None:
+        worker.wake()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_queued_messages(session, previous_transaction):
+    session.info.pop("outbox_queued", None)
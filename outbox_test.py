@@ -0,0 +1,174 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import aiosmtplib
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import outbox
+from models import OutboxMessage
+from testing import DatabaseTestCase
+
+
+class SMTPServer:
+  """A local stand-in for an SMTP server that accepts every message."""
+
+  def __init__(self):
+    self.connections = 0
+    self.messages = []
+
+  async def start(self):
+    self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+    self.port = self.server.sockets[0].getsockname()[1]
+
+  async def stop(self):
+    self.server.close()
+    await self.server.wait_closed()
+
+  async def handle(self, reader, writer):
+    self.connections += 1
+    writer.write(b"220 localhost ready\r\n")
+    while line := await reader.readline():
+      command = line[:4].upper()
+      if command == b"DATA":
+        writer.write(b"354 go ahead\r\n")
+        await writer.drain()
+        data = []
+        while (line := await reader.readline()) != b".\r\n":
+          data.append(line)
+        self.messages.append(b"".join(data))
+        writer.write(b"250 queued\r\n")
+      elif command == b"QUIT":
+        writer.write(b"221 bye\r\n")
+        break
+      else:
+        writer.write(b"250 ok\r\n")
+      await writer.drain()
+    writer.close()
+
+
+class FailingPool:
+  """An SMTP pool whose every send fails."""
+
+  async def send(self, message):
+    raise aiosmtplib.SMTPException("mailbox unavailable")
+
+  async def close(self):
+    pass
+
+
+def connection_config(port: int = 25):
+  return SimpleNamespace(
+    MAIL_SERVER="127.0.0.1", MAIL_PORT=port, MAIL_USERNAME="", MAIL_PASSWORD="", USE_CREDENTIALS=False,
+    MAIL_SSL_TLS=False, MAIL_STARTTLS=False, VALIDATE_CERTS=False,
+    MAIL_FROM="noreply@example.com", MAIL_FROM_NAME="Contacts",
+  )
+
+
+class OutboxTestCase(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    patcher = patch.object(database, "SessionLocal", self.sessions)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def enqueue(self, count: int = 1, **values):
+    async with self.sessions() as db:
+      for i in range(count):
+        outbox.enqueue(db, [f"user{i}@example.com"], "Hello", "<p>Hi</p>")
+      await db.commit()
+    if values:
+      await self.set(**values)
+
+  async def set(self, **values):
+    async with self.sessions() as db:
+      await db.execute(update(OutboxMessage).values(**values))
+      await db.commit()
+
+  async def messages(self):
+    async with self.sessions() as db:
+      return (await db.scalars(select(OutboxMessage).order_by(OutboxMessage.id))).all()
+
+
+class TestDelivery(OutboxTestCase):
+  async def test_claims_are_leases(self):
+    await self.enqueue(2)
+    worker = outbox.OutboxWorker(connection_config(), FailingPool())
+    async with self.sessions() as db:
+      claimed = await worker._claim(db)
+    self.assertEqual([message.status for message in claimed], [outbox.SENDING] * 2)
+    # Claimed messages are not handed out again while the lease holds...
+    async with self.sessions() as db:
+      self.assertEqual(await worker._claim(db), [])
+    # ...but are once it has run out, as after a worker crash.
+    await self.set(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    async with self.sessions() as db:
+      self.assertEqual(len(await worker._claim(db)), 2)
+
+  async def test_failures_back_off_until_max_attempts(self):
+    await self.enqueue()
+    worker = outbox.OutboxWorker(connection_config(), FailingPool())
+    self.assertEqual(await worker.run_once(), 1)
+    [message] = await self.messages()
+    self.assertEqual((message.status, message.attempts, message.last_error),
+                     (outbox.PENDING, 1, "mailbox unavailable"))
+    # Not due again until the backoff has passed.
+    self.assertEqual(await worker.run_once(), 0)
+
+    await self.set(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=datetime.now(timezone.utc))
+    self.assertEqual(await worker.run_once(), 1)
+    [message] = await self.messages()
+    self.assertEqual((message.status, message.attempts), (outbox.FAILED, outbox.MAX_ATTEMPTS))
+    self.assertEqual((worker.stats.retried, worker.stats.failed, worker.stats.sent), (1, 1, 0))
+
+  def test_backoff_grows_and_is_capped(self):
+    self.assertLess(outbox.backoff(1), outbox.backoff(4))
+    self.assertLessEqual(outbox.backoff(100), timedelta(seconds=outbox.BACKOFF_MAX * 1.2))
+
+  async def test_dedupe_key_is_unique(self):
+    async with self.sessions() as db:
+      outbox.enqueue(db, ["ann@example.com"], "Verify", "body", dedupe_key="verify:1")
+      await db.commit()
+      outbox.enqueue(db, ["ann@example.com"], "Verify", "body", dedupe_key="verify:1")
+      with self.assertRaises(IntegrityError):
+        await db.commit()
+    self.assertEqual(len(await self.messages()), 1)
+
+  async def test_pool_reuses_connections(self):
+    server = SMTPServer()
+    await server.start()
+    self.addAsyncCleanup(server.stop)
+    worker = outbox.OutboxWorker(connection_config(server.port), outbox.SMTPPool(connection_config(server.port), size=2))
+    for _ in range(2):
+      await self.enqueue(5)
+      self.assertEqual(await worker.run_once(), 5)
+    await worker.stop()
+
+    self.assertEqual(len(server.messages), 10)
+    self.assertLessEqual(server.connections, 2)
+    self.assertEqual({message.status for message in await self.messages()}, {outbox.SENT})
+    self.assertEqual(worker.stats.sent, 10)
+
+
+class TestWakeup(OutboxTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    self.worker = outbox.OutboxWorker(connection_config(), FailingPool())
+    patcher = patch.object(outbox, "worker", self.worker)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def test_commit_wakes_the_worker(self):
+    await self.enqueue()
+    self.assertTrue(self.worker._wakeup.is_set())
+
+  async def test_rolled_back_messages_do_not(self):
+    async with self.sessions() as db:
+      outbox.enqueue(db, ["ann@example.com"], "Hello", "body")
+      await db.flush()
+      await db.rollback()
+      await db.commit()
+    self.assertFalse(self.worker._wakeup.is_set())
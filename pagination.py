@@ -0,0 +1,63 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+
+# Page sizes for GET /contacts/. Clients may ask for less than MAX_PAGE_SIZE but
+# never more, so a single request can't pull the whole table into memory.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Number of rows fetched from the server-side cursor per round trip when streaming.
+STREAM_BATCH_SIZE = 500
+
+# Response header carrying the cursor of the next page.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def clamp_limit(limit: int) -> int:
+    """Caps a client supplied page size at MAX_PAGE_SIZE.
+
+    Args:
+        limit (int): The requested page size.
+
+    Returns:
+        int: The page size that will actually be used.
+    """
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(contact_id: int) -> str:
+    """Builds an opaque keyset cursor pointing after the given contact.
+
+    Args:
+        contact_id (int): The id of the last contact on the current page.
+
+    Returns:
+        str: A URL-safe cursor string for the next page.
+    """
+    raw = json.dumps({"after": contact_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decodes a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The opaque cursor received from the client.
+
+    Returns:
+        int: The contact id after which the next page starts.
+
+    Raises:
+        HTTPException: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if not isinstance(after, int):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return after
@@ -0,0 +1,83 @@
+import base64
+from unittest import TestCase
+from unittest.mock import patch
+
+import httpx
+from fastapi import HTTPException
+
+import main
+from auth import get_current_owner
+from database import get_db, get_read_db
+from models import Contact, User
+from pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, clamp_limit, decode_cursor, encode_cursor
+from testing import DatabaseTestCase
+
+
+class TestCursor(TestCase):
+  def test_clamp_limit(self):
+    self.assertEqual(clamp_limit(10), 10)
+    self.assertEqual(clamp_limit(MAX_PAGE_SIZE + 1), MAX_PAGE_SIZE)
+    self.assertEqual(clamp_limit(0), 1)
+
+  def test_round_trip(self):
+    for contact_id in (0, 1, 123456789):
+      cursor = encode_cursor(contact_id)
+      self.assertNotIn("=", cursor)
+      self.assertEqual(decode_cursor(cursor), contact_id)
+
+  def test_malformed_or_tampered_cursors_are_rejected(self):
+    tampered = [base64.urlsafe_b64encode(raw).decode() for raw in (b'{"after":"1"}', b'{"before":1}', b"[1]")]
+    for cursor in ["", "!!!", "bm90IGpzb24", *tampered]:
+      with self.assertRaises(HTTPException) as error:
+        decode_cursor(cursor)
+      self.assertEqual(error.exception.status_code, 400, cursor)
+
+
+class TestListing(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    async with self.sessions() as db:
+      db.add(User(id=1, username="ann"))
+      db.add_all(Contact(first_name=f"Name {i}", last_name="Lee", email=f"{i}@example.com", phone_number="555",
+                         owner_id=1) for i in range(5))
+      await db.commit()
+
+    async def get_test_db():
+      async with self.sessions() as db:
+        yield db
+
+    main.app.dependency_overrides[get_db] = get_test_db
+    main.app.dependency_overrides[get_read_db] = get_test_db
+    main.app.dependency_overrides[get_current_owner] = lambda: 1
+    # The stream opens its own session.
+    patcher = patch.object(main, "SessionLocal", self.sessions)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+  async def asyncTearDown(self):
+    await self.client.aclose()
+    main.app.dependency_overrides.clear()
+    await super().asyncTearDown()
+
+  async def test_pages_follow_the_cursor(self):
+    seen = []
+    params = {"limit": 2}
+    while True:
+      response = await self.client.get("/contacts/", params=params)
+      self.assertEqual(response.status_code, 200)
+      seen += [contact["contact_id"] for contact in response.json()]
+      if NEXT_CURSOR_HEADER not in response.headers:
+        break
+      params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
+    self.assertEqual(seen, [1, 2, 3, 4, 5])
+
+  async def test_invalid_cursor(self):
+    response = await self.client.get("/contacts/", params={"cursor": "!!!"})
+    self.assertEqual(response.status_code, 400)
+
+  async def test_stream_returns_every_contact(self):
+    with patch.object(main, "STREAM_BATCH_SIZE", 2):
+      response = await self.client.get("/contacts/", params={"stream": "true", "limit": 1})
+    self.assertEqual(response.headers["content-type"], "application/json")
+    self.assertEqual([contact["contact_id"] for contact in response.json()], [1, 2, 3, 4, 5])
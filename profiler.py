@@ -0,0 +1,236 @@
+"""SQL profiling: slow statements with their plans, repeated statements, query budgets.
+
+With SQL_PROFILE on, every statement slower than SLOW_QUERY_SECONDS is logged
+with its normalized SQL, the shape of its parameters (types, never values) and
+its plan: EXPLAIN (ANALYZE, BUFFERS) for SELECTs on Postgres, which runs the
+statement a second time, plain EXPLAIN for writes, and EXPLAIN QUERY PLAN on
+SQLite. ProfilerMiddleware also logs the statements a request ran more than
+once with identical parameters, the round trips it could have saved.
+
+Tests put a budget on a block of code, typically one request:
+    with assert_queries(3, max_time=0.05):
+        response = await client.get("/contacts/1", headers=headers)
+"""
+import collections
+import contextvars
+import logging
+import re
+from contextlib import contextmanager
+from typing import Optional
+
+import metrics
+from admission import STREAM_PATHS
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Statements that have a plan worth capturing.
+EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+SAVEPOINT = "sql_profile"
+
+# String and number literals and bind placeholders (qmark, numeric, format and pyformat).
+_VALUE = re.compile(r"'(?:[^']|'')*'|\$\d+|%\(\w+\)s|%s|\?|(?<![\w.])\d+(?:\.\d+)?\b")
+# A parenthesized list of values, e.g. an expanded IN; asyncpg adds casts to its placeholders.
+_VALUE_LIST = re.compile(r"\(\?(?:::\w+)?(?:, \?(?:::\w+)?)*\)")
+# The rows of a multi-row VALUES clause.
+_ROWS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """Reduces a statement to its shape, so that runs with other values read the same.
+
+    Whitespace is collapsed, literals and placeholders become ?, and lists of
+    them (expanded IN lists, VALUES rows) become (...).
+    """
+    sql = _WHITESPACE.sub(" ", statement).strip()
+    sql = _VALUE.sub("?", sql)
+    sql = _VALUE_LIST.sub("(...)", sql)
+    return _ROWS.sub("(...), ...", sql)
+
+
+def _type_of(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Describes bound parameters by their types, e.g. "(int, str, NoneType)", leaving the values out."""
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} x {parameter_shape(rows[0])}" if rows else "0 x ()"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {_type_of(value)}" for name, value in parameters.items()) + "}"
+    return "(" + ", ".join(_type_of(value) for value in parameters or ()) + ")"
+
+
+def explain(conn, statement: str, parameters) -> Optional[str]:
+    """Returns the plan of a statement that just ran on `conn`, or None if it has none worth capturing.
+
+    The EXPLAIN runs on a raw cursor, so it isn't profiled itself. On Postgres
+    it runs inside a savepoint: a failure must not abort the transaction of
+    the request being profiled.
+    """
+    kind = metrics.statement_kind(statement)
+    if kind not in EXPLAINED:
+        return None
+    postgres = conn.dialect.name == "postgresql"
+    if postgres:
+        analyze = settings.sql_explain_analyze and kind == "SELECT"
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    elif conn.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        if postgres:
+            cursor.execute(f"SAVEPOINT {SAVEPOINT}")
+        try:
+            cursor.execute(prefix + statement, parameters or ())
+            rows = cursor.fetchall()
+        except Exception:
+            if postgres:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT}")
+            raise
+        if postgres:
+            cursor.execute(f"RELEASE SAVEPOINT {SAVEPOINT}")
+    finally:
+        cursor.close()
+    # Postgres returns one line of the plan per row, SQLite one node per row with its detail last.
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+class Profile:
+    """The SQL statements run while profiling a request or a block of code.
+
+    Attributes:
+        label (str): What is profiled, e.g. "GET /contacts/".
+        queries (int): Statements executed.
+        db_time (float): Seconds spent executing them.
+        statements (list): (normalized SQL, seconds) of each statement, in order.
+    """
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []
+        self._runs = collections.Counter()
+        self._sql = {}
+
+    def record(self, sql: str, key, elapsed: float):
+        self.queries += 1
+        self.db_time += elapsed
+        self.statements.append((sql, elapsed))
+        self._runs[key] += 1
+        self._sql[key] = sql
+
+    def repeated(self) -> list:
+        """Returns (normalized SQL, runs) of the statements run more than once with identical parameters."""
+        return [(self._sql[key], runs) for key, runs in self._runs.items() if runs > 1]
+
+    def report(self) -> str:
+        """Lists the statements run, one per line with its time in milliseconds."""
+        return "\n".join(f"{elapsed * 1000:8.2f} ms  {sql}" for sql, elapsed in self.statements)
+
+
+_active = contextvars.ContextVar("sql_profiles", default=())
+
+
+@contextmanager
+def profile(label: str = ""):
+    """Records the statements run in the block, including those of nested profiles.
+
+    Yields:
+        Profile: The profile, complete once the block has ended.
+    """
+    current = Profile(label)
+    token = _active.set(_active.get() + (current,))
+    try:
+        yield current
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def assert_queries(max_count: int, max_time: float = None, allow_repeated: bool = False):
+    """Fails if the block goes over a query budget; meant for tests.
+
+    Args:
+        max_count (int): The number of statements the block may run.
+        max_time (float, optional): The seconds it may spend in them.
+        allow_repeated (bool): Whether it may run a statement twice with identical parameters.
+
+    Yields:
+        Profile: The profile of the block.
+
+    Raises:
+        AssertionError: On leaving the block, listing its statements, if it went over budget.
+    """
+    with profile("assert_queries") as current:
+        yield current
+    problems = []
+    if current.queries > max_count:
+        problems.append(f"{current.queries} queries, expected at most {max_count}")
+    if max_time is not None and current.db_time > max_time:
+        problems.append(f"{current.db_time:.3f}s in the database, expected at most {max_time:.3f}s")
+    if not allow_repeated:
+        problems += [f"{runs} identical runs of {sql}" for sql, runs in current.repeated()]
+    if problems:
+        raise AssertionError("; ".join(problems) + "\n" + current.report())
+
+
+def _log_slow(conn, statement, parameters, context, executemany, sql, elapsed):
+    plan = None
+    # Batches and server-side cursors aren't run a second time.
+    if not executemany and not (context is not None and context.execution_options.get("stream_results")):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as error:
+            plan = f"(no plan: {error})"
+    profiles = _active.get()
+    logger.warning("Slow query, %.1f ms (%s): %s\nparameters: %s%s", elapsed * 1000,
+                   profiles[-1].label if profiles else "outside a request", sql,
+                   parameter_shape(parameters, executemany), f"\n{plan}" if plan else "")
+
+
+def _record_statement(conn, statement, parameters, context, executemany, elapsed):
+    profiles = _active.get()
+    if not profiles and not settings.sql_profile:
+        return
+    sql = normalize(statement)
+    if profiles:
+        key = (statement, repr(parameters))
+        for current in profiles:
+            current.record(sql, key, elapsed)
+    if settings.sql_profile and elapsed >= settings.slow_query_seconds:
+        _log_slow(conn, statement, parameters, context, executemany, sql, elapsed)
+
+
+# Timed by the metrics module's cursor events.
+metrics.statement_observers.append(_record_statement)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling the SQL of each HTTP request; create_app() adds it when SQL_PROFILE is on.
+
+    Slow statements are logged as they finish, statements repeated with
+    identical parameters when the request ends. Change streams aren't
+    profiled: they run for minutes and poll by design.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in STREAM_PATHS:
+            return await self.app(scope, receive, send)
+        with profile(f"{scope['method']} {scope['path']}") as current:
+            await self.app(scope, receive, send)
+        repeated = current.repeated()
+        if repeated:
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            logger.warning("%s %s ran identical queries:\n%s", scope["method"], route,
+                           "\n".join(f"{runs} x {sql}" for sql, runs in repeated))
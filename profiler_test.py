@@ -0,0 +1,137 @@
+import logging
+import os
+import tempfile
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import text
+
+import auth
+import birthdays
+import cache
+import database
+from config import settings
+from main import create_app
+from models import Base, User
+from profiler import assert_queries, normalize, parameter_shape, profile
+from revocation import revocations
+
+CONTACT = {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+           "phone_number": "555 123 4567", "birthday": "1990-05-17", "additional_info": ""}
+
+
+class TestNormalize(TestCase):
+  def test_values_become_placeholders(self):
+    self.assertEqual(normalize("SELECT *\n  FROM contacts WHERE email = 'a''b' AND id = 42 LIMIT $1"),
+                     "SELECT * FROM contacts WHERE email = ? AND id = ? LIMIT ?")
+    self.assertEqual(normalize('SELECT "t1".x FROM t1'), 'SELECT "t1".x FROM t1')
+
+  def test_lists_collapse(self):
+    self.assertEqual(normalize("SELECT x FROM t WHERE id IN ($1::INTEGER, $2::INTEGER, $3::INTEGER)"),
+                     normalize("SELECT x FROM t WHERE id IN (?)"))
+    self.assertEqual(normalize("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)"),
+                     "INSERT INTO t (a, b) VALUES (...), ...")
+
+  def test_parameter_shape(self):
+    self.assertEqual(parameter_shape((1, "a", None, [1, 2])), "(int, str, NoneType, list[2])")
+    self.assertEqual(parameter_shape({"id": 1}), "{id: int}")
+    self.assertEqual(parameter_shape([(1, "a"), (2, "b")], executemany=True), "2 x (int, str)")
+
+
+class TestQueryBudget(IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    engine = database.init_engine(f"sqlite+aiosqlite:///{os.path.join(self.directory.name, 'db.sqlite')}")
+    async with engine.begin() as connection:
+      await connection.run_sync(Base.metadata.create_all)
+    async with database.SessionLocal() as db:
+      db.add(User(id=1, username="ann"))
+      await db.commit()
+      # A fresh revocation list isn't synced again by the requests measured.
+      await revocations.sync(db)
+    cache.contacts.clear()
+    birthdays.cache.clear()
+    token = auth.create_access_token("ann", 1, auth.ACCESS_TOKEN_EXPIRE)
+    self.headers = {"Authorization": f"Bearer {token}"}
+    self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()), base_url="http://test")
+
+  async def asyncTearDown(self):
+    await self.client.aclose()
+    await database.dispose_engine()
+    self.directory.cleanup()
+
+  async def create(self, **fields):
+    response = await self.client.post("/contacts/", json=dict(CONTACT, **fields), headers=self.headers,
+                                      params={"on_duplicate": "allow"})
+    self.assertEqual(response.status_code, 200)
+    return response.json()
+
+  async def test_contact_handlers_stay_within_budget(self):
+    # Allocating a change number, inserting the contact.
+    with assert_queries(2):
+      contact = await self.create()
+    path = f"/contacts/{contact['contact_id']}"
+
+    cache.contacts.clear()
+    with assert_queries(1):
+      response = await self.client.get(path, headers=self.headers)
+    self.assertEqual(response.status_code, 200)
+    with assert_queries(0):
+      await self.client.get(path, headers=self.headers)
+
+    with assert_queries(2):
+      response = await self.client.patch(path, json={"first_name": "Anne"}, headers=self.headers)
+    self.assertEqual(response.json()["first_name"], "Anne")
+
+    with assert_queries(2):
+      response = await self.client.get("/contacts/", headers=self.headers)
+    self.assertEqual(len(response.json()), 1)
+
+    with assert_queries(1):
+      await self.client.get("/contacts/birthday/", params={"days": 7}, headers=self.headers)
+
+    # Allocating, deleting, recording the tombstone.
+    with assert_queries(3):
+      response = await self.client.delete(path, headers=self.headers)
+    self.assertEqual(response.status_code, 200)
+
+  async def test_duplicate_check_costs_one_query(self):
+    await self.create()
+    with assert_queries(3):
+      response = await self.client.post("/contacts/", json=CONTACT, headers=self.headers)
+    self.assertIn("X-Duplicate-Of", response.headers)
+
+  async def test_over_budget_fails_with_the_statements(self):
+    with self.assertRaises(AssertionError) as failure:
+      with assert_queries(1):
+        await self.create()
+    self.assertIn("2 queries, expected at most 1", str(failure.exception))
+    self.assertIn("UPDATE users", str(failure.exception))
+
+  async def test_repeated_statements_are_flagged(self):
+    with self.assertRaises(AssertionError) as failure:
+      with assert_queries(5):
+        async with database.SessionLocal() as db:
+          await db.execute(text("SELECT 1"))
+          await db.execute(text("SELECT 1"))
+    self.assertIn("2 identical runs of SELECT ?", str(failure.exception))
+    with assert_queries(5, allow_repeated=True) as current, profile() as inner:
+      async with database.SessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
+    self.assertEqual((current.queries, inner.queries), (2, 2))
+
+  async def test_slow_statements_are_logged_with_their_plan(self):
+    contact = await self.create()
+    cache.contacts.clear()
+    with patch.object(settings, "sql_profile", True), patch.object(settings, "slow_query_seconds", 0.0):
+      transport = httpx.ASGITransport(app=create_app())
+      async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        with self.assertLogs("profiler", logging.WARNING) as logs:
+          await client.get(f"/contacts/{contact['contact_id']}", headers=self.headers)
+    slow = [line for line in logs.output if "Slow query" in line]
+    self.assertEqual(len(slow), 1)
+    self.assertIn("(GET /contacts/", slow[0])
+    self.assertIn("parameters: (int, int)", slow[0])
+    self.assertIn("SEARCH contacts USING INTEGER PRIMARY KEY", slow[0])
@@ -0,0 +1,235 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+
+from sqlalchemy import event, text
+
+import metrics
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Cookie telling the workers that a client wrote recently and must read from the primary.
+STICKY_COOKIE = "primary_until"
+# Seconds between replica health and lag checks.
+CHECK_INTERVAL = 1.0
+# Seconds a health check may take before the replica counts as down.
+CHECK_TIMEOUT = 2.0
+
+# Replication lag of a PostgreSQL standby: zero when it has replayed all the
+# WAL it received, otherwise the age of the last replayed transaction. A
+# server that isn't a standby reports zero.
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+lag_gauge = metrics.Gauge(
+    "db_replica_lag_seconds", "Replication lag of each read replica, as last measured.", ("replica",))
+healthy_gauge = metrics.Gauge(
+    "db_replica_healthy", "Whether each read replica receives reads (1) or not (0).", ("replica",))
+reads = metrics.Counter(
+    "db_read_sessions_total", "Sessions of read-only routes, by the database serving them.", ("target",))
+
+
+class Replica:
+    """A read replica and its last known state.
+
+    Attributes:
+        name (str): The replica's label in metrics and stats.
+        engine (AsyncEngine): The engine connected to it.
+        lag (float): Replication lag in seconds, or None before the first check.
+        ejected_until (float): Monotonic time until which it receives no reads.
+        failures (int): Times it was ejected since it last passed a check.
+    """
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.lag = None
+        self.ejected_until = 0.0
+        self.failures = 0
+
+    def usable(self, max_lag: float, now: float) -> bool:
+        return now >= self.ejected_until and self.lag is not None and self.lag <= max_lag
+
+    def stats(self) -> dict:
+        return {"lag": self.lag, "ejected_for": max(0.0, self.ejected_until - time.monotonic()),
+                "failures": self.failures}
+
+
+class ReplicaSet:
+    """Picks the replica a read-only session reads from.
+
+    Reads are spread round-robin over the replicas that passed their last
+    check and lag at most `max_lag` seconds behind the primary. A replica
+    whose check or connection fails is ejected for `eject_seconds`; it comes
+    back once that time has passed and a check succeeds. When no replica is
+    usable reads fall back to the primary.
+
+    Attributes:
+        replicas (List[Replica]): Every configured replica.
+        max_lag (float): The largest lag, in seconds, a replica may have and still serve reads.
+        eject_seconds (float): How long a failing replica is left out.
+    """
+
+    def __init__(self, engines, max_lag: float, eject_seconds: float):
+        self.replicas = [Replica(f"replica{i}", engine) for i, engine in enumerate(engines)]
+        self.max_lag = max_lag
+        self.eject_seconds = eject_seconds
+        self._turn = itertools.count()
+        self._task = None
+        for replica in self.replicas:
+            event.listen(replica.engine.sync_engine, "handle_error", self._on_error(replica))
+
+    def _on_error(self, replica: Replica):
+        def handle_error(context):
+            # Query errors are the application's; only lost connections say the replica is down.
+            if context.is_disconnect or context.connection is None:
+                self.eject(replica)
+        return handle_error
+
+    def choose(self):
+        """Returns the replica to read from, or None to read from the primary."""
+        now = time.monotonic()
+        usable = [replica for replica in self.replicas if replica.usable(self.max_lag, now)]
+        if not usable:
+            return None
+        return usable[next(self._turn) % len(usable)]
+
+    def eject(self, replica: Replica):
+        if replica.ejected_until <= time.monotonic():
+            replica.failures += 1
+            logger.warning("Ejecting %s for %.0fs", replica.name, self.eject_seconds)
+        replica.ejected_until = time.monotonic() + self.eject_seconds
+
+    async def check(self, replica: Replica):
+        """Measures a replica's lag, ejecting it if it can't be reached."""
+        try:
+            async with replica.engine.connect() as connection:
+                if connection.dialect.name == "postgresql":
+                    lag = await asyncio.wait_for(connection.scalar(POSTGRES_LAG_QUERY), CHECK_TIMEOUT)
+                else:
+                    # Other databases can't report lag; a working connection counts as in sync.
+                    await asyncio.wait_for(connection.execute(text("SELECT 1")), CHECK_TIMEOUT)
+                    lag = 0.0
+        except Exception as error:
+            logger.warning("Check of %s failed: %r", replica.name, error)
+            self.eject(replica)
+            return
+        replica.lag = float(lag or 0.0)
+        replica.failures = 0
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def _run(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(CHECK_INTERVAL)
+
+    def start(self):
+        """Starts checking the replicas in the background."""
+        if self._task is None and self.replicas:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stops the checks and closes the replicas' connections."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        return {replica.name: replica.stats() for replica in self.replicas}
+
+    def update_metrics(self):
+        now = time.monotonic()
+        for replica in self.replicas:
+            if replica.lag is not None:
+                lag_gauge.set(replica.lag, replica.name)
+            healthy_gauge.set(int(replica.usable(self.max_lag, now)), replica.name)
+
+
+# The replicas of this worker, created by database.init_engine() when any are configured.
+replica_set = None
+
+
+def may_predate(session, committed_at: float) -> bool:
+    """Whether a session may have read from a replica that hasn't replayed a recent write yet.
+
+    Args:
+        session: The session that read.
+        committed_at (float): Monotonic time at which the write was committed.
+    """
+    if session.info.get("replica") is None or replica_set is None:
+        return False
+    # A replica's lag was at most max_lag when it was last checked, CHECK_INTERVAL ago at most.
+    return time.monotonic() - committed_at <= replica_set.max_lag + CHECK_INTERVAL
+
+
+class _Writes:
+    __slots__ = ("committed",)
+
+    def __init__(self):
+        self.committed = False
+
+
+_writes = contextvars.ContextVar("request_writes", default=None)
+
+
+def note_write():
+    """Records that the request being served committed a write."""
+    writes = _writes.get()
+    if writes is not None:
+        writes.committed = True
+
+
+def is_sticky(cookies: dict) -> bool:
+    """Whether a client wrote recently enough that it must read from the primary."""
+    try:
+        return float(cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware keeping a client on the primary for a while after it wrote.
+
+    A response to a request that committed a write sets the primary_until
+    cookie to the time until which the client's reads must see that write.
+    Read-only routes skip the replicas and the per-worker contact and
+    birthday caches for clients presenting an unexpired cookie, so they never
+    read data older than their own last write, even from another worker.
+    """
+
+    def __init__(self, app, window: float = None):
+        self.app = app
+        self.window = settings.read_your_writes_seconds if window is None else window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or replica_set is None:
+            return await self.app(scope, receive, send)
+
+        writes = _Writes()
+        token = _writes.set(writes)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and writes.committed:
+                until = int(time.time() + self.window) + 1
+                cookie = f"{STICKY_COOKIE}={until}; Max-Age={int(self.window) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (b"set-cookie", cookie.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _writes.reset(token)
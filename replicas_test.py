@@ -0,0 +1,77 @@
+import time
+from unittest import TestCase
+
+from sqlalchemy import column, insert, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database import RoutingSession
+from replicas import Replica, ReplicaSet, STICKY_COOKIE, is_sticky
+from testing import DatabaseTestCase
+
+
+class TestReplicaSet(TestCase):
+  def replica_set(self, lags):
+    replicas = ReplicaSet([], max_lag=1.0, eject_seconds=30)
+    for i, lag in enumerate(lags):
+      replica = Replica(f"replica{i}", engine=None)
+      replica.lag = lag
+      replicas.replicas.append(replica)
+    return replicas
+
+  def test_round_robin_over_usable_replicas(self):
+    replicas = self.replica_set([0.0, 0.5, 3.0, None])
+    chosen = [replicas.choose().name for _ in range(4)]
+    self.assertEqual(sorted(chosen), ["replica0", "replica0", "replica1", "replica1"])
+
+  def test_falls_back_to_primary(self):
+    replicas = self.replica_set([0.2])
+    replicas.eject(replicas.replicas[0])
+    self.assertIsNone(replicas.choose())
+    replicas.replicas[0].ejected_until = time.monotonic() - 1
+    self.assertEqual(replicas.choose().name, "replica0")
+    replicas.replicas[0].lag = 5.0
+    self.assertIsNone(replicas.choose())
+
+  def test_sticky_cookie(self):
+    self.assertTrue(is_sticky({STICKY_COOKIE: str(time.time() + 5)}))
+    self.assertFalse(is_sticky({STICKY_COOKIE: str(time.time() - 5)}))
+    self.assertFalse(is_sticky({STICKY_COOKIE: "junk"}))
+    self.assertFalse(is_sticky({}))
+
+
+class TestRoutingSession(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    engines = []
+    for name in ("primary", "replica"):
+      engine = self.sqlite_engine(name)
+      async with engine.begin() as connection:
+        await connection.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, source TEXT)"))
+        await connection.execute(text("INSERT INTO t VALUES (1, :source)"), {"source": name})
+      engines.append(engine)
+    self.primary, replica_engine = engines
+    self.replicas = ReplicaSet([replica_engine], max_lag=1.0, eject_seconds=30)
+    await self.replicas.check_all()
+    self.sessions = async_sessionmaker(self.primary, class_=AsyncSession, sync_session_class=RoutingSession)
+
+  async def test_reads_go_to_the_replica_until_the_session_writes(self):
+    async with self.sessions() as db:
+      db.info["replica"] = self.replicas.choose()
+      self.assertEqual(await db.scalar(text("SELECT source FROM t")), "replica")
+      t = table("t", column("id"), column("source"))
+      await db.execute(insert(t).values(id=2, source="written"))
+      self.assertEqual(await db.scalar(select(t.c.source).where(t.c.id == 2)), "written")
+      await db.commit()
+    async with self.primary.connect() as connection:
+      self.assertEqual(await connection.scalar(text("SELECT count(*) FROM t")), 2)
+
+  async def test_sessions_without_a_replica_use_the_primary(self):
+    async with self.sessions() as db:
+      self.assertEqual(await db.scalar(text("SELECT source FROM t")), "primary")
+
+  async def test_unreachable_replica_is_ejected(self):
+    broken = self.sqlite_engine("missing/x")
+    replicas = ReplicaSet([broken], max_lag=1.0, eject_seconds=30)
+    await replicas.check_all()
+    self.assertEqual(replicas.replicas[0].failures, 1)
+    self.assertIsNone(replicas.choose())
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+import database
+from models import RevokedToken
+
+# How often each worker pulls revocations made by the other workers, in seconds.
+SYNC_INTERVAL = 5.0
+
+# Sizing of the Bloom filter holding revoked token ids.
+FILTER_CAPACITY = 100000
+FILTER_ERROR_RATE = 0.001
+# A rebuilt filter holds this many times the revocations still live, so it isn't full again right away.
+FILTER_HEADROOM = 2
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter over strings.
+
+    Membership tests never give false negatives; false positives happen at
+    roughly error_rate once `capacity` items have been added.
+
+    Attributes:
+        capacity (int): The number of items the filter is sized for.
+        size (int): The number of bits.
+        hashes (int): The number of hash functions.
+        count (int): The number of items added so far.
+    """
+
+    def __init__(self, capacity: int = FILTER_CAPACITY, error_rate: float = FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        """Adds an item to the filter."""
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """Per-worker view of revoked access tokens.
+
+    Revoked token ids live in a BloomFilter, and password changes in a map of
+    user id to the time (Unix milliseconds) before which that user's tokens
+    are invalid. Both are filled incrementally from the revoked_tokens table,
+    so checking a token needs no database round trip unless the filter
+    reports a possible match.
+
+    Attributes:
+        last_id (int): The highest revoked_tokens id seen so far.
+    """
+
+    def __init__(self, capacity: int = FILTER_CAPACITY, error_rate: float = FILTER_ERROR_RATE):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._filter = BloomFilter(capacity, error_rate)
+        self._revoked_before = {}
+        self._last_sync = 0.0
+        self._lock = asyncio.Lock()
+        self.last_id = 0
+
+    def _apply(self, jti, user_id, revoked_before):
+        if jti is not None:
+            self._filter.add(jti)
+        if user_id is not None and revoked_before is not None:
+            if revoked_before > self._revoked_before.get(user_id, 0):
+                self._revoked_before[user_id] = revoked_before
+
+    async def sync(self, db):
+        """Loads revocations recorded since the last sync.
+
+        When the filter is full it is rebuilt from the revocations that have
+        not expired yet, which keeps its false positive rate bounded. The new
+        filter is sized from the number of those revocations, so it isn't
+        rebuilt again on the next sync when more of them are live than the
+        configured capacity.
+
+        Args:
+            db (AsyncSession): The database session to read from.
+        """
+        rebuild = self._filter.count >= self._filter.capacity
+        stmt = select(RevokedToken.id, RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_before)
+        if rebuild:
+            stmt = stmt.where(RevokedToken.expires_at > datetime.now(timezone.utc))
+        else:
+            stmt = stmt.where(RevokedToken.id > self.last_id)
+        rows = (await db.execute(stmt.order_by(RevokedToken.id))).all()
+        if rebuild:
+            live = sum(jti is not None for _, jti, _, _ in rows)
+            self._filter = BloomFilter(max(self._capacity, live * FILTER_HEADROOM), self._error_rate)
+            self._revoked_before = {}
+        for row_id, jti, user_id, revoked_before in rows:
+            self._apply(jti, user_id, revoked_before)
+            self.last_id = max(self.last_id, row_id)
+        self._last_sync = time.monotonic()
+
+    async def maybe_sync(self):
+        """Syncs with the database if the last sync is older than SYNC_INTERVAL."""
+        if time.monotonic() - self._last_sync < SYNC_INTERVAL:
+            return
+        async with self._lock:
+            if time.monotonic() - self._last_sync < SYNC_INTERVAL:
+                return
+            async with database.SessionLocal() as db:
+                await self.sync(db)
+
+    async def is_revoked(self, claims: dict) -> bool:
+        """Checks whether the token with the given claims has been revoked.
+
+        Args:
+            claims (dict): The verified token claims (jti, id, iat).
+
+        Returns:
+            bool: True if the token must be rejected.
+        """
+        # Tokens from before iat_ms count from the start of their second.
+        issued_at = claims.get("iat_ms", claims.get("iat", 0) * 1000)
+        if issued_at < self._revoked_before.get(claims.get("id"), -1):
+            return True
+        jti = claims.get("jti")
+        if jti is None or jti not in self._filter:
+            return False
+        # Possible match: confirm it so a false positive doesn't log the user out.
+        async with database.SessionLocal() as db:
+            return await db.scalar(select(RevokedToken.id).where(RevokedToken.jti == jti).limit(1)) is not None
+
+    async def revoke_token(self, db, jti: str, user_id: int, expires_at: datetime):
+        """Revokes a single token (logout).
+
+        The revocation is added to the session; the caller commits it, and
+        this worker applies it once the commit succeeds.
+        """
+        db.add(RevokedToken(jti=jti, user_id=user_id, expires_at=expires_at))
+        db.info.setdefault("revocations", []).append((self, jti, None, None))
+
+    async def revoke_user(self, db, user_id: int, expires_at: datetime):
+        """Revokes every token issued to a user until now (password change).
+
+        Tokens issued in a later millisecond, such as the one of the next
+        login, stay valid. The revocation is added to the session; the caller
+        commits it, and this worker applies it once the commit succeeds.
+        """
+        revoked_before = time.time_ns() // 1_000_000
+        db.add(RevokedToken(user_id=user_id, revoked_before=revoked_before, expires_at=expires_at))
+        db.info.setdefault("revocations", []).append((self, None, user_id, revoked_before))
+
+
+revocations = RevocationList()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_revocations(session):
+    for revocation_list, jti, user_id, revoked_before in session.info.pop("revocations", ()):
+        revocation_list._apply(jti, user_id, revoked_before)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_revocations(session, previous_transaction):
+    session.info.pop("revocations", None)
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+from jose import jwt
+
+import auth
+from models import RevokedToken, User
+from revocation import BloomFilter, RevocationList
+from testing import DatabaseTestCase
+
+
+class TestBloomFilter(TestCase):
+  def test_no_false_negatives(self):
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+      bloom.add(f"token-{i}")
+    self.assertTrue(all(f"token-{i}" in bloom for i in range(1000)))
+    self.assertEqual(bloom.count, 1000)
+
+  def test_false_positive_rate(self):
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+      bloom.add(f"token-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    self.assertLess(false_positives, 300)
+
+
+class TestRevocationList(IsolatedAsyncioTestCase):
+  async def test_tokens_issued_before_password_change_are_revoked(self):
+    revocations = RevocationList(capacity=100)
+    revocations._apply(None, 7, 1000500)
+    self.assertTrue(await revocations.is_revoked({"id": 7, "iat": 1000, "iat_ms": 1000499, "jti": "a"}))
+    self.assertFalse(await revocations.is_revoked({"id": 7, "iat": 1000, "iat_ms": 1000500, "jti": "a"}))
+    self.assertFalse(await revocations.is_revoked({"id": 8, "iat": 999, "iat_ms": 999000, "jti": "a"}))
+    # Tokens without iat_ms count from the start of their second.
+    self.assertTrue(await revocations.is_revoked({"id": 7, "iat": 1000, "jti": "a"}))
+    self.assertFalse(await revocations.is_revoked({"id": 7, "iat": 1001, "jti": "a"}))
+
+  async def test_unknown_token_is_not_revoked(self):
+    revocations = RevocationList(capacity=100)
+    revocations._apply("revoked", None, None)
+    self.assertFalse(await revocations.is_revoked({"id": 1, "iat": 1, "jti": "not-revoked"}))
+
+
+class TestRevokeUser(DatabaseTestCase):
+  def claims(self):
+    token = auth.create_access_token("ann", 1, timedelta(minutes=5))
+    return jwt.get_unverified_claims(token)
+
+  async def test_login_right_after_a_password_change_is_accepted(self):
+    revocations = RevocationList(capacity=100)
+    old = self.claims()
+    await asyncio.sleep(0.002)
+    async with self.sessions() as db:
+      db.add(User(id=1, username="ann"))
+      await revocations.revoke_user(db, 1, datetime.now(timezone.utc) + timedelta(minutes=5))
+      await db.commit()
+    # Issued right after the change, usually within the same second.
+    new = self.claims()
+    self.assertTrue(await revocations.is_revoked(old))
+    self.assertFalse(await revocations.is_revoked(new))
+
+  async def test_rolled_back_revocations_are_not_applied(self):
+    revocations = RevocationList(capacity=100)
+    claims = self.claims()
+    async with self.sessions() as db:
+      await revocations.revoke_user(db, 1, datetime.now(timezone.utc) + timedelta(minutes=5))
+      await revocations.revoke_token(db, claims["jti"], 1, datetime.now(timezone.utc) + timedelta(minutes=5))
+      self.assertFalse(await revocations.is_revoked(claims))
+      await db.rollback()
+    self.assertFalse(await revocations.is_revoked(claims))
+
+
+class TestSync(DatabaseTestCase):
+  async def revoke(self, count, expires_in=timedelta(minutes=5)):
+    async with self.sessions() as db:
+      db.add_all(RevokedToken(jti=f"{i}-{expires_in}", user_id=1, expires_at=datetime.now(timezone.utc) + expires_in)
+                 for i in range(count))
+      await db.commit()
+
+  async def sync(self, revocations):
+    async with self.sessions() as db:
+      await revocations.sync(db)
+
+  async def test_rebuilt_filter_has_room_for_the_live_revocations(self):
+    revocations = RevocationList(capacity=4)
+    await self.revoke(10)
+    await self.revoke(3, expires_in=timedelta(minutes=-5))
+    await self.sync(revocations)
+    self.assertEqual(revocations._filter.count, 13)
+
+    # Over capacity: rebuilt without the expired ones, sized for more than the rest.
+    await self.sync(revocations)
+    rebuilt = revocations._filter
+    self.assertEqual(rebuilt.count, 10)
+    self.assertGreater(rebuilt.capacity, 10)
+    self.assertIn("0-0:05:00", rebuilt)
+
+    # Later syncs keep filling it rather than rebuilding every time.
+    await self.revoke(1, expires_in=timedelta(minutes=6))
+    await self.sync(revocations)
+    self.assertIs(revocations._filter, rebuilt)
+    self.assertEqual(rebuilt.count, 11)
@@ -0,0 +1,84 @@
+from datetime import date
+from typing import Optional
+from pydantic import BaseModel, ConfigDict
+
+# Клас моделі для Pydantic
+class ContactInDB(BaseModel):
+    """Represents a contact stored in the database.
+
+    Attributes:
+        contact_id (int): The unique identifier for the contact.
+        first_name (str): The contact's first name.
+        last_name (str): The contact's last name.
+        email (str): The contact's email address.
+        phone_number (str): The contact's phone number (optional).
+        birthday (date): The contact's birthday (optional).
+        additional_info (str): Any additional information about the contact (optional).
+        version (int): The contact's version, sent back in If-Match to update it.
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    contact_id: int
+    first_name: str
+    last_name: str
+    email: str
+    phone_number: str
+    birthday: Optional[date] 
+    additional_info: Optional[str]
+    version: int
+
+class ContactCreate(BaseModel):
+    """Represents data required to create a new contact.
+
+    Attributes:
+        first_name (str): The contact's first name.
+        last_name (str): The contact's last name.
+        email (str): The contact's email address.
+        phone_number (str): The contact's phone number (optional).
+        birthday (date): The contact's birthday (optional).
+        additional_info (str): Any additional information about the contact (optional).
+    """
+    first_name: str
+    last_name: str
+    email: str
+    phone_number: str
+    birthday: Optional[date] 
+    additional_info: Optional[str]
+
+class ContactUpdate(BaseModel):
+    """Represents data for partially updating a contact.
+
+    Attributes:
+        first_name (str): The contact's first name (optional).
+        last_name (str): The contact's last name (optional).
+        email (str): The contact's email address (optional).
+        phone_number (str): The contact's phone number (optional).
+        birthday (date): The contact's birthday (optional).
+        additional_info (str): Any additional information about the contact (optional).
+    """
+    first_name: Optional[str]
+    last_name: Optional[str]
+    email: Optional[str]
+    phone_number: Optional[str]
+    birthday: Optional[date]
+    additional_info: Optional[str]
+
+class ContactPatch(BaseModel):
+    """Represents a partial update of a contact; only the fields sent are changed.
+
+    Names, email and phone number may be omitted but not set to null.
+
+    Attributes:
+        first_name (str): The contact's first name (optional).
+        last_name (str): The contact's last name (optional).
+        email (str): The contact's email address (optional).
+        phone_number (str): The contact's phone number (optional).
+        birthday (date): The contact's birthday (optional).
+        additional_info (str): Any additional information about the contact (optional).
+    """
+    first_name: str = None
+    last_name: str = None
+    email: str = None
+    phone_number: str = None
+    birthday: Optional[date] = None
+    additional_info: Optional[str] = None
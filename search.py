@@ -0,0 +1,276 @@
+import asyncio
+import re
+from collections import defaultdict
+
+from sqlalchemy import select, or_, func, desc, bindparam, event
+from sqlalchemy.orm import Session
+
+from models import Contact
+
+# Queries shorter than this can't be served by a trigram index, so they are
+# treated as prefix searches instead.
+NGRAM_SIZE = 3
+
+# A trailing "*" asks for a prefix search explicitly ("smi*").
+PREFIX_MARKER = "*"
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+SEARCH_FIELDS = ("first_name", "last_name", "email")
+
+
+def classify(query: str):
+    """Decides which search path serves a query.
+
+    Args:
+        query (str): The raw search query.
+
+    Returns:
+        tuple: ("email" | "prefix" | "substring", normalized query).
+    """
+    term = query.strip().lower()
+    if EMAIL_RE.match(term):
+        return "email", term
+    if term.endswith(PREFIX_MARKER):
+        return "prefix", term.rstrip(PREFIX_MARKER)
+    if len(term) < NGRAM_SIZE:
+        return "prefix", term
+    return "substring", term
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def contains_clause(query: str):
+    """Builds the unranked substring filter used by list and export endpoints.
+
+    On Postgres the ILIKE predicates are served by the pg_trgm GIN indexes on
+    the contacts table.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        ColumnElement: A filter matching contacts whose first name, last name or
+        email contains the query.
+    """
+    pattern = f"%{_escape_like(query.strip())}%"
+    return or_(*(getattr(Contact, field).ilike(pattern, escape="\\") for field in SEARCH_FIELDS))
+
+
+def _prefix_clause(term: str, dialect: str):
+    lowered = (func.lower(Contact.first_name), func.lower(Contact.last_name), func.lower(Contact.email))
+    if dialect == "postgresql":
+        # Inline the pattern so the planner can use the text_pattern_ops indexes.
+        pattern = bindparam("prefix", _escape_like(term) + "%", literal_execute=True)
+        return or_(*(column.like(pattern, escape="\\") for column in lowered))
+    # A half-open range on lower(column) is a plain B-tree range scan everywhere else.
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    return or_(*((column >= term) & (column < upper) for column in lowered))
+
+
+class NgramIndex:
+    """In-process n-gram index over contact names and emails.
+
+    Used when the database has no trigram index (SQLite and test deployments).
+    Lookups intersect the posting lists of the query's n-grams, so the cost
+    depends on how selective the query is rather than on the table size.
+    Posting lists are kept per owner, so a search only touches the searching
+    user's contacts.
+
+    Attributes:
+        n (int): The n-gram length.
+        ready (bool): Whether the index has been loaded from the database.
+    """
+
+    def __init__(self, n: int = NGRAM_SIZE):
+        self.n = n
+        self.ready = False
+        self._postings = defaultdict(set)
+        self._docs = {}
+        self._lock = asyncio.Lock()
+
+    def _grams(self, text: str):
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, contact_id: int, *fields, owner_id: int = None):
+        """Indexes (or re-indexes) a contact.
+
+        Args:
+            contact_id (int): The contact's id.
+            *fields (str): The first name, last name and email of the contact.
+            owner_id (int, optional): The id of the user the contact belongs to.
+        """
+        self.discard(contact_id)
+        values = tuple((value or "").lower() for value in fields)
+        self._docs[contact_id] = (owner_id, values)
+        for value in values:
+            for gram in self._grams(value):
+                self._postings[owner_id, gram].add(contact_id)
+
+    def discard(self, contact_id: int):
+        """Removes a contact from the index if it is present.
+
+        Args:
+            contact_id (int): The contact's id.
+        """
+        doc = self._docs.pop(contact_id, None)
+        if doc is None:
+            return
+        owner_id, values = doc
+        for value in values:
+            for gram in self._grams(value):
+                postings = self._postings.get((owner_id, gram))
+                if postings is not None:
+                    postings.discard(contact_id)
+                    if not postings:
+                        del self._postings[owner_id, gram]
+
+    def reset(self):
+        """Drops the index so it is rebuilt from the database on the next search."""
+        self._postings.clear()
+        self._docs.clear()
+        self.ready = False
+
+    def search(self, term: str, limit: int, owner_id: int = None):
+        """Finds contacts containing a lower-cased term, best matches first.
+
+        A field equal to the term ranks above a field starting with it, which
+        ranks above a plain substring match. Ties are broken by contact id.
+
+        Args:
+            term (str): The lower-cased search term.
+            limit (int): The maximum number of ids to return.
+            owner_id (int, optional): Only search the contacts of this user.
+
+        Returns:
+            List[int]: The matching contact ids in rank order.
+        """
+        grams = self._grams(term)
+        if grams:
+            postings = sorted((self._postings.get((owner_id, gram), set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = [contact_id for contact_id, (owner, _) in self._docs.items() if owner == owner_id]
+
+        scored = []
+        for contact_id in candidates:
+            score = 0
+            for value in self._docs[contact_id][1]:
+                if value == term:
+                    score += 4
+                elif value.startswith(term):
+                    score += 2
+                elif term in value:
+                    score += 1
+            if score:
+                scored.append((-score, contact_id))
+        scored.sort()
+        return [contact_id for _, contact_id in scored[:limit]]
+
+    async def ensure_loaded(self, db):
+        """Builds the index from the contacts table on first use.
+
+        Args:
+            db (AsyncSession): The database session to read contacts from.
+        """
+        if self.ready:
+            return
+        async with self._lock:
+            if self.ready:
+                return
+            stmt = select(Contact.contact_id, Contact.owner_id, Contact.first_name, Contact.last_name, Contact.email)
+            result = await db.stream(stmt.execution_options(yield_per=1000))
+            async for contact_id, owner_id, first_name, last_name, email in result:
+                self.add(contact_id, first_name, last_name, email, owner_id=owner_id)
+            self.ready = True
+
+
+index = NgramIndex()
+
+
+async def search_contacts(db, query: str, limit: int, owner_id: int):
+    """Searches a user's contacts by name or email, best matches first.
+
+    Exact emails and prefix queries are answered from the (owner_id, ...)
+    B-tree indexes. Other queries use the pg_trgm indexes on Postgres, ranked
+    by word similarity, and the in-process NgramIndex everywhere else.
+
+    Args:
+        db (AsyncSession): The database session.
+        query (str): The search query.
+        limit (int): The maximum number of contacts to return.
+        owner_id (int): The id of the user whose contacts are searched.
+
+    Returns:
+        List[Contact]: The matching contacts.
+    """
+    kind, term = classify(query)
+    if not term:
+        return []
+    dialect = db.bind.dialect.name
+
+    owned = select(Contact).where(Contact.owner_id == owner_id)
+    if kind == "email":
+        stmt = owned.where(func.lower(Contact.email) == term)
+    elif kind == "prefix":
+        stmt = owned.where(_prefix_clause(term, dialect))
+    elif dialect == "postgresql":
+        rank = func.greatest(*(func.word_similarity(term, getattr(Contact, field)) for field in SEARCH_FIELDS))
+        stmt = owned.where(contains_clause(term)).order_by(desc(rank), Contact.contact_id)
+        result = await db.scalars(stmt.limit(limit))
+        return result.all()
+    else:
+        await index.ensure_loaded(db)
+        ids = index.search(term, limit, owner_id)
+        if not ids:
+            return []
+        result = await db.scalars(owned.where(Contact.contact_id.in_(ids)))
+        by_id = {contact.contact_id: contact for contact in result}
+        return [by_id[contact_id] for contact_id in ids if contact_id in by_id]
+
+    result = await db.scalars(stmt.order_by(Contact.contact_id).limit(limit))
+    return result.all()
+
+
+def record_change(session, contact_id: int, fields=None, owner_id: int = None):
+    """Queues an index update that is applied when the session commits.
+
+    ORM flushes are picked up automatically; writes issued as UPDATE or DELETE
+    statements report their changes here.
+
+    Args:
+        session (Session): The session running the write.
+        contact_id (int): The contact's id.
+        fields (tuple, optional): The new first name, last name and email, or
+            None if the contact was deleted.
+        owner_id (int, optional): The id of the user the contact belongs to.
+    """
+    # Flushed changes only reach the index once the transaction commits.
+    if index.ready:
+        session.info.setdefault("search_index_changes", []).append((contact_id, fields, owner_id))
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_index_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Contact):
+            record_change(session, obj.contact_id, (obj.first_name, obj.last_name, obj.email), obj.owner_id)
+    for obj in session.deleted:
+        if isinstance(obj, Contact):
+            record_change(session, obj.contact_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_index_changes(session):
+    for contact_id, fields, owner_id in session.info.pop("search_index_changes", ()):
+        if fields is None:
+            index.discard(contact_id)
+        else:
+            index.add(contact_id, *fields, owner_id=owner_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_index_changes(session, previous_transaction):
+    session.info.pop("search_index_changes", None)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from search import NgramIndex, classify
+
+
+class TestClassify(TestCase):
+  def test_email_query(self):
+    self.assertEqual(classify(" John.Doe@Example.com "), ("email", "john.doe@example.com"))
+
+  def test_prefix_query(self):
+    self.assertEqual(classify("smi*"), ("prefix", "smi"))
+    # Too short for a trigram lookup
+    self.assertEqual(classify("Jo"), ("prefix", "jo"))
+
+  def test_substring_query(self):
+    self.assertEqual(classify("ohn"), ("substring", "ohn"))
+
+
+class TestNgramIndex(TestCase):
+  def setUp(self):
+    self.index = NgramIndex()
+    self.index.add(1, "John", "Smith", "john@example.com")
+    self.index.add(2, "Johnny", "Walker", "jw@example.com")
+    self.index.add(3, "Anna", "Johnson", "anna@example.com")
+
+  def test_substring_match_is_ranked(self):
+    # Exact first name beats a prefix match, which beats a substring match
+    self.assertEqual(self.index.search("john", 10), [1, 2, 3])
+
+  def test_limit(self):
+    self.assertEqual(self.index.search("john", 2), [1, 2])
+
+  def test_no_match(self):
+    self.assertEqual(self.index.search("zzz", 10), [])
+
+  def test_short_term_scans_documents(self):
+    self.assertEqual(self.index.search("jw", 10), [2])
+
+  def test_reindex_and_discard(self):
+    self.index.add(1, "Jane", "Smith", "jane@example.com")
+    self.assertEqual(self.index.search("john", 10), [2, 3])
+    self.index.discard(2)
+    self.assertEqual(self.index.search("john", 10), [3])
+
+  def test_reset(self):
+    self.index.ready = True
+    self.index.reset()
+    self.assertFalse(self.index.ready)
+    self.assertEqual(self.index.search("john", 10), [])
+
+  def test_owners_are_kept_apart(self):
+    index = NgramIndex()
+    index.add(1, "John", "Smith", "john@example.com", owner_id=1)
+    index.add(2, "Johnny", "Walker", "jw@example.com", owner_id=2)
+    index.add(3, "Jo", "Smith", "jo@example.com", owner_id=2)
+    self.assertEqual(index.search("john", 10, owner_id=1), [1])
+    self.assertEqual(index.search("john", 10, owner_id=2), [2])
+    self.assertEqual(index.search("jo", 10, owner_id=1), [1])
+    index.add(1, "John", "Smith", "john@example.com", owner_id=2)
+    self.assertEqual(index.search("john", 10, owner_id=1), [])
+    self.assertEqual(index.search("john", 10, owner_id=2), [1, 2])
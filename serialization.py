@@ -0,0 +1,204 @@
+from datetime import date
+from typing import List, Optional
+
+import pydantic_core
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import select
+
+from models import Contact
+from schemas import ContactInDB
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; pydantic-core's encoder is the fallback.
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it lists are only offered as JSON.
+    msgpack = None
+
+# The fields of a contact response, in output order.
+CONTACT_FIELDS = tuple(ContactInDB.model_fields)
+CONTACT_COLUMNS = tuple(getattr(Contact, field) for field in CONTACT_FIELDS)
+
+# The representations of contact lists, negotiated through the Accept header.
+JSON = "application/json"
+# Field names once, then one array of values per field.
+COLUMNAR_JSON = "application/vnd.contacts.columnar+json"
+MSGPACK = "application/msgpack"
+MSGPACK_ALIASES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+# Suffixes telling the entity tags of the other representations apart from JSON's.
+ETAG_VARIANTS = {JSON: "", COLUMNAR_JSON: "-columnar", MSGPACK: "-msgpack"}
+# The alternatives to JSON in the OpenAPI schema of the list routes.
+LIST_RESPONSES = {200: {"content": {COLUMNAR_JSON: {}, MSGPACK: {}}}}
+
+# Built once: creating a TypeAdapter compiles its validator and serializer.
+contact_adapter = TypeAdapter(ContactInDB)
+contact_list_adapter = TypeAdapter(List[ContactInDB])
+
+
+def dumps(value) -> bytes:
+    """Encodes a value as compact JSON bytes; dates become ISO strings."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return pydantic_core.to_json(value)
+
+
+def _pack_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def packb(value) -> bytes:
+    """Encodes a value as MessagePack; dates become ISO strings, as in JSON."""
+    return msgpack.packb(value, default=_pack_default)
+
+
+def parse_accept(header: Optional[str]) -> list:
+    """Parses an Accept or Accept-Encoding header into (value, q) pairs, values lowercased.
+
+    A missing q counts as 1, an invalid one as 0 (not acceptable).
+    """
+    choices = []
+    for part in (header or "").split(","):
+        value, *params = (item.strip().lower() for item in part.split(";"))
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        choices.append((value, q))
+    return choices
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Picks the representation of a contact list from an Accept header.
+
+    The acceptable type with the highest q wins, the first one listed on a tie.
+    Without a header, or when nothing offered is acceptable, the answer is
+    JSON rather than 406, as it always was.
+
+    Args:
+        accept (str, optional): The Accept header value.
+
+    Returns:
+        str: JSON, COLUMNAR_JSON or MSGPACK (only when msgpack is installed).
+    """
+    best, best_q = JSON, 0.0
+    for media_type, q in parse_accept(accept):
+        if media_type in MSGPACK_ALIASES and msgpack is not None:
+            candidate = MSGPACK
+        elif media_type == COLUMNAR_JSON:
+            candidate = COLUMNAR_JSON
+        elif media_type in (JSON, "application/*", "*/*"):
+            candidate = JSON
+        else:
+            continue
+        if q > best_q:
+            best, best_q = candidate, q
+    return best
+
+
+class FastJSONResponse(JSONResponse):
+    """The default response class, encoding with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """A response whose content is JSON that was already encoded."""
+
+    media_type = "application/json"
+
+
+def contact_rows(stmt=None):
+    """Selects the response columns of contacts as plain rows instead of ORM objects.
+
+    Args:
+        stmt (Select, optional): A statement selecting Contact whose filters and
+            ordering are kept (default: every contact).
+
+    Returns:
+        Select: A statement returning one tuple per contact, in CONTACT_FIELDS order.
+    """
+    if stmt is None:
+        return select(*CONTACT_COLUMNS)
+    return stmt.with_only_columns(*CONTACT_COLUMNS)
+
+
+def encode_row(row) -> bytes:
+    """Encodes one row of contact_rows() as a JSON object."""
+    return dumps(dict(zip(CONTACT_FIELDS, row)))
+
+
+def encode_rows(rows, media_type: str = JSON) -> bytes:
+    """Encodes rows of contact_rows() as a list of contacts.
+
+    The columns already have the response types, so rows skip Pydantic entirely.
+
+    Args:
+        rows (Iterable): The rows.
+        media_type (str): JSON (an array of objects), COLUMNAR_JSON (one object
+            mapping each field to the list of its values) or MSGPACK (an array of maps).
+
+    Returns:
+        bytes: The encoded list.
+    """
+    if media_type == COLUMNAR_JSON:
+        rows = list(rows)
+        return dumps({field: [row[i] for row in rows] for i, field in enumerate(CONTACT_FIELDS)})
+    contacts = [dict(zip(CONTACT_FIELDS, row)) for row in rows]
+    return packb(contacts) if media_type == MSGPACK else dumps(contacts)
+
+
+async def encode_batches(batches, media_type: str = JSON):
+    """Encodes batches of contact_rows() rows as one streamed list, a chunk per batch.
+
+    JSON is one array of objects. COLUMNAR_JSON is an array holding one
+    object of column arrays per batch, like the columnar export. MSGPACK is
+    a sequence of maps, one per contact, for msgpack.Unpacker to read.
+
+    Args:
+        batches (AsyncIterable): Lists of rows, e.g. the partitions of a streamed result.
+        media_type (str): The representation (see negotiate).
+
+    Yields:
+        bytes: Chunks of the body.
+    """
+    if media_type == MSGPACK:
+        async for batch in batches:
+            yield b"".join(packb(dict(zip(CONTACT_FIELDS, row))) for row in batch)
+        return
+    prefix = b"["
+    async for batch in batches:
+        if media_type == COLUMNAR_JSON:
+            yield prefix + encode_rows(batch, COLUMNAR_JSON)
+        else:
+            # Strip the brackets of the encoded batch to splice it into one array.
+            yield prefix + encode_rows(batch)[1:-1]
+        prefix = b","
+    yield b"[]" if prefix == b"[" else b"]"
+
+
+def contact_values(contact) -> tuple:
+    """Returns the response fields of an ORM contact as a row of contact_rows()."""
+    return tuple(getattr(contact, field) for field in CONTACT_FIELDS)
+
+
+def encode_contact(contact) -> bytes:
+    """Encodes an ORM contact, validated once by the compiled adapter."""
+    return contact_adapter.dump_json(contact_adapter.validate_python(contact, from_attributes=True))
+
+
+def encode_contacts(contacts) -> bytes:
+    """Encodes ORM contacts as a JSON array, validated once by the compiled adapter."""
+    return contact_list_adapter.dump_json(contact_list_adapter.validate_python(contacts, from_attributes=True))
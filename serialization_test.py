@@ -0,0 +1,71 @@
+import json
+from datetime import date
+from unittest import TestCase, IsolatedAsyncioTestCase, skipIf
+
+from models import Contact
+from serialization import (COLUMNAR_JSON, JSON, MSGPACK, encode_batches, encode_row, encode_rows, encode_contact,
+                           encode_contacts, msgpack, negotiate, parse_accept)
+
+
+class TestEncoding(TestCase):
+  row = (7, "Anna", "Novak", "anna@example.com", "+380501112233", date(1990, 2, 28), None, 1)
+  expected = {"contact_id": 7, "first_name": "Anna", "last_name": "Novak", "email": "anna@example.com",
+              "phone_number": "+380501112233", "birthday": "1990-02-28", "additional_info": None,
+              "version": 1}
+
+  def test_rows(self):
+    self.assertEqual(json.loads(encode_row(self.row)), self.expected)
+    self.assertEqual(json.loads(encode_rows([self.row, self.row])), [self.expected, self.expected])
+    self.assertEqual(encode_rows([]), b"[]")
+
+  def test_orm_contacts_match_rows(self):
+    contact = Contact(**dict(self.expected, birthday=date(1990, 2, 28)))
+    self.assertEqual(json.loads(encode_contact(contact)), self.expected)
+    self.assertEqual(encode_contacts([contact]), encode_rows([self.row]))
+
+  def test_columnar_rows(self):
+    columns = json.loads(encode_rows([self.row, self.row], COLUMNAR_JSON))
+    self.assertEqual(list(columns), list(self.expected))
+    self.assertEqual(columns["first_name"], ["Anna", "Anna"])
+    self.assertEqual(json.loads(encode_rows([], COLUMNAR_JSON))["contact_id"], [])
+
+  @skipIf(msgpack is None, "msgpack is not installed")
+  def test_msgpack_rows(self):
+    self.assertEqual(msgpack.unpackb(encode_rows([self.row], MSGPACK)), [self.expected])
+
+
+class TestBatches(IsolatedAsyncioTestCase):
+  async def encode(self, batches, media_type):
+    async def partitions():
+      for batch in batches:
+        yield batch
+    return b"".join([chunk async for chunk in encode_batches(partitions(), media_type)])
+
+  async def test_json_and_columnar(self):
+    row = TestEncoding.row
+    self.assertEqual(await self.encode([[row], [row, row]], JSON), encode_rows([row] * 3))
+    self.assertEqual(await self.encode([], JSON), b"[]")
+    columnar = json.loads(await self.encode([[row], [row, row]], COLUMNAR_JSON))
+    self.assertEqual([batch["contact_id"] for batch in columnar], [[7], [7, 7]])
+
+  @skipIf(msgpack is None, "msgpack is not installed")
+  async def test_msgpack_is_a_sequence_of_maps(self):
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(await self.encode([[TestEncoding.row], [TestEncoding.row]], MSGPACK))
+    self.assertEqual(list(unpacker), [TestEncoding.expected] * 2)
+
+
+class TestNegotiate(TestCase):
+  def test_negotiate(self):
+    self.assertEqual(negotiate(None), JSON)
+    self.assertEqual(negotiate("text/html, */*;q=0.8"), JSON)
+    self.assertEqual(negotiate(f"application/json;q=0.5, {COLUMNAR_JSON}"), COLUMNAR_JSON)
+    self.assertEqual(negotiate(f"{COLUMNAR_JSON}, application/json"), COLUMNAR_JSON)
+    self.assertEqual(negotiate("image/png"), JSON)
+    self.assertEqual(negotiate(f"{COLUMNAR_JSON};q=0, application/json;q=0.1"), JSON)
+    if msgpack is not None:
+      self.assertEqual(negotiate("application/x-msgpack, application/json;q=0.9"), MSGPACK)
+
+  def test_parse_accept(self):
+    self.assertEqual(parse_accept("gzip;q=0.5, BR, deflate;q=x"), [("gzip", 0.5), ("br", 1.0), ("deflate", 0.0)])
+    self.assertEqual(parse_accept(""), [])
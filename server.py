@@ -0,0 +1,212 @@
+"""Production entrypoint: serves the contacts API with uvicorn.
+
+With --workers N > 1 the application is imported once by the master process
+and the workers are forked from it, so they share the loaded code instead of
+each importing it again. Every worker listens on its own SO_REUSEPORT socket
+and the kernel spreads connections between them; where SO_REUSEPORT is not
+available the workers accept from one socket bound by the master. A worker
+that dies is replaced. On SIGTERM or SIGINT the workers stop accepting
+connections and get --drain-timeout seconds to finish the requests in flight
+before they are killed.
+
+Database connections are only opened by each worker's lifespan, after the
+fork, so no worker inherits a connection of another.
+
+Usage:
+    python server.py --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+# Seconds in-flight requests get to finish on shutdown.
+DEFAULT_DRAIN_TIMEOUT = 30.0
+# Extra seconds the master waits for a draining worker before killing it.
+KILL_GRACE = 5.0
+# Seconds between checks of the workers' state.
+POLL_INTERVAL = 0.1
+# A worker dying sooner than this after it started is restarted with a delay,
+# so a broken deployment doesn't fork in a tight loop.
+MIN_WORKER_LIFETIME = 1.0
+
+logger = logging.getLogger("server")
+
+
+def bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    """Creates a listening TCP socket.
+
+    Args:
+        host (str): The address to bind.
+        port (int): The port to bind.
+        reuse_port (bool): Whether to set SO_REUSEPORT, letting several
+            processes bind the same port.
+
+    Returns:
+        socket.socket: The bound, listening socket.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+class Server(uvicorn.Server):
+    """A uvicorn server that ends the open change streams when told to exit.
+
+    Streams never finish on their own, so without this every shutdown would
+    wait out the whole drain timeout.
+    """
+
+    def handle_exit(self, sig, frame):
+        import changes
+        changes.feed.close_soon()
+        super().handle_exit(sig, frame)
+
+
+def run_worker(app, sock: socket.socket, args):
+    """Serves the application on `sock` until uvicorn is told to stop."""
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=args.log_level,
+        access_log=args.access_log,
+        timeout_graceful_shutdown=args.drain_timeout,
+    )
+    Server(config).run(sockets=[sock])
+
+
+class Master:
+    """Forks the workers, replaces the ones that die and drains them on shutdown.
+
+    Attributes:
+        app: The preloaded ASGI application.
+        args (argparse.Namespace): The command line options.
+        workers (dict): The start time of every live worker, keyed by pid.
+        stopping (bool): Whether a shutdown signal was received.
+    """
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.workers = {}
+        self.stopping = False
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        # Without SO_REUSEPORT the workers share the master's socket.
+        self.shared_socket = None if self.reuse_port else bind_socket(args.host, args.port)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                sock = self.shared_socket or bind_socket(self.args.host, self.args.port, reuse_port=True)
+                run_worker(self.app, sock, self.args)
+            except SystemExit as error:
+                # uvicorn exits with status 3 when the lifespan fails to start.
+                code = error.code if isinstance(error.code, int) else 1
+            except BaseException:
+                logger.exception("worker %d failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("draining %d workers", len(self.workers))
+        for pid in self.workers:
+            self._signal(pid, signal.SIGTERM)
+
+    def _signal(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        """Forgets exited workers; returns how many died soon after starting."""
+        early = 0
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                break
+            if pid == 0:
+                break
+            started = self.workers.pop(pid, None)
+            if started is not None and not self.stopping:
+                logger.warning("worker %d exited with status %d", pid, os.waitstatus_to_exitcode(status))
+                early += time.monotonic() - started < MIN_WORKER_LIFETIME
+        return early
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.args.workers):
+            self.spawn()
+        deadline = None
+        while self.workers:
+            time.sleep(POLL_INTERVAL)
+            early = self._reap()
+            if self.stopping:
+                if deadline is None:
+                    deadline = time.monotonic() + self.args.drain_timeout + KILL_GRACE
+                elif time.monotonic() > deadline:
+                    for pid in self.workers:
+                        logger.warning("killing worker %d, still busy after the drain timeout", pid)
+                        self._signal(pid, signal.SIGKILL)
+                    deadline = float("inf")
+                continue
+            if early:
+                time.sleep(MIN_WORKER_LIFETIME)
+            while len(self.workers) < self.args.workers and not self.stopping:
+                self.spawn()
+        return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=os.environ.get("HOST", DEFAULT_HOST))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", DEFAULT_PORT)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)),
+                        help="worker processes; more than one needs os.fork")
+    parser.add_argument("--drain-timeout", type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    return parser.parse_args(argv)
+
+
+def main(args) -> int:
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    # Loaded before forking: the workers share these modules instead of importing them each.
+    from main import app
+
+    if args.workers <= 1:
+        run_worker(app, bind_socket(args.host, args.port), args)
+        return 0
+    if not hasattr(os, "fork"):
+        print("--workers needs os.fork, which this platform lacks", file=sys.stderr)
+        return 2
+    return Master(app, args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
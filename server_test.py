@@ -0,0 +1,49 @@
+import asyncio
+import os
+import signal
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+import httpx
+
+from bench import _free_port, start_server, wait_until_ready
+from server import DEFAULT_DRAIN_TIMEOUT, parse_args
+from testing import DatabaseTestCase
+
+# Seconds a stopping server gets to exit before the test fails.
+EXIT_TIMEOUT = 20
+
+
+class TestArguments(TestCase):
+  def test_defaults_and_environment(self):
+    with patch.dict(os.environ, {"PORT": "9000", "WEB_CONCURRENCY": "3"}):
+      args = parse_args([])
+    self.assertEqual((args.port, args.workers, args.drain_timeout, args.access_log),
+                     (9000, 3, DEFAULT_DRAIN_TIMEOUT, True))
+    args = parse_args(["--workers", "2", "--drain-timeout", "1.5", "--no-access-log"])
+    self.assertEqual((args.workers, args.drain_timeout, args.access_log), (2, 1.5, False))
+
+
+class TestServer(DatabaseTestCase):
+  async def serve_and_stop(self, workers: int):
+    port = _free_port()
+    with patch.dict(os.environ, {"DATABASE_URL": str(self.engine.url)}):
+      server = start_server(port, workers)
+    self.addCleanup(lambda: server.poll() is None and server.kill())
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+      await wait_until_ready(client, server)
+      response = await client.get("/healthcheck")
+    self.assertEqual(response.json(), {"status": "ok"})
+
+    server.send_signal(signal.SIGTERM)
+    # Once it has shut down, uvicorn re-raises the signal it caught, so a lone
+    # worker exits by SIGTERM; the master exits with status 0.
+    expected = 0 if workers > 1 else -signal.SIGTERM
+    self.assertEqual(await asyncio.to_thread(server.wait, EXIT_TIMEOUT), expected)
+
+  async def test_single_worker_shuts_down_cleanly(self):
+    await self.serve_and_stop(1)
+
+  @skipUnless(hasattr(os, "fork"), "needs os.fork")
+  async def test_forked_workers_shut_down_cleanly(self):
+    await self.serve_and_stop(2)
@@ -0,0 +1,35 @@
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from models import Base
+
+
+class DatabaseTestCase(IsolatedAsyncioTestCase):
+  """Runs each test against a fresh SQLite database holding the application's schema.
+
+  Attributes:
+    engine (AsyncEngine): The engine of the database.
+    sessions (async_sessionmaker): Sessions bound to it, not expiring on commit.
+  """
+
+  async def asyncSetUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.engines = []
+    self.engine = self.sqlite_engine("db")
+    async with self.engine.begin() as connection:
+      await connection.run_sync(Base.metadata.create_all)
+    self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+  async def asyncTearDown(self):
+    for engine in self.engines:
+      await engine.dispose()
+    self.directory.cleanup()
+
+  def sqlite_engine(self, name: str):
+    """Creates an engine on an empty SQLite file of the test's directory; disposed after the test."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(self.directory.name, name)}.sqlite")
+    self.engines.append(engine)
+    return engine
@@ -0,0 +1,403 @@
+import codecs
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Request, Query, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import birthdays
+import changes
+import search
+from auth import owner_dependency
+from database import get_db, SessionLocal
+from models import Contact, DERIVED_COLUMNS, derived_columns
+from schemas import ContactCreate
+
+router = APIRouter(
+    prefix='/contacts',
+    tags=['transfer']
+)
+
+# Number of validated rows written and committed to the database at once.
+IMPORT_CHUNK_SIZE = 5000
+
+# Only the first errors are reported back; the rest are just counted.
+MAX_REPORTED_ERRORS = 1000
+
+CSV_TYPES = ("text/csv",)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+CONTACT_FIELDS = tuple(ContactCreate.model_fields)
+# COPY skips the ORM's column defaults, so every column without a server default is listed.
+COPY_COLUMNS = CONTACT_FIELDS + tuple(DERIVED_COLUMNS) + ("owner_id", "change_seq", "is_verified")
+
+# Rows fetched from the server-side cursor per round trip during an export.
+EXPORT_BATCH_SIZE = 2000
+
+EXPORT_COLUMNS = ("contact_id",) + CONTACT_FIELDS + ("updated_at",)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "columnar": ("application/x-ndjson", "columnar.ndjson"),
+}
+
+
+class RowError(BaseModel):
+    """Describes a row that could not be imported.
+
+    Attributes:
+        row (int): The 1-based number of the data row (the CSV header is not counted).
+        errors (list): The validation errors for the row.
+    """
+    row: int
+    errors: list
+
+
+class ImportReport(BaseModel):
+    """Summarizes a bulk import.
+
+    Attributes:
+        inserted (int): The number of contacts inserted.
+        failed (int): The number of rows rejected.
+        errors (List[RowError]): Details for up to MAX_REPORTED_ERRORS rejected rows.
+    """
+    inserted: int
+    failed: int
+    errors: List[RowError]
+
+
+async def iter_text(chunks):
+    """Decodes a byte stream into complete lines, chunk by chunk.
+
+    Args:
+        chunks: An async iterator of bytes.
+
+    Yields:
+        List[str]: The complete lines (with their newline) decoded from each chunk.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        cut = pending.rfind("\n") + 1
+        if cut:
+            complete, pending = pending[:cut], pending[cut:]
+            yield [line + "\n" for line in complete[:-1].split("\n")]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending]
+
+
+async def iter_csv_rows(chunks):
+    """Parses a streamed CSV body into dictionaries keyed by its header row.
+
+    Lines are only handed to the csv module once every quoted field is closed,
+    so values may contain newlines across chunk boundaries.
+
+    Args:
+        chunks: An async iterator of bytes.
+
+    Yields:
+        dict: One row, with empty optional values turned into None.
+    """
+    header = None
+    carry = []
+    in_quotes = False
+    async for lines in iter_text(chunks):
+        ready = []
+        for line in lines:
+            carry.append(line)
+            if line.count('"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                ready.extend(carry)
+                carry = []
+        for values in csv.reader(ready):
+            if not values:
+                continue
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            yield {name: (value if value != "" else None) for name, value in zip(header, values)}
+    if carry:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unterminated quoted CSV field")
+
+
+async def iter_ndjson_rows(chunks):
+    """Parses a streamed newline-delimited JSON body.
+
+    Args:
+        chunks: An async iterator of bytes.
+
+    Yields:
+        dict | Exception: One decoded object per non-empty line, or the decoding error.
+    """
+    async for lines in iter_text(chunks):
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+
+
+def copy_records(rows: List[dict], owner_id: int, first_seq: int) -> List[tuple]:
+    """Turns validated contacts into COPY records, in COPY_COLUMNS order.
+
+    Args:
+        rows (List[dict]): The dumped contacts.
+        owner_id (int): The id of the user the contacts belong to.
+        first_seq (int): The change sequence number of the first contact.
+
+    Returns:
+        List[tuple]: One record per contact.
+    """
+    # derived_columns() returns every derived column here, in DERIVED_COLUMNS order.
+    return [
+        tuple(row[field] for field in CONTACT_FIELDS)
+        + tuple(derived_columns(row).values()) + (owner_id, first_seq + i, False)
+        for i, row in enumerate(rows)
+    ]
+
+
+async def insert_contacts(db: AsyncSession, contacts: List[ContactCreate], owner_id: int):
+    """Inserts a chunk of validated contacts.
+
+    Postgres receives the rows through COPY; other databases get one batched
+    executemany INSERT. Every contact gets its own change sequence number.
+
+    Args:
+        db (AsyncSession): The database session.
+        contacts (List[ContactCreate]): The contacts to insert.
+        owner_id (int): The id of the user the contacts belong to.
+    """
+    first_seq = await changes.allocate(db, owner_id, len(contacts))
+    rows = [contact.model_dump() for contact in contacts]
+    if db.bind.dialect.name == "postgresql":
+        records = copy_records(rows, owner_id, first_seq)
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Contact.__tablename__, records=records, columns=COPY_COLUMNS)
+    else:
+        await db.execute(insert(Contact), [
+            dict(row, **derived_columns(row), owner_id=owner_id, change_seq=first_seq + i)
+            for i, row in enumerate(rows)
+        ])
+
+
+@router.post("/import", response_model=ImportReport)
+async def import_contacts(request: Request, owner_id: owner_dependency, db: AsyncSession = Depends(get_db)):
+    """Imports contacts for the authenticated user from a streamed CSV or NDJSON request body.
+
+    The body is parsed while it is being received. Rows are validated with
+    ContactCreate and inserted in chunks of IMPORT_CHUNK_SIZE. Invalid rows are
+    skipped and reported.
+
+    Each chunk is committed on its own, so the import is not atomic: if it
+    fails half way, for a malformed CSV or a dropped connection, the chunks
+    before stay imported. Writing a chunk locks the user's row to allocate
+    its change numbers (see changes.allocate), and a single transaction would
+    hold that lock, blocking the user's other writes, for the whole upload.
+
+    Args:
+        request (Request): The incoming request; its Content-Type selects the format
+            (text/csv or application/x-ndjson).
+        owner_id (int): The id of the authenticated user.
+        db (AsyncSession): The database session dependency.
+
+    Returns:
+        ImportReport: The number of inserted and rejected rows, with error details.
+
+    Raises:
+        HTTPException: If the content type is not supported or the CSV is malformed.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in CSV_TYPES:
+        rows = iter_csv_rows(request.stream())
+    elif content_type in NDJSON_TYPES:
+        rows = iter_ndjson_rows(request.stream())
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Expected text/csv or application/x-ndjson")
+
+    inserted = failed = 0
+    errors = []
+    chunk = []
+    row_number = 0
+    try:
+        async for row in rows:
+            row_number += 1
+            try:
+                if isinstance(row, Exception):
+                    row_errors = [{"type": "json_invalid", "msg": str(row)}]
+                else:
+                    chunk.append(ContactCreate.model_validate(row))
+                    row_errors = None
+            except ValidationError as e:
+                row_errors = e.errors(include_url=False, include_context=False)
+            if row_errors is not None:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(RowError(row=row_number, errors=row_errors))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await insert_contacts(db, chunk, owner_id)
+                await db.commit()
+                inserted += len(chunk)
+                chunk = []
+        if chunk:
+            await insert_contacts(db, chunk, owner_id)
+            await db.commit()
+            inserted += len(chunk)
+    finally:
+        # Bulk inserts bypass the ORM events that maintain these.
+        if inserted:
+            search.index.reset()
+            birthdays.cache.clear()
+    return ImportReport(inserted=inserted, failed=failed, errors=errors)
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_csv(batch, header: bool) -> bytes:
+    """Encodes a batch of exported rows as CSV.
+
+    Args:
+        batch (list): Rows in EXPORT_COLUMNS order.
+        header (bool): Whether to write the header line first.
+
+    Returns:
+        bytes: The encoded CSV lines.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(batch)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(batch, header: bool) -> bytes:
+    """Encodes a batch of exported rows as one JSON object per line."""
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_default) + "\n" for row in batch
+    ).encode()
+
+
+def encode_columnar(batch, header: bool) -> bytes:
+    """Encodes a batch of exported rows as a single line of column arrays.
+
+    Each line maps every column name to the list of its values in the batch,
+    so field names are written once per batch instead of once per row.
+    """
+    columns = dict(zip(EXPORT_COLUMNS, (list(values) for values in zip(*batch))))
+    return (json.dumps(columns, default=_json_default) + "\n").encode()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "columnar": encode_columnar,
+}
+
+
+def export_query(owner_id: int, updated_since: Optional[datetime] = None, birthday_month: Optional[int] = None,
+                 query: Optional[str] = None):
+    """Builds the SELECT used by the export endpoint.
+
+    Only plain columns are selected, so rows are never turned into ORM objects.
+
+    Args:
+        owner_id (int): The id of the user whose contacts are exported.
+        updated_since (datetime, optional): Only export contacts modified at or after this time.
+        birthday_month (int, optional): Only export contacts born in this month (1-12).
+        query (str, optional): Only export contacts whose name or email contains this text.
+
+    Returns:
+        Select: The statement selecting the exported columns, ordered by contact_id.
+    """
+    stmt = (select(*(getattr(Contact, column) for column in EXPORT_COLUMNS))
+            .where(Contact.owner_id == owner_id)
+            .order_by(Contact.contact_id))
+    if updated_since is not None:
+        stmt = stmt.where(Contact.updated_at >= updated_since)
+    if birthday_month is not None:
+        stmt = stmt.where(Contact.birthday_key.between(birthday_month * 100 + 1, birthday_month * 100 + 31))
+    if query:
+        stmt = stmt.where(search.contains_clause(query))
+    return stmt
+
+
+async def stream_export(stmt, fmt: str, compress: bool):
+    """Streams exported rows from a server-side cursor.
+
+    Args:
+        stmt (Select): The statement selecting the exported rows.
+        fmt (str): The output format ("csv", "ndjson" or "columnar").
+        compress (bool): Whether to gzip the output.
+
+    Yields:
+        bytes: Encoded (and optionally compressed) chunks.
+    """
+    encode = ENCODERS[fmt]
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    header = True
+    async with SessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for batch in result.partitions():
+            data = encode(batch, header)
+            header = False
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    if header and fmt == "csv":
+        # No rows: still send the header line.
+        data = encode([], header)
+        yield compressor.compress(data) if compressor is not None else data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+@router.get("/export")
+async def export_contacts(owner_id: owner_dependency,
+                          format: Literal["csv", "ndjson", "columnar"] = "csv", gzip: bool = False,
+                          updated_since: Optional[datetime] = None,
+                          birthday_month: Optional[int] = Query(None, ge=1, le=12),
+                          query: Optional[str] = None):
+    """Exports the authenticated user's contacts as a streamed file download.
+
+    Rows are read from a server-side cursor in batches and written out as they
+    arrive, so memory use does not depend on the number of contacts.
+
+    Args:
+        owner_id (int): The id of the authenticated user.
+        format (str): "csv", "ndjson", or "columnar" (one JSON line of column arrays per batch).
+        gzip (bool): If true, the file is gzip compressed.
+        updated_since (datetime, optional): Only export contacts modified at or after this time.
+        birthday_month (int, optional): Only export contacts born in this month (1-12).
+        query (str, optional): Only export contacts whose name or email contains this text.
+
+    Returns:
+        StreamingResponse: The exported file.
+    """
+    media_type, extension = EXPORT_MEDIA_TYPES[format]
+    filename = f"contacts.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    stmt = export_query(owner_id, updated_since, birthday_month, query)
+    return StreamingResponse(stream_export(stmt, format, gzip), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -0,0 +1,142 @@
+import csv
+import gzip
+import io
+import json
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+import transfer
+from models import Contact, User
+from testing import DatabaseTestCase
+from transfer import (COPY_COLUMNS, copy_records, export_query, import_contacts, iter_csv_rows, iter_ndjson_rows,
+                      stream_export)
+
+CSV = (b"first_name,last_name,email,phone_number,birthday,additional_info\n"
+       b'Ann,Lee,ann@example.com,555 123 4567,1990-05-17,"two\nlines"\n'
+       b"Bob,Stone,bob@example.com,555 765 4321,,\n"
+       b"Eve,,eve@example.com,555 000 0000,not a date,\n")
+
+
+async def chunks(data: bytes, size: int):
+  for i in range(0, len(data), size):
+    yield data[i:i + size]
+
+
+async def collect(rows):
+  return [row async for row in rows]
+
+
+class UploadRequest:
+  """The parts of a Request that import_contacts reads."""
+
+  def __init__(self, content_type: str, body: bytes, chunk_size: int = 7):
+    self.headers = {"content-type": content_type}
+    self.body = body
+    self.chunk_size = chunk_size
+
+  def stream(self):
+    return chunks(self.body, self.chunk_size)
+
+
+class TestParsing(IsolatedAsyncioTestCase):
+  async def test_csv_rows_survive_any_chunking(self):
+    expected = await collect(iter_csv_rows(chunks(CSV, len(CSV))))
+    self.assertEqual(len(expected), 3)
+    self.assertEqual(expected[0]["additional_info"], "two\nlines")
+    self.assertIsNone(expected[1]["birthday"])
+    for size in (1, 5, 16):
+      self.assertEqual(await collect(iter_csv_rows(chunks(CSV, size))), expected)
+
+  async def test_unterminated_quote_is_rejected(self):
+    with self.assertRaises(HTTPException) as error:
+      await collect(iter_csv_rows(chunks(b'first_name\n"Ann\n', 4)))
+    self.assertEqual(error.exception.status_code, 400)
+
+  async def test_ndjson_reports_bad_lines(self):
+    rows = await collect(iter_ndjson_rows(chunks(b'{"a": 1}\n\nnot json\n{"b": 2}', 3)))
+    self.assertEqual(rows[0], {"a": 1})
+    self.assertIsInstance(rows[1], ValueError)
+    self.assertEqual(rows[2], {"b": 2})
+
+
+class TestCopyRecords(TestCase):
+  def test_copy_records_fill_every_column_without_a_server_default(self):
+    # COPY bypasses the ORM, so Python-side defaults such as is_verified=False don't apply.
+    needed = {column.name for column in Contact.__table__.columns
+              if column.server_default is None and column.autoincrement is not True}
+    self.assertLessEqual(needed, set(COPY_COLUMNS))
+    row = {"first_name": "Ann", "last_name": "Lee", "email": "Ann@Example.com", "phone_number": "555 123 4567",
+           "birthday": None, "additional_info": None}
+    [record] = copy_records([row], 1, 7)
+    self.assertEqual(len(record), len(COPY_COLUMNS))
+    values = dict(zip(COPY_COLUMNS, record))
+    self.assertEqual((values["owner_id"], values["change_seq"], values["is_verified"]), (1, 7, False))
+
+
+class TestTransfer(DatabaseTestCase):
+  async def asyncSetUp(self):
+    await super().asyncSetUp()
+    async with self.sessions() as db:
+      db.add(User(id=1, username="ann"))
+      await db.commit()
+
+  async def import_body(self, content_type: str, body: bytes):
+    async with self.sessions() as db:
+      return await import_contacts(UploadRequest(content_type, body), 1, db)
+
+  async def stored(self):
+    async with self.sessions() as db:
+      result = await db.execute(select(Contact.first_name, Contact.birthday_key, Contact.change_seq)
+                                .order_by(Contact.contact_id))
+      return [tuple(row) for row in result]
+
+  async def test_import_csv(self):
+    report = await self.import_body("text/csv; charset=utf-8", CSV)
+    self.assertEqual((report.inserted, report.failed), (2, 1))
+    self.assertEqual(report.errors[0].row, 3)
+    # Derived columns and change numbers are filled in for the bulk insert.
+    self.assertEqual(await self.stored(), [("Ann", 517, 1), ("Bob", None, 2)])
+
+  async def test_import_ndjson(self):
+    contact = {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+               "phone_number": "555", "birthday": None, "additional_info": None}
+    body = (json.dumps(contact) + "\n{oops\n" + json.dumps(dict(contact, first_name="Bob")) + "\n").encode()
+    report = await self.import_body("application/x-ndjson", body)
+    self.assertEqual((report.inserted, report.failed), (2, 1))
+    self.assertEqual(report.errors[0].errors[0]["type"], "json_invalid")
+
+  async def test_unsupported_type(self):
+    with self.assertRaises(HTTPException) as error:
+      await self.import_body("application/json", b"[]")
+    self.assertEqual(error.exception.status_code, 415)
+
+  async def test_chunks_are_committed_as_they_fill(self):
+    # The import isn't atomic: chunks before a malformed row stay imported.
+    body = CSV.replace(b"Eve", b'"Eve')
+    with patch.object(transfer, "IMPORT_CHUNK_SIZE", 1), self.assertRaises(HTTPException):
+      await self.import_body("text/csv", body)
+    self.assertEqual([name for name, _, _ in await self.stored()], ["Ann", "Bob"])
+
+  async def export(self, fmt: str, compress: bool = False, **filters):
+    with patch.object(transfer, "SessionLocal", self.sessions):
+      return b"".join([chunk async for chunk in stream_export(export_query(1, **filters), fmt, compress)])
+
+  async def test_export(self):
+    await self.import_body("text/csv", CSV)
+    rows = list(csv.reader(io.StringIO((await self.export("csv")).decode())))
+    self.assertEqual(rows[0], list(transfer.EXPORT_COLUMNS))
+    self.assertEqual([row[1:3] for row in rows[1:]], [["Ann", "Lee"], ["Bob", "Stone"]])
+    self.assertEqual(rows[1][6], "two\nlines")
+
+    rows = [json.loads(line) for line in (await self.export("ndjson", birthday_month=5)).splitlines()]
+    self.assertEqual([(row["first_name"], row["birthday"]) for row in rows], [("Ann", "1990-05-17")])
+
+    columns = json.loads(gzip.decompress(await self.export("columnar", compress=True)))
+    self.assertEqual(columns["first_name"], ["Ann", "Bob"])
+
+  async def test_empty_csv_export_has_a_header(self):
+    self.assertEqual(await self.export("csv"), (",".join(transfer.EXPORT_COLUMNS) + "\n").encode())
+    self.assertEqual(await self.export("ndjson"), b"")